@@ -1,5 +1,31 @@
-const { exec } = require("child_process");
+// Sweeps the cost of every memory opcode of the tracer across memory sizes, using a
+// precompiled Go test binary of the client, e.g. built in a go-ethereum checkout with:
+//
+//   go test -c -o vm.test ./core/vm
+//
+// The binary must define a `BenchmarkOp<Name>` benchmark for each swept opcode (e.g.
+// `BenchmarkOpMstore`, `BenchmarkOpMcopy`, `BenchmarkOpKeccak256`), which takes the
+// `-memStart` flag, the offset of the access, and `-memSize`, the size of the access of
+// variable-size opcodes. By default, every memory opcode of the tracer whose benchmark
+// the binary defines is swept, except calls, contract creations and logs, whose cost is
+// dominated by the call context, state or logs the benchmarks do not set up.
+//
+// Usage:
+//
+//   node bench.js --binary <path> [--opcodes MLOAD,MCOPY] [--repetitions 5] [--jobs N]
+//     [--cores 2,3,4,5] [--start 0] [--max 104857600] [--step 102400] [--size 32]
+//     [--benchtime 1s]
+//
+// Points are run in parallel, each job pinned to its own core with taskset, so there are
+// at most as many jobs as cores, and each
+// point is repeated to estimate the 95% confidence interval of its time per operation.
+// Results are written to out/benchmark_<opcode>.csv, in the schema of
+// out/benchmark_results.csv with the mean time of the repetitions, and the confidence
+// intervals of all opcodes to out/benchmark_summary.csv.
+
+const { execFile, execFileSync } = require("child_process");
 const fs = require("fs");
+const os = require("os");
 const path = require("path");
 const cliProgress = require("cli-progress");
 
@@ -7,18 +33,126 @@ const KB = 1024;
 const MB = 1024 * KB;
 
 // Config
-const startMemory = 0;
-const maxMemory = 100 * MB;
-const step = 100 * KB;
+const defaults = {
+  binary: "",
+  opcodes: "",
+  start: 0,
+  max: 100 * MB,
+  step: 100 * KB,
+  // Size of the accesses of variable-size opcodes
+  size: 32,
+  repetitions: 5,
+  jobs: 0,
+  cores: "",
+  benchtime: "1s",
+  python: "python3",
+};
+
+// Directory of the tracer, whose configuration lists the memory opcodes
+const tracerPath = path.join(__dirname, "..", "memory-tracer");
+
+const outPath = path.join(__dirname, "out");
+
+// Opcodes left out of the default sweep: CALL*, CREATE* and LOG*
+const unbenchmarkedOpcodes = /^(LOG\d|CREATE2?|(DELEGATE|STATIC)?CALL(CODE)?)$/;
+
+// Two-sided 97.5% quantiles of Student's t-distribution, by degrees of freedom
+const tQuantiles = [
+  12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179,
+  2.16, 2.145, 2.131, 2.12, 2.11, 2.101, 2.093, 2.086, 2.08, 2.074, 2.069, 2.064, 2.06,
+  2.056, 2.052, 2.048, 2.045, 2.042,
+];
+
+// Function to parse the command-line options, given as `--name value`
+const parseOptions = (argv) => {
+  const options = { ...defaults };
+  for (let index = 0; index < argv.length; index += 2) {
+    const name = argv[index].replace(/^--/, "");
+    if (!(name in defaults) || index + 1 >= argv.length) {
+      throw new Error(`Unknown or incomplete option ${argv[index]}`);
+    }
+    const value = argv[index + 1];
+    options[name] = typeof defaults[name] === "number" ? Number(value) : value;
+  }
+  if (!options.binary) {
+    throw new Error("The path of the Go test binary is required (--binary)");
+  }
+  return options;
+};
+
+// Function to read the memory opcodes from the configuration of the tracer
+const loadInstructions = (python) => {
+  const output = execFileSync(
+    python,
+    [
+      "-c",
+      "import json; from tracer.config import INSTRUCTIONS; print(json.dumps(INSTRUCTIONS))",
+    ],
+    { cwd: tracerPath }
+  );
+  return JSON.parse(output);
+};
 
-// Path to the Go benchmark executable
-const goTestPath = "";
+// Function to get the name of the Go benchmark of an opcode, e.g. BenchmarkOpMstore
+const getBenchmarkName = (opcode) =>
+  `BenchmarkOp${opcode.charAt(0)}${opcode.slice(1).toLowerCase()}`;
+
+// Function to list the opcode benchmarks defined by the Go test binary
+const listBenchmarks = (binary) => {
+  const output = execFileSync(binary, ["-test.list", "^BenchmarkOp"], { encoding: "utf8" });
+  return new Set(output.split("\n").map((line) => line.trim()));
+};
+
+// Function to get the cores jobs are pinned to, one distinct core per job
+const getCores = (options) => {
+  if (options.cores) {
+    const cores = options.cores.split(",").map(Number);
+    if (new Set(cores).size !== cores.length) {
+      throw new Error(`Cores ${options.cores} would pin several jobs to the same core`);
+    }
+    return cores;
+  }
+  const cpus = os.cpus().length;
+  if (options.jobs > cpus) {
+    throw new Error(`${options.jobs} jobs would pin several jobs to one of the ${cpus} cores`);
+  }
+  const count = options.jobs || Math.max(cpus - 1, 1);
+  return Array.from({ length: count }, (_, index) => index);
+};
+
+// Function to check whether jobs can be pinned to cores
+const canPin = () => {
+  try {
+    execFileSync("taskset", ["-V"], { stdio: "ignore" });
+    return true;
+  } catch (error) {
+    return false;
+  }
+};
+
+// Function to run the repetitions of the benchmark of a point and return its output
+const runBenchmark = (options, point, core, pin) => {
+  const args = [
+    `-test.run=^$`,
+    `-test.bench=^${point.benchmark}$`,
+    `-test.count=${options.repetitions}`,
+    `-test.benchtime=${options.benchtime}`,
+    `-test.cpu=1`,
+    `-memStart=${point.memStart}`,
+  ];
+  if (point.variable) {
+    args.push(`-memSize=${point.size}`);
+  }
+  const [file, fileArgs] = pin
+    ? ["taskset", ["-c", String(core), options.binary, ...args]]
+    : [options.binary, args];
 
-// Function to run the benchmark and return the result
-const runBenchmark = (memStart) => {
   return new Promise((resolve, reject) => {
-    exec(
-      `go test -bench=BenchmarkOpMstore -memStart=${memStart} ${goTestPath}`,
+    execFile(
+      file,
+      fileArgs,
+      // The benchmark runs on the core it is pinned to only
+      { env: { ...process.env, GOMAXPROCS: "1" }, maxBuffer: 16 * MB },
       (error, stdout, stderr) => {
         if (error) {
           return reject(`Error: ${stderr || error.message}`);
@@ -29,76 +163,177 @@ const runBenchmark = (memStart) => {
   });
 };
 
-// Function to parse benchmark results
-const parseResults = (output, memStart) => {
-  const lines = output.split("\n");
-  const resultLines = lines.filter((line) =>
-    line.includes("BenchmarkOpMstore")
-  );
+// Function to parse benchmark results, one per repetition
+const parseResults = (output, benchmark) => {
+  const pattern = new RegExp(`^${benchmark}(-\\d+)?\\s+(\\d+)\\s+([\\d.]+) ns/op`);
+  return output
+    .split("\n")
+    .map((line) => line.match(pattern))
+    .filter((match) => match)
+    .map((match) => ({
+      iterations: parseInt(match[2]),
+      nsPerOp: parseFloat(match[3]),
+    }));
+};
 
-  return resultLines.map((line) => {
-    const parts = line.split(/\s+/);
-    return {
-      memory: memStart,
-      iterations: parseInt(parts[1]),
-      nsPerOp: parseFloat(parts[2]),
-    };
-  });
+// Function to summarize the repetitions of a point with the mean time per operation and
+// its 95% confidence interval
+const summarize = (results) => {
+  const count = results.length;
+  const mean = results.reduce((sum, result) => sum + result.nsPerOp, 0) / count;
+  const variance =
+    count > 1
+      ? results.reduce((sum, result) => sum + (result.nsPerOp - mean) ** 2, 0) / (count - 1)
+      : 0;
+  const t = count > 1 ? tQuantiles[Math.min(count - 1, tQuantiles.length) - 1] : 0;
+  const halfWidth = (t * Math.sqrt(variance)) / Math.sqrt(count);
+  return {
+    repetitions: count,
+    iterations: results.reduce((sum, result) => sum + result.iterations, 0),
+    nsPerOp: mean,
+    ciLow: mean - halfWidth,
+    ciHigh: mean + halfWidth,
+  };
+};
+
+// Function to list the points of the sweep of every opcode
+const getPoints = (options, instructions, benchmarks) => {
+  const opcodes = options.opcodes
+    ? options.opcodes.split(",").map((opcode) => opcode.trim().toUpperCase())
+    : Object.keys(instructions).filter(
+        (opcode) =>
+          !unbenchmarkedOpcodes.test(opcode) && benchmarks.has(getBenchmarkName(opcode))
+      );
+  if (!opcodes.length) {
+    throw new Error(`${options.binary} defines no benchmark of a memory opcode`);
+  }
+
+  const points = [];
+  for (const opcode of opcodes) {
+    const instruction = instructions[opcode];
+    if (!instruction) {
+      throw new Error(`${opcode} is not a memory opcode of the tracer`);
+    }
+    if (!benchmarks.has(getBenchmarkName(opcode))) {
+      throw new Error(`${options.binary} does not define ${getBenchmarkName(opcode)}`);
+    }
+    const variable = instruction.access_size === "variable";
+    for (let memStart = options.start; memStart <= options.max; memStart += options.step) {
+      points.push({
+        opcode,
+        benchmark: getBenchmarkName(opcode),
+        memStart,
+        variable,
+        size: variable ? options.size : instruction.size,
+      });
+    }
+  }
+  return points;
+};
+
+// Function to write the results of an opcode, in the schema of benchmark_results.csv
+const writeOpcodeResults = (opcode, points) => {
+  const lines = ["offset,memory_size, iterations,nsPerOp"];
+  for (const point of points) {
+    if (point.summary) {
+      const { iterations, nsPerOp } = point.summary;
+      lines.push(
+        `${point.memStart},${point.memStart + point.size},${iterations},${nsPerOp.toFixed(2)}`
+      );
+    }
+  }
+  const fileName = path.join(outPath, `benchmark_${opcode.toLowerCase()}.csv`);
+  fs.writeFileSync(fileName, lines.join("\n") + "\n");
 };
 
 // Main function to execute benchmarks and save results
 const main = async () => {
-  const totalIterations = Math.ceil((maxMemory - startMemory) / step) + 1;
+  const options = parseOptions(process.argv.slice(2));
+  const cores = getCores(options);
+  const points = getPoints(
+    options,
+    loadInstructions(options.python),
+    listBenchmarks(options.binary)
+  );
+  const pin = canPin();
+  if (!pin) {
+    console.warn("taskset is not available, benchmarks are not pinned to cores");
+  }
+
+  // Number of points left for each opcode, whose results are written once it reaches 0
+  const remaining = {};
+  points.forEach((point) => (remaining[point.opcode] = (remaining[point.opcode] || 0) + 1));
 
   // Create a new progress bar instance and use shades_classic theme
   const progressBar = new cliProgress.SingleBar(
     {
       format:
-        "Benchmark Progress |{bar}| {percentage}% || {value}/{total} MemStart={memStart}",
-      barCompleteChar: "\u2588",
-      barIncompleteChar: "\u2591",
+        "Benchmark Progress |{bar}| {percentage}% || {value}/{total} {opcode} MemStart={memStart}",
+      barCompleteChar: "█",
+      barIncompleteChar: "░",
       hideCursor: true,
     },
     cliProgress.Presets.shades_classic
   );
+  progressBar.start(points.length, 0, { opcode: "", memStart: "" });
 
-  progressBar.start(totalIterations, 0);
+  let next = 0;
+  let completed = 0;
 
-  // Create a writable stream to write to CSV file incrementally
-  const csvStream = fs.createWriteStream(
-    path.join(__dirname, "out/benchmark_results.csv")
-  );
-  csvStream.write("offset,memory_size, iterations,nsPerOp\n"); // Write the header
-
-  for (
-    let memStart = startMemory, index = 0;
-    memStart <= maxMemory;
-    memStart += step, index++
-  ) {
-    console.log(`Running benchmark with memStart=${memStart}`);
-    try {
-      const output = await runBenchmark(memStart);
-      const parsedResults = parseResults(output, memStart);
-
-      // Write each result to the CSV file
-      parsedResults.forEach((result) => {
-        const line = `${result.memory},${result.memory + 32},${
-          result.iterations
-        },${result.nsPerOp}\n`;
-        csvStream.write(line);
-      });
-    } catch (error) {
-      console.error(`Failed for memStart=${memStart}: ${error}`);
-    }
+  // Each job takes the next point until none are left, on its own core
+  const runJob = async (core) => {
+    while (next < points.length) {
+      const point = points[next++];
+      try {
+        const output = await runBenchmark(options, point, core, pin);
+        const results = parseResults(output, point.benchmark);
+        if (results.length) {
+          point.summary = summarize(results);
+        } else {
+          console.error(`No results for ${point.opcode} with memStart=${point.memStart}`);
+        }
+      } catch (error) {
+        console.error(`Failed for ${point.opcode} with memStart=${point.memStart}: ${error}`);
+      }
 
-    progressBar.update(index + 1);
-  }
+      progressBar.update(++completed, { opcode: point.opcode, memStart: point.memStart });
+      if (--remaining[point.opcode] === 0) {
+        writeOpcodeResults(
+          point.opcode,
+          points.filter((other) => other.opcode === point.opcode)
+        );
+      }
+    }
+  };
+  await Promise.all(cores.map(runJob));
 
   progressBar.stop();
-  csvStream.end(); // Close the writable stream
 
-  console.log("Benchmark results saved to benchmark_results.csv");
+  // Write the confidence intervals of every point
+  const lines = ["opcode,offset,memory_size,repetitions,nsPerOp,ci_low,ci_high"];
+  for (const point of points) {
+    if (point.summary) {
+      const { repetitions, nsPerOp, ciLow, ciHigh } = point.summary;
+      lines.push(
+        [
+          point.opcode,
+          point.memStart,
+          point.memStart + point.size,
+          repetitions,
+          nsPerOp.toFixed(2),
+          ciLow.toFixed(2),
+          ciHigh.toFixed(2),
+        ].join(",")
+      );
+    }
+  }
+  fs.writeFileSync(path.join(outPath, "benchmark_summary.csv"), lines.join("\n") + "\n");
+
+  console.log(`Benchmark results saved to ${outPath}`);
 };
 
 // Run the script
-main();
+main().catch((error) => {
+  console.error(error.message || error);
+  process.exit(1);
+});
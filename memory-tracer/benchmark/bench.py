@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import psutil
+
+from benchmark.node import add_node_arguments, get_node_options, run_node
+from tracer.budget import memory_budget
+from tracer.cache import rpc_cache
+from tracer.fs import Compression, OutputFormat, OutputOptions
+from tracer.metrics import metrics
+from tracer.scheduler import Endpoint, pool
+
+# The command-line script, which shares its name with the `tracer` package
+TRACER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tracer.py")
+
+# The number of seconds between two samples of the memory usage of the tracer
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def get_free_port() -> int:
+    """
+    Get a free TCP port on localhost.
+
+    Returns:
+        int: The port number.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    """
+    Wait until a server listens on a port of localhost.
+
+    Args:
+        port (int): The port number.
+        timeout (float): The maximum number of seconds to wait.
+
+    Raises:
+        TimeoutError: If nothing listens on the port in time.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The stub node did not start on port {port}")
+            time.sleep(0.05)
+
+
+def load_tracer_script():
+    """
+    Load the command-line script as a module, without running a command.
+
+    Returns:
+        module: The script module, exposing `trace_memory`.
+    """
+    spec = importlib.util.spec_from_file_location("tracer_script", TRACER_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class PeakMemory:
+    def __init__(self, process: psutil.Process):
+        """
+        Initialize the sampling of the peak resident memory of a process.
+
+        Args:
+            process (psutil.Process): The process to sample.
+        """
+        self.process = process
+        self.peak = process.memory_info().rss
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """
+        Sample the resident memory until stopped.
+        """
+        while not self.stopped.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def get_cpu_time(process: psutil.Process) -> float:
+    """
+    Get the CPU time used by a process so far.
+
+    Args:
+        process (psutil.Process): The process.
+
+    Returns:
+        float: The user and system CPU seconds.
+    """
+    times = process.cpu_times()
+    return times.user + times.system
+
+
+def run_benchmark(
+    args: argparse.Namespace, script, port: int, node: psutil.Process
+) -> Dict[str, Any]:
+    """
+    Trace a block range against the stub node once, in this process.
+
+    Args:
+        args (argparse.Namespace): The options of the benchmark.
+        script (module): The command-line script, see `load_tracer_script`.
+        port (int): The port the stub node listens on.
+        node (psutil.Process): The process of the stub node.
+
+    Returns:
+        Dict[str, Any]: The measurements of the run.
+    """
+    # Every run starts with a fresh endpoint, whatever the environment file selects
+    pool.endpoints = [Endpoint(f"http://127.0.0.1:{port}", 1.0)]
+    memory_budget.estimate = None
+    rpc_cache.enabled = args.cache
+
+    options = OutputOptions(
+        output_format=OutputFormat(args.format),
+        compression=args.compression and Compression(args.compression),
+    )
+    process = psutil.Process()
+    before = metrics.snapshot()
+    cpu_start, node_cpu_start = get_cpu_time(process), get_cpu_time(node)
+    start = time.perf_counter()
+
+    with PeakMemory(process) as peak, contextlib.redirect_stdout(open(os.devnull, "w")):
+        asyncio.run(
+            script.trace_memory(args.start_block, args.end_block, args.trace_blocks, True, options)
+        )
+
+    elapsed = time.perf_counter() - start
+    cpu = get_cpu_time(process) - cpu_start
+    after = metrics.snapshot()
+
+    transactions = after["counters"].get("transactions_rows", 0) - before["counters"].get(
+        "transactions_rows", 0
+    )
+    rows = after["counters"].get("call_frames_rows", 0) - before["counters"].get(
+        "call_frames_rows", 0
+    )
+    skipped = after["counters"].get("skipped_transactions", 0) - before["counters"].get(
+        "skipped_transactions", 0
+    )
+    stages = {
+        stage: round(timer["seconds"] - before["timers"].get(stage, {}).get("seconds", 0), 3)
+        for stage, timer in after["timers"].items()
+    }
+    return {
+        "seconds": round(elapsed, 3),
+        "transactions": transactions,
+        "skipped_transactions": skipped,
+        "rows": rows,
+        "transactions_per_second": round(transactions / elapsed, 1),
+        "rows_per_second": round(rows / elapsed, 1),
+        "peak_rss_mb": round(peak.peak / 1024**2, 1),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(100 * cpu / elapsed, 1),
+        "node_cpu_percent": round(100 * (get_cpu_time(node) - node_cpu_start) / elapsed, 1),
+        "stage_seconds": stages,
+    }
+
+
+def print_result(index: int, result: Dict[str, Any]):
+    """
+    Print the measurements of a run.
+
+    Args:
+        index (int): The number of the run, starting at 1.
+        result (Dict[str, Any]): The measurements of the run.
+    """
+    stages = ", ".join(f"{stage} {seconds}s" for stage, seconds in result["stage_seconds"].items())
+    print(
+        f"Run {index}: {result['seconds']}s, "
+        f"{result['transactions_per_second']} tx/s, {result['rows_per_second']} rows/s, "
+        f"peak RSS {result['peak_rss_mb']} MB, CPU {result['cpu_percent']}% "
+        f"(stub node {result['node_cpu_percent']}%)"
+    )
+    print(f"  Stages: {stages}")
+
+
+def benchmark(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Start a stub node in its own process, and trace a block range against it.
+
+    Args:
+        args (argparse.Namespace): The options of the benchmark.
+
+    Returns:
+        List[Dict[str, Any]]: The measurements of each run.
+    """
+    port = get_free_port()
+    node_process = multiprocessing.Process(
+        target=run_node, args=(port,), kwargs=get_node_options(args), daemon=True
+    )
+    node_process.start()
+
+    results = []
+    working_directory = os.getcwd()
+    try:
+        wait_for_port(port)
+        node = psutil.Process(node_process.pid)
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Outputs, the RPC cache if enabled, and the error log of the script are
+            # written to a scratch directory
+            os.chdir(directory)
+            try:
+                script = load_tracer_script()
+                for index in range(1, args.runs + 1):
+                    result = run_benchmark(args, script, port, node)
+                    print_result(index, result)
+                    results.append(result)
+            finally:
+                os.chdir(working_directory)
+    finally:
+        node_process.terminate()
+        node_process.join()
+
+    if len(results) > 1:
+        rates = [result["transactions_per_second"] for result in results]
+        print(f"Median: {statistics.median(rates)} tx/s over {len(results)} runs")
+    return results
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create the command-line parser of the benchmark.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tracer against a local stub node, reporting throughput, "
+        "peak memory and CPU usage."
+    )
+    parser.add_argument("start_block", type=int, help="Start block number")
+    parser.add_argument("end_block", type=int, help="End block number")
+    parser.add_argument(
+        "--trace-blocks",
+        action="store_true",
+        help="Trace whole blocks with debug_traceBlockByNumber in a single pass",
+    )
+    parser.add_argument(
+        "--format",
+        choices=[output_format.value for output_format in OutputFormat],
+        default=OutputFormat.CSV.value,
+        help="Output format",
+    )
+    parser.add_argument(
+        "--compression", choices=["gzip", "zstd", "lz4"], help="Stream compressed CSV output"
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Use the RPC cache, so that runs after the first are served from it",
+    )
+    parser.add_argument("--runs", type=int, default=1, help="Number of runs")
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help="Append the measurements of every run to this JSON lines file",
+    )
+    add_node_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    args = create_parser().parse_args()
+    results = benchmark(args)
+
+    if args.output:
+        with open(args.output, "a") as f:
+            for result in results:
+                f.write(json.dumps({"options": vars(args), **result}) + "\n")
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import hashlib
+import random
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from tracer.cache import RpcCache
+from tracer.config import INSTRUCTIONS
+
+# Instructions recorded by the tracer, with the number of memory regions each accesses
+TRACED_INSTRUCTIONS = [
+    (int(instruction["opcode"], 16), len(instruction["stack_input_positions"]))
+    for instruction in INSTRUCTIONS.values()
+]
+
+# Block number reported as the head of the chain
+HEAD_BLOCK_NUMBER = 20_000_000
+
+
+class StubNode:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        transactions: int = 100,
+        accesses: int = 200,
+        transfer_rate: float = 0.4,
+        seed: int = 0,
+        recorded: Optional[str] = None,
+    ):
+        """
+        Initialize a stand-in for an archive node, answering the JSON-RPC methods used by
+        the tracer with recorded or generated responses.
+
+        Generated responses only depend on the seed and the request, so the same run of
+        the tracer receives the same responses every time.
+
+        Args:
+            latency (float): The number of seconds every HTTP request takes.
+            error_rate (float): The share of HTTP requests answered with a transient
+                HTTP 503 error, which the tracer retries.
+            transactions (int): The number of transactions of every generated block.
+            accesses (int): The average number of memory accesses of a generated trace,
+                which sets the size of trace responses.
+            transfer_rate (float): The share of generated transactions that are plain
+                transfers, without input data, accesses or gas used above the intrinsic gas.
+            seed (int): The seed of the generated responses.
+            recorded (Optional[str]): An RPC cache file recorded by previous runs of the
+                tracer against a real node, whose results are served when present.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.transactions = transactions
+        self.accesses = accesses
+        self.transfer_rate = transfer_rate
+        self.seed = seed
+        # Disk space is not a concern for a cache that is only read
+        self.recorded = RpcCache(recorded, 0) if recorded else None
+        self.random = random.Random(seed)
+
+    def get_random(self, *key: Any) -> random.Random:
+        """
+        Get a random generator determined by the seed and a key.
+
+        Args:
+            *key (Any): The values identifying what is generated.
+
+        Returns:
+            random.Random: The random generator.
+        """
+        return random.Random(":".join(map(str, (self.seed, *key))))
+
+    def get_transaction_hash(self, block_number: int, index: int) -> str:
+        """
+        Get the hash of a generated transaction.
+
+        Args:
+            block_number (int): The number of the block of the transaction.
+            index (int): The position of the transaction in the block.
+
+        Returns:
+            str: The hex encoded transaction hash.
+        """
+        data = f"{self.seed}:{block_number}:{index}".encode()
+        return "0x" + hashlib.sha256(data).hexdigest()
+
+    def is_transfer(self, tx_hash: str) -> bool:
+        """
+        Check whether a generated transaction is a plain transfer.
+
+        Args:
+            tx_hash (str): The transaction hash.
+
+        Returns:
+            bool: True if the transaction is a plain transfer.
+        """
+        return self.get_random("transfer", tx_hash).random() < self.transfer_rate
+
+    def get_block(self, block_number: int) -> dict:
+        """
+        Generate a block with its full transaction objects.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            dict: The block.
+        """
+        rng = self.get_random("block", block_number)
+        transactions = []
+        for index in range(self.transactions):
+            tx_hash = self.get_transaction_hash(block_number, index)
+            input_size = 0 if self.is_transfer(tx_hash) else rng.choice([4, 68, 132])
+            transactions.append(
+                {
+                    "hash": tx_hash,
+                    "to": "0x" + rng.randbytes(20).hex(),
+                    "gas": hex(rng.randrange(21_000, 1_000_000)),
+                    "input": "0x" + rng.randbytes(input_size).hex(),
+                }
+            )
+        return {
+            "number": hex(block_number),
+            "hash": "0x" + hashlib.sha256(f"{self.seed}:{block_number}".encode()).hexdigest(),
+            "transactions": transactions,
+        }
+
+    def get_receipts(self, block_number: int) -> List[dict]:
+        """
+        Generate the receipts of the transactions of a block.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            List[dict]: The receipt of each transaction, in block order.
+        """
+        receipts = []
+        for tx in self.get_block(block_number)["transactions"]:
+            rng = self.get_random("receipt", tx["hash"])
+            gas_used = 21_000 if self.is_transfer(tx["hash"]) else rng.randrange(21_100, 500_000)
+            receipts.append(
+                {"transactionHash": tx["hash"], "status": "0x1", "gasUsed": hex(gas_used)}
+            )
+        return receipts
+
+    @lru_cache(maxsize=1024)
+    def get_trace(self, tx_hash: str, compact: bool) -> dict:
+        """
+        Generate the result of the memory tracer for a transaction.
+
+        Args:
+            tx_hash (str): The transaction hash.
+            compact (bool): Return the parallel arrays of the compact tracer instead of
+                an object per instruction.
+
+        Returns:
+            dict: The trace result.
+        """
+        rng = self.get_random("trace", tx_hash)
+        packed: Dict[str, List[int]] = {
+            "op": [],
+            "depth": [],
+            "frame": [],
+            "gas_cost": [],
+            "pre_memory_size": [],
+            "post_memory_size": [],
+            "regions": [],
+        }
+
+        # Plain transfers execute no instruction
+        access_count = 0
+        if not self.is_transfer(tx_hash):
+            access_count = rng.randint(self.accesses // 2, self.accesses * 3 // 2)
+
+        # Ordinals of the call frames being executed, the size of the memory of each, and
+        # the number of frames entered
+        frames = [0]
+        memory_sizes = [0]
+        frame_count = 0
+        for _ in range(access_count):
+            # Calls are entered and returned from at random, up to a depth of 4. Every call
+            # frame starts with an empty memory, and the caller's memory is left as it was.
+            move = rng.random()
+            if move < 0.1 and len(frames) < 4:
+                frame_count += 1
+                frames.append(frame_count)
+                memory_sizes.append(0)
+            elif move < 0.2 and len(frames) > 1:
+                frames.pop()
+                memory_sizes.pop()
+
+            opcode, region_count = rng.choice(TRACED_INSTRUCTIONS)
+            memory_size = pre_memory_size = memory_sizes[-1]
+            for _ in range(region_count):
+                offset = rng.randrange(0, memory_size + 1024, 32)
+                size = rng.choice([0, 32, 32, 32, 64, 128, 1024])
+                if size:
+                    memory_size = max(memory_size, (offset + size + 31) // 32 * 32)
+                packed["regions"] += [offset, size]
+            memory_sizes[-1] = memory_size
+            packed["op"].append(opcode)
+            packed["depth"].append(len(frames))
+            packed["frame"].append(frames[-1])
+            packed["gas_cost"].append(rng.choice([3, 3, 6, 100, 2600]))
+            packed["pre_memory_size"].append(pre_memory_size)
+            packed["post_memory_size"].append(memory_size)
+
+        if compact:
+            return {"error": False, "packed": packed}
+
+        # The original tracer returns an object per instruction
+        data = []
+        regions = iter(packed["regions"])
+        region_counts = dict(TRACED_INSTRUCTIONS)
+        for index, opcode in enumerate(packed["op"]):
+            data.append(
+                {
+                    "op": f"{opcode:02x}",
+                    "depth": packed["depth"][index],
+                    "frame": packed["frame"][index],
+                    "access_regions": [
+                        {"offset": next(regions), "size": next(regions)}
+                        for _ in range(region_counts[opcode])
+                    ],
+                    "gas_cost": packed["gas_cost"][index],
+                    "pre_memory_size": packed["pre_memory_size"][index],
+                    "post_memory_size": packed["post_memory_size"][index],
+                    "memory_expansion": packed["post_memory_size"][index]
+                    - packed["pre_memory_size"][index],
+                }
+            )
+        return {"error": False, "data": data}
+
+    def get_result(self, method: str, params: list) -> Any:
+        """
+        Get the result of a JSON-RPC request.
+
+        Args:
+            method (str): The JSON-RPC method.
+            params (list): Parameters for the JSON-RPC method.
+
+        Returns:
+            Any: The result of the request.
+
+        Raises:
+            ValueError: If the method is not supported.
+        """
+        if self.recorded is not None:
+            result = self.recorded.get(method, params)
+            if result is not None:
+                return result
+
+        if method == "eth_blockNumber":
+            return hex(HEAD_BLOCK_NUMBER)
+        if method == "eth_getBlockByNumber":
+            return self.get_block(int(params[0], 16))
+        if method == "eth_getBlockReceipts":
+            return self.get_receipts(int(params[0], 16))
+        if method == "eth_getBlockTransactionCountByNumber":
+            return hex(self.transactions)
+        if method == "debug_traceTransaction":
+            return self.get_trace(params[0], "packed" in params[1]["tracer"])
+        if method == "debug_traceBlockByNumber":
+            compact = "packed" in params[1]["tracer"]
+            block = self.get_block(int(params[0], 16))
+            return [
+                {"txHash": tx["hash"], "result": self.get_trace(tx["hash"], compact)}
+                for tx in block["transactions"]
+            ]
+        raise ValueError(f"Unsupported method {method}")
+
+    def answer(self, request: dict) -> dict:
+        """
+        Answer a single JSON-RPC request.
+
+        Args:
+            request (dict): The JSON-RPC request object.
+
+        Returns:
+            dict: The JSON-RPC response object.
+        """
+        try:
+            result = self.get_result(request["method"], request["params"])
+        except ValueError as e:
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "error": {"code": -32601, "message": str(e)},
+            }
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """
+        Handle an HTTP request holding a JSON-RPC request or batch.
+
+        Args:
+            request (web.Request): The HTTP request.
+
+        Returns:
+            web.Response: The HTTP response.
+        """
+        payload = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.error_rate:
+            return web.Response(status=503)
+
+        if isinstance(payload, list):
+            return web.json_response([self.answer(item) for item in payload])
+        return web.json_response(self.answer(payload))
+
+    def create_app(self) -> web.Application:
+        """
+        Create the web application serving JSON-RPC requests on `/`.
+
+        Returns:
+            web.Application: The application.
+        """
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_post("/", self.handle)
+        return app
+
+
+def run_node(port: int, **kwargs):
+    """
+    Serve a stub node until the process is stopped.
+
+    Args:
+        port (int): The port to listen on, on localhost.
+        **kwargs: The options of the stub node, see `StubNode`.
+    """
+    web.run_app(StubNode(**kwargs).create_app(), host="127.0.0.1", port=port, print=None)
+
+
+def add_node_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the arguments configuring the stub node to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of a command.
+    """
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds every HTTP request takes"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of HTTP requests answered with a transient HTTP 503 error",
+    )
+    parser.add_argument(
+        "--transactions", type=int, default=100, help="Number of transactions of every block"
+    )
+    parser.add_argument(
+        "--accesses",
+        type=int,
+        default=200,
+        help="Average number of memory accesses of a trace, setting the payload size",
+    )
+    parser.add_argument(
+        "--transfer-rate",
+        type=float,
+        default=0.4,
+        help="Share of transactions that are plain transfers, skipped by the tracer",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated responses")
+    parser.add_argument(
+        "--recorded",
+        metavar="FILE",
+        help="Serve the results of this RPC cache file, recorded against a real node, "
+        "when present",
+    )
+
+
+def get_node_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Get the options of the stub node selected on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        Dict[str, Any]: The keyword arguments of `StubNode`.
+    """
+    return {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "transactions": args.transactions,
+        "accesses": args.accesses,
+        "transfer_rate": args.transfer_rate,
+        "seed": args.seed,
+        "recorded": args.recorded,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a stand-in for an archive node, answering the JSON-RPC methods "
+        "used by the tracer with recorded or generated responses."
+    )
+    parser.add_argument("--port", type=int, default=8545, help="Port to listen on")
+    add_node_arguments(parser)
+    args = parser.parse_args()
+    run_node(args.port, **get_node_options(args))
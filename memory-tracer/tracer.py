@@ -1,11 +1,40 @@
 import argparse
 import asyncio
+import csv
 import logging
+import os
 import sys
+from dataclasses import replace
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
 
-from tracer.chain import get_call_frames_from_transaction, get_transactions_from_block
-from tracer.fs import CSVIterator, FileType, OutputHandler
-from tracer.pipeline import schedule_rpc_tasks
+# Only light modules are imported up front, so that arguments are parsed (and `--help`
+# printed) without loading aiohttp, pypeln, numpy or pyarrow. Each command imports the
+# modules it needs when it runs.
+from tracer.config import (
+    DATA_DIR,
+    FOLLOW_CONFIRMATIONS,
+    FOLLOW_POLL_INTERVAL,
+    FOLLOW_SEGMENT_SIZE,
+    INSTRUCTIONS,
+    RPC_BATCH_SIZE,
+)
+from tracer.fs import (
+    CSV_FIELDNAMES,
+    CombinedFormat,
+    Compression,
+    CSVIterator,
+    FileType,
+    OutputFormat,
+    OutputOptions,
+    create_iterator,
+    get_output_directory,
+    get_output_path,
+)
+from tracer.metrics import Instrumentation, instrument
+
+if TYPE_CHECKING:
+    from tracer.checkpoint import Checkpoint
+    from tracer.simulate import GasSchedule
 
 # Configure logging
 logging.basicConfig(
@@ -41,45 +70,70 @@ def print_progress_bar(iteration, total, prefix="", length=40, fill="█", print
         sys.stdout.flush()
 
 
-async def save_transactions(start_block: int, end_block: int) -> str:
+async def save_transactions(start_block: int, end_block: int, checkpoint: "Checkpoint") -> str:
     """
     Save transactions for a range of blocks.
 
     Args:
         start_block (int): The starting block number.
         end_block (int): The ending block number.
+        checkpoint (Checkpoint): The checkpoint manifest of the run.
 
     Returns:
-        str: The name of the compressed file containing transactions.
+        str: The path of the finished output containing transactions.
     """
+    from tracer.chain import get_transactions_from_blocks
+    from tracer.pipeline import batch_stage, schedule_rpc_tasks
+
+    global total_transactions
+    total_transactions = checkpoint.total_transactions
+
+    if checkpoint.is_stage_complete(FileType.TRANSACTION):
+        return get_output_path(
+            start_block,
+            end_block,
+            FileType.TRANSACTION,
+            checkpoint.options,
+            checkpoint.data_directory,
+        )
+
+    # Skip blocks completed by a previous run
     block_range = range(start_block, end_block + 1)
+    pending_blocks = (block for block in block_range if block not in checkpoint.completed_blocks)
 
     # Initialize the output handler for transactions
-    output = OutputHandler(start_block, end_block, FileType.TRANSACTION)
+    output = checkpoint.open_output(FileType.TRANSACTION)
 
-    async def task(block_number: int, session):
+    async def task(block_numbers: List[int], session):
         global total_transactions
         """
-        Task to fetch transactions for a given block and write to output.
+        Task to fetch transactions for a batch of blocks and write to output.
 
         Args:
-            block_number (int): The block number to fetch transactions for.
+            block_numbers (List[int]): The block numbers to fetch transactions for.
             session: The session object for RPC calls.
         """
-        transactions = await get_transactions_from_block(block_number, session)
+        transactions = await get_transactions_from_blocks(block_numbers, session)
         total_transactions += len(transactions)
         output.write(transactions)
 
-    # Schedule RPC tasks for each block in the range
-    await schedule_rpc_tasks(task=task, stage=block_range)
+        checkpoint.total_transactions = total_transactions
+        checkpoint.complete_blocks(block_numbers)
+        await checkpoint.drain()
+
+    # Schedule RPC tasks for each batch of blocks in the range
+    await schedule_rpc_tasks(task=task, stage=batch_stage(pending_blocks, RPC_BATCH_SIZE))
 
-    output.compress()
+    checkpoint.finalize(output)
 
-    return output.compressed_file_name
+    return output.output_path
 
 
 async def save_call_frames(
-    start_block: int, end_block: int, transaction_iterator: CSVIterator
+    start_block: int,
+    end_block: int,
+    transaction_iterator: CSVIterator,
+    checkpoint: "Checkpoint",
 ) -> None:
     """
     Save call frames for transactions within a range of blocks.
@@ -88,65 +142,893 @@ async def save_call_frames(
         start_block (int): The starting block number.
         end_block (int): The ending block number.
         transaction_iterator (CSVIterator): Iterator for transactions from the CSV file.
+        checkpoint (Checkpoint): The checkpoint manifest of the run.
     """
-    # Initialize the output handler for call frames
-    output = OutputHandler(start_block, end_block, FileType.CALL_FRAME)
+    from tracer.frames import get_call_frame_columns_from_transactions, summarize_frames
+    from tracer.pipeline import batch_stage, schedule_rpc_tasks
 
-    async def task(transaction, session):
+    if checkpoint.is_stage_complete(FileType.CALL_FRAME):
+        return
+
+    global current_transaction
+    current_transaction = len(checkpoint.completed_transactions)
+
+    skipped_transactions = 0
+
+    def get_pending_transactions() -> Iterator[Dict[str, str]]:
+        """
+        Yield the transactions left to trace.
+
+        Transactions completed by a previous run are skipped, as are those flagged as not
+        traced when their transactions were saved, which never access memory. Outputs of
+        older versions have no flag, and all their transactions are traced.
+        """
+        global current_transaction
+        nonlocal skipped_transactions
+        for tx in transaction_iterator:
+            if tx.get("traced") == "0":
+                current_transaction += 1
+                skipped_transactions += 1
+            elif int(tx["id"]) not in checkpoint.completed_transactions:
+                yield tx
+
+    # Initialize the output handlers for call frames and their per-frame summaries
+    output = checkpoint.open_output(FileType.CALL_FRAME)
+    frame_output = checkpoint.open_output(FileType.FRAME)
+
+    async def task(transactions, session):
         global current_transaction
         """
-        Task to fetch call frames for a given transaction and write to output.
+        Task to fetch call frames for a batch of transactions and write to output.
 
         Args:
-            transaction: The transaction to fetch call frames for.
+            transactions: The transactions to fetch call frames for.
             session: The session object for RPC calls.
         """
-        call_frames = await get_call_frames_from_transaction(transaction, session)
-        current_transaction += 1
+        call_frames = await get_call_frame_columns_from_transactions(transactions, session)
+        current_transaction += len(transactions)
         print_progress_bar(
             current_transaction, total_transactions, prefix="Processing transactions"
         )
 
-        output.write(call_frames)
+        output.write_columns(call_frames)
+        frame_output.write_columns(summarize_frames(call_frames))
+        checkpoint.aggregator.update(call_frames)
+        checkpoint.complete_transactions(transactions)
+        await checkpoint.drain()
 
-    # Schedule RPC tasks for each transaction in the iterator
-    await schedule_rpc_tasks(task=task, stage=transaction_iterator)
+    # Schedule RPC tasks for each batch of transactions in the iterator
+    await schedule_rpc_tasks(
+        task=task, stage=batch_stage(get_pending_transactions(), RPC_BATCH_SIZE)
+    )
+    if skipped_transactions:
+        print(f"\nSkipped {skipped_transactions} plain transfers without memory accesses")
 
-    output.compress()
+    checkpoint.aggregator.write_summary(checkpoint.directory, start_block, end_block)
+    checkpoint.finalize(output, frame_output)
 
 
-async def trace_memory(start_block: int, end_block: int) -> None:
+async def save_blocks(start_block: int, end_block: int, checkpoint: "Checkpoint") -> None:
+    """
+    Save transactions and call frames for a range of blocks in a single pass,
+    tracing whole blocks instead of individual transactions.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        checkpoint (Checkpoint): The checkpoint manifest of the run.
+    """
+    from tracer.frames import get_call_frame_columns_from_blocks, summarize_frames
+    from tracer.pipeline import batch_stage, schedule_rpc_tasks
+
+    if checkpoint.is_stage_complete(FileType.CALL_FRAME):
+        return
+
+    block_range = range(start_block, end_block + 1)
+    processed_blocks = len(checkpoint.completed_blocks)
+
+    # Skip blocks completed by a previous run
+    pending_blocks = (block for block in block_range if block not in checkpoint.completed_blocks)
+
+    # Initialize the output handlers for transactions, call frames and their summaries
+    transaction_output = checkpoint.open_output(FileType.TRANSACTION)
+    call_frame_output = checkpoint.open_output(FileType.CALL_FRAME)
+    frame_output = checkpoint.open_output(FileType.FRAME)
+
+    async def task(block_numbers: List[int], session):
+        nonlocal processed_blocks
+        """
+        Task to trace a batch of blocks and write transactions and call frames to output.
+
+        Args:
+            block_numbers (List[int]): The block numbers to trace.
+            session: The session object for RPC calls.
+        """
+        transactions, call_frames = await get_call_frame_columns_from_blocks(
+            block_numbers, session
+        )
+        processed_blocks += len(block_numbers)
+        print_progress_bar(processed_blocks, len(block_range), prefix="Processing blocks")
+
+        transaction_output.write(transactions)
+        call_frame_output.write_columns(call_frames)
+        frame_output.write_columns(summarize_frames(call_frames))
+        checkpoint.aggregator.update(call_frames)
+        checkpoint.complete_blocks(block_numbers)
+        await checkpoint.drain()
+
+    # Schedule RPC tasks for each batch of blocks in the range
+    await schedule_rpc_tasks(task=task, stage=batch_stage(pending_blocks, RPC_BATCH_SIZE))
+
+    checkpoint.aggregator.write_summary(checkpoint.directory, start_block, end_block)
+    checkpoint.finalize(transaction_output, call_frame_output, frame_output)
+
+
+async def trace_memory(
+    start_block: int,
+    end_block: int,
+    trace_blocks: bool = False,
+    fresh: bool = False,
+    options: OutputOptions = OutputOptions(),
+    directory: str = DATA_DIR,
+) -> None:
     """
     Trace memory usage for a range of blocks by saving transactions and call frames.
 
+    Progress is recorded in a checkpoint manifest, so an interrupted run picks up
+    where it stopped when restarted with the same block range.
+
     Args:
         start_block (int): The starting block number.
         end_block (int): The ending block number.
+        trace_blocks (bool): Trace whole blocks in a single pass instead of
+            tracing each transaction separately.
+        fresh (bool): Discard the checkpoint of a previous run and start from scratch.
+        options (OutputOptions): The options to write the output with.
+        directory (str): The directory holding the output directories of the ranges.
     """
+    from tracer.checkpoint import Checkpoint
+
+    checkpoint = Checkpoint(start_block, end_block, options, fresh=fresh, directory=directory)
+    if checkpoint.resumed:
+        print(f"Resuming from checkpoint {checkpoint.file_name}")
+
     try:
-        # Save transactions to a compressed csv file and get its path.
-        tx_file = await save_transactions(start_block, end_block)
+        if trace_blocks:
+            await save_blocks(start_block, end_block, checkpoint)
+        else:
+            # Save transactions to a compressed csv file (or columnar dataset) and get its path.
+            tx_file = await save_transactions(start_block, end_block, checkpoint)
 
-        # Process the transactions to save call frames
-        with CSVIterator(tx_file) as transaction_iterator:
-            await save_call_frames(start_block, end_block, transaction_iterator)
+            # Process the transactions to save call frames
+            with create_iterator(tx_file, options) as transaction_iterator:
+                await save_call_frames(start_block, end_block, transaction_iterator, checkpoint)
     except Exception as e:
+        # Record the work completed so far so that a restart can resume from it
+        checkpoint.save()
         logging.error(f"Error tracing memory for blocks {start_block}-{end_block}: {e}")
         raise
 
+    checkpoint.remove()
 
-# Command-line arguments parsing
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Trace EVM memory usage.")
+
+def run_shard(
+    start_block: int,
+    end_block: int,
+    block_offsets: Dict[int, int],
+    shards: int,
+    trace_blocks: bool,
+    fresh: bool,
+    options: OutputOptions,
+    instrumentation: Instrumentation,
+    directory: str,
+) -> None:
+    """
+    Trace the block range of a single shard, in a worker process.
+
+    Args:
+        start_block (int): The starting block number of the shard.
+        end_block (int): The ending block number of the shard.
+        block_offsets (Dict[int, int]): The id of the first transaction of each block.
+        shards (int): The number of shards running at the same time.
+        trace_blocks (bool): Trace whole blocks in a single pass.
+        fresh (bool): Discard the checkpoint of a previous run of the shard.
+        options (OutputOptions): The options to write the output with.
+        instrumentation (Instrumentation): The instrumentation of the run. Shards share
+            its metrics log, and write their own profile next to its profile.
+        directory (str): The directory holding the output directories of the shards.
+    """
+    from tracer.budget import memory_budget
+    from tracer.chain import transaction_state
+    from tracer.scheduler import pool
+
+    # Shards run side by side, so their progress bars would garble each other
+    sys.stdout = open(os.devnull, "w")
+
+    transaction_state.block_offsets = block_offsets
+
+    # Every shard gets an equal share of the maximum request rate and of the memory budget
+    for endpoint in pool.endpoints:
+        endpoint.scheduler.interval *= shards
+    memory_budget.capacity //= shards
+
+    if instrumentation.profile_file:
+        root, extension = os.path.splitext(instrumentation.profile_file)
+        instrumentation = replace(
+            instrumentation, profile_file=f"{root}.{start_block}_to_{end_block}{extension}"
+        )
+
+    with instrument(instrumentation, f"{start_block}-{end_block}"):
+        asyncio.run(trace_memory(start_block, end_block, trace_blocks, fresh, options, directory))
+
+
+def trace_shards(
+    start_block: int,
+    end_block: int,
+    shards: int,
+    trace_blocks: bool = False,
+    fresh: bool = False,
+    options: OutputOptions = OutputOptions(),
+    instrumentation: Instrumentation = Instrumentation(),
+) -> None:
+    """
+    Trace memory usage for a range of blocks split into shards, each traced in its own
+    process, and merge the outputs of the shards.
+
+    Transaction ids are assigned from the position of transactions in the whole range,
+    so they are unique across shards and do not change between runs. Shards are written
+    to a directory of their own, so they never touch the outputs of other ranges. Each
+    shard keeps its own checkpoint, so an interrupted run only retraces unfinished shards.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        shards (int): The number of shards to split the range into.
+        trace_blocks (bool): Trace whole blocks in a single pass instead of
+            tracing each transaction separately.
+        fresh (bool): Discard the checkpoints of a previous run and start from scratch.
+        options (OutputOptions): The options to write the output with.
+        instrumentation (Instrumentation): The instrumentation of the shards.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    from tracer.checkpoint import Checkpoint
+    from tracer.shard import get_block_offsets, get_shards_directory, merge_shards, split_range
+
+    shard_ranges = split_range(start_block, end_block, shards)
+    shards_directory = get_shards_directory(start_block, end_block)
+
+    print(f"Counting transactions of blocks {start_block}-{end_block}")
+    block_offsets = asyncio.run(get_block_offsets(start_block, end_block))
+
+    with ProcessPoolExecutor(max_workers=len(shard_ranges)) as executor:
+        futures = {}
+        for shard_start, shard_end in shard_ranges:
+            # Shards finished by a previous run have an output but no checkpoint left
+            directory = get_output_directory(shard_start, shard_end, shards_directory)
+            output_path = get_output_path(
+                shard_start, shard_end, FileType.CALL_FRAME, options, shards_directory
+            )
+            if (
+                not fresh
+                and not os.path.exists(os.path.join(directory, Checkpoint.FILE_NAME))
+                and os.path.exists(output_path)
+            ):
+                continue
+
+            futures[(shard_start, shard_end)] = executor.submit(
+                run_shard,
+                shard_start,
+                shard_end,
+                {block: block_offsets[block] for block in range(shard_start, shard_end + 1)},
+                len(shard_ranges),
+                trace_blocks,
+                fresh,
+                options,
+                instrumentation,
+                shards_directory,
+            )
+
+        for (shard_start, shard_end), future in futures.items():
+            future.result()
+            print(f"Traced shard {shard_start}-{shard_end}")
+
+    merge_shards(start_block, end_block, shard_ranges, options)
+
+
+def add_output_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the arguments selecting how output is written to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of a command.
+    """
+    parser.add_argument(
+        "--format",
+        choices=[output_format.value for output_format in OutputFormat],
+        default=OutputFormat.CSV.value,
+        help="Output format: gzip CSV, typed columnar Parquet or Arrow IPC datasets, or "
+        "compact Parquet datasets with binary hashes and dictionary and delta encodings",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=[compression.value for compression in Compression],
+        help="Compress CSV output on a background thread while it is written",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help="Rotate compressed CSV output into chunk files of about this many MB",
+    )
+
+
+def add_instrumentation_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the arguments selecting the instrumentation of a run to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser of a command.
+    """
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Append snapshots of per-stage timings, bytes received, requests in flight "
+        "and queue depths to this JSON lines file every few seconds",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write a cProfile profile of the run to this file, or a pyinstrument report "
+        "if it ends with .html",
+    )
+
+
+def get_instrumentation(args: argparse.Namespace) -> Instrumentation:
+    """
+    Get the instrumentation selected on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        Instrumentation: The instrumentation of the run.
+    """
+    return Instrumentation(metrics_file=args.metrics, profile_file=args.profile)
+
+
+def get_output_options(args: argparse.Namespace) -> OutputOptions:
+    """
+    Get the output options selected on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        OutputOptions: The output options.
+    """
+    return OutputOptions(
+        output_format=OutputFormat(args.format),
+        compression=args.compression and Compression(args.compression),
+        chunk_size=args.chunk_size * 1024 * 1024,
+    )
+
+
+def create_trace_parser() -> argparse.ArgumentParser:
+    """
+    Create the command-line parser of the default command, which traces a block range.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        description="Trace EVM memory usage.",
+        epilog="Run `%(prog)s replay --help` to rebuild call frames from cached traces, "
+        "`%(prog)s follow --help` to trace new blocks as they are confirmed, "
+        "`%(prog)s combine --help` to combine the outputs of several ranges, or "
+        "`%(prog)s query --help` to look up transactions and call frames of a range.",
+    )
+    parser.add_argument("start_block", type=int, help="Start block number")
+    parser.add_argument("end_block", type=int, help="End block number")
+    parser.add_argument(
+        "--trace-blocks",
+        action="store_true",
+        help="Trace whole blocks with debug_traceBlockByNumber in a single pass",
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Ignore the checkpoint of an interrupted run and start from scratch",
+    )
+    add_output_arguments(parser)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always query the node instead of the on-disk cache of block and trace results",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the block range into this many shards traced in parallel processes",
+    )
+    add_instrumentation_arguments(parser)
+    return parser
+
+
+def create_replay_parser() -> argparse.ArgumentParser:
+    """
+    Create the command-line parser of the `replay` command.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"{sys.argv[0]} replay",
+        description="Rebuild the call frames of a traced block range from cached traces, "
+        "without querying the node.",
+    )
+    parser.add_argument("start_block", type=int, help="Start block number")
+    parser.add_argument("end_block", type=int, help="End block number")
+    add_output_arguments(parser)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes decoding traces, one per core by default",
+    )
+    add_instrumentation_arguments(parser)
+    return parser
+
+
+def create_follow_parser() -> argparse.ArgumentParser:
+    """
+    Create the command-line parser of the `follow` command.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"{sys.argv[0]} follow",
+        description="Trace new blocks as they are confirmed, into rolling segments.",
+    )
+    parser.add_argument(
+        "--start-block",
+        type=int,
+        help="First block to trace, aligning the segments. Defaults to the last confirmed "
+        "block; pass the same value to resume a previous run",
+    )
+    parser.add_argument(
+        "--confirmations",
+        type=int,
+        default=FOLLOW_CONFIRMATIONS,
+        help="Number of blocks built on top of a block before it is traced",
+    )
+    parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=FOLLOW_SEGMENT_SIZE,
+        help="Number of blocks of each output segment",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=FOLLOW_POLL_INTERVAL,
+        help="Seconds between two polls of the head of the chain",
+    )
+    add_output_arguments(parser)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always query the node instead of the on-disk cache of block and trace results",
+    )
+    add_instrumentation_arguments(parser)
+    return parser
+
+
+async def follow_chain(
+    start_block: Optional[int],
+    confirmations: int,
+    segment_size: int,
+    poll_interval: float,
+    options: OutputOptions = OutputOptions(),
+) -> None:
+    """
+    Trace new blocks as they are confirmed, until interrupted.
+
+    Args:
+        start_block (Optional[int]): The first block to trace, the last confirmed block
+            by default.
+        confirmations (int): The number of blocks on top of a block before it is traced.
+        segment_size (int): The number of blocks of each output segment.
+        poll_interval (float): The number of seconds between two polls of the head.
+        options (OutputOptions): The options to write the output with.
+    """
+    from aiohttp import ClientSession
+
+    from tracer.follow import Follower
+    from tracer.rpc import get_block_number
+
+    if start_block is None:
+        async with ClientSession() as session:
+            start_block = await get_block_number(session) - confirmations
+
+    print(f"Following the chain from block {start_block}")
+    follower = Follower(start_block, segment_size, confirmations, options)
+    await follower.follow(poll_interval)
+
+
+def create_combine_parser() -> argparse.ArgumentParser:
+    """
+    Create the command-line parser of the `combine` command.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"{sys.argv[0]} combine",
+        description="Combine the outputs of several block ranges into a single dataset, "
+        "with transaction ids unique across ranges.",
+    )
+    parser.add_argument(
+        "directories",
+        nargs="*",
+        help="Output directories of the ranges, e.g. data/100_to_199. "
+        "Defaults to every finished range in the data directory",
+    )
+    parser.add_argument(
+        "--format",
+        choices=[combined_format.value for combined_format in CombinedFormat],
+        default=CombinedFormat.HDF5.value,
+        help="Format of the combined datasets: chunked HDF5 files readable by vaex, "
+        "or directories of Parquet part files",
+    )
+    parser.add_argument(
+        "--name",
+        default="combined",
+        help="Name of the combined datasets, e.g. data/<name>_call_frames.hdf5",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes reading ranges, one per core by default",
+    )
+    return parser
+
+
+def combine_outputs(
+    directories: List[str],
+    combined_format: CombinedFormat = CombinedFormat.HDF5,
+    name: str = "combined",
+    workers: Optional[int] = None,
+) -> None:
+    """
+    Combine the outputs of several block ranges into a single dataset per file type.
+
+    Args:
+        directories (List[str]): The output directories of the ranges, or an empty list
+            for every finished range.
+        combined_format (CombinedFormat): The format of the combined datasets.
+        name (str): The name of the combined datasets.
+        workers (Optional[int]): The number of worker processes, one per core by default.
+    """
+    from tracer.combine import combine_ranges, find_ranges, parse_range_directory
+
+    ranges = [parse_range_directory(directory) for directory in directories] or find_ranges()
+    if not ranges:
+        raise ValueError("No finished block range to combine")
+
+    paths = combine_ranges(
+        ranges,
+        combined_format,
+        name,
+        workers,
+        on_progress=lambda file_type, combined: print_progress_bar(
+            combined, len(ranges), prefix=f"Combining {file_type.value}", print_end="\n"
+        ),
+    )
+    for path in paths.values():
+        print(f"Combined output written to {path}")
+
+
+def parse_opcode(value: str) -> int:
+    """
+    Parse an opcode given by its mnemonic, e.g. MLOAD, or its hex number, e.g. 51.
+
+    Args:
+        value (str): The mnemonic or hex number.
+
+    Returns:
+        int: The opcode number.
+    """
+    if value.upper() in INSTRUCTIONS:
+        return int(INSTRUCTIONS[value.upper()]["opcode"], 16)
+    try:
+        return int(value, 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Unknown opcode: {value}")
+
+
+def create_query_parser() -> argparse.ArgumentParser:
+    """
+    Create the command-line parser of the `query` command.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"{sys.argv[0]} query",
+        description="Look up transactions and call frames in the output of a traced block "
+        "range through its index, printing them as CSV.",
+    )
+    parser.add_argument("start_block", type=int, help="Start block number")
+    parser.add_argument("end_block", type=int, help="End block number")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--block", type=int, help="Select the transactions of a block")
+    selection.add_argument("--tx-hash", help="Select a transaction by its hash")
+    selection.add_argument("--transaction-id", type=int, help="Select a transaction by its id")
+    parser.add_argument(
+        "--opcode",
+        type=parse_opcode,
+        help="Only print call frames of this opcode, given by mnemonic or hex number. "
+        "Without a selection, print the call frames of this opcode in the whole range",
+    )
+    parser.add_argument(
+        "--transactions",
+        action="store_true",
+        help="Print the selected transactions instead of their call frames",
+    )
+    return parser
+
+
+def query_output(
+    start_block: int,
+    end_block: int,
+    block: Optional[int] = None,
+    tx_hash: Optional[str] = None,
+    transaction_id: Optional[int] = None,
+    opcode: Optional[int] = None,
+    transactions: bool = False,
+) -> None:
+    """
+    Print the transactions or call frames of a traced block range selected by block,
+    transaction hash or transaction id, and opcode, as CSV.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        block (Optional[int]): Select the transactions of this block.
+        tx_hash (Optional[str]): Select the transaction with this hash.
+        transaction_id (Optional[int]): Select the transaction with this id.
+        opcode (Optional[int]): Only print call frames of this opcode.
+        transactions (bool): Print the selected transactions instead of their call frames.
+    """
+    from tracer.query import RangeQuery
+
+    query = RangeQuery(start_block, end_block)
+
+    selected = block is not None or tx_hash is not None or transaction_id is not None
+    if not selected and (transactions or opcode is None):
+        raise ValueError("Select transactions with --block, --tx-hash or --transaction-id")
+
+    # The selected range of transaction ids, None if no transaction matches
+    ids: Optional[Tuple[int, int]] = None
+    if tx_hash is not None:
+        transaction = query.get_transaction_by_hash(tx_hash)
+        if transaction:
+            ids = (int(transaction["id"]), int(transaction["id"]))
+    elif transaction_id is not None:
+        ids = (transaction_id, transaction_id)
+    elif block is not None:
+        ids = query.get_block_transaction_ids(block)
+
+    if transactions:
+        file_type, rows = FileType.TRANSACTION, query.get_transactions(*ids) if ids else []
+    elif selected:
+        file_type, rows = FileType.CALL_FRAME, query.get_call_frames(*ids, opcode) if ids else []
+    else:
+        # Every call frame of the opcode in the range
+        file_type, rows = FileType.CALL_FRAME, query.iter_call_frames(opcode)
+
+    writer = csv.DictWriter(sys.stdout, fieldnames=CSV_FIELDNAMES[file_type], lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def replay_memory(
+    start_block: int,
+    end_block: int,
+    options: OutputOptions = OutputOptions(),
+    workers: Optional[int] = None,
+) -> None:
+    """
+    Rebuild the call frames of a traced block range from cached traces.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        options (OutputOptions): The options the range was traced with.
+        workers (Optional[int]): The number of worker processes, one per core by default.
+    """
+    from tracer.replay import replay_call_frames
+    from tracer.shard import find_output_path
+
+    transactions_path = find_output_path(start_block, end_block, FileType.TRANSACTION, options)
+    with create_iterator(transactions_path, options) as transaction_iterator:
+        total = sum(1 for tx in transaction_iterator if tx.get("traced") != "0")
+
+    output_path = replay_call_frames(
+        start_block,
+        end_block,
+        options,
+        workers,
+        on_progress=lambda replayed: print_progress_bar(
+            replayed, total, prefix="Replaying transactions", print_end="\n"
+        ),
+    )
+    print(f"Call frames written to {output_path}")
+
+
+def parse_schedule_argument(value: str) -> "GasSchedule":
+    """
+    Parse a gas schedule given on the command line, see `parse_schedule`.
+
+    Args:
+        value (str): The schedule.
+
+    Returns:
+        GasSchedule: The gas schedule.
+    """
+    from tracer.simulate import parse_schedule
+
+    try:
+        return parse_schedule(value)
+    except (ValueError, OSError) as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def create_simulate_parser() -> argparse.ArgumentParser:
+    """
+    Create the command-line parser of the `simulate` command.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"{sys.argv[0]} simulate",
+        description="Re-price the memory expansions of a traced block range under "
+        "alternative gas schedules, reporting the gas difference of every transaction "
+        "and block with the current schedule.",
+    )
     parser.add_argument("start_block", type=int, help="Start block number")
     parser.add_argument("end_block", type=int, help="End block number")
+    parser.add_argument(
+        "--schedule",
+        dest="schedules",
+        action="append",
+        type=parse_schedule_argument,
+        help="Gas schedule to compare to the current one, repeatable: "
+        "quadratic[:<divisor>], linear[:<gas per word>] or "
+        "fitted:<client benchmark results file>[:<degree>]. Defaults to linear",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes pricing call frames, one per core by default",
+    )
+    return parser
+
+
+def simulate_gas(
+    start_block: int,
+    end_block: int,
+    schedules: List["GasSchedule"],
+    workers: Optional[int] = None,
+) -> None:
+    """
+    Re-price the memory expansions of a traced block range under alternative gas schedules.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        schedules (List[GasSchedule]): The schedules to compare to the current one.
+        workers (Optional[int]): The number of worker processes, one per core by default.
+    """
+    from tracer.simulate import simulate_range
+
+    summary = simulate_range(
+        start_block,
+        end_block,
+        schedules,
+        workers,
+        on_progress=lambda simulated: print(f"\rSimulated {simulated} call frames", end=""),
+    )
+    print()
+    for name, totals in summary.items():
+        print(
+            f"{name}: {totals['gas']:.0f} gas of memory expansion "
+            f"({totals['delta']:+.0f}, {100 * (totals['ratio'] - 1):+.1f}%)"
+        )
+    print(f"Simulation written to {get_output_directory(start_block, end_block)}")
+
+
+# Command-line arguments parsing
+if __name__ == "__main__":
+    # Tracing is the default command, other commands are given as the first argument
+    commands = (["replay"], ["follow"], ["combine"], ["query"], ["simulate"])
+    command = sys.argv[1] if sys.argv[1:2] in commands else None
+
+    if command == "simulate":
+        args = create_simulate_parser().parse_args(sys.argv[2:])
+        simulate_gas(
+            args.start_block,
+            args.end_block,
+            args.schedules or [parse_schedule_argument("linear")],
+            args.workers,
+        )
+    elif command == "query":
+        args = create_query_parser().parse_args(sys.argv[2:])
+        query_output(
+            args.start_block,
+            args.end_block,
+            args.block,
+            args.tx_hash,
+            args.transaction_id,
+            args.opcode,
+            args.transactions,
+        )
+    elif command == "combine":
+        args = create_combine_parser().parse_args(sys.argv[2:])
+        combine_outputs(args.directories, CombinedFormat(args.format), args.name, args.workers)
+    elif command == "follow":
+        args = create_follow_parser().parse_args(sys.argv[2:])
+        from tracer.cache import rpc_cache
+
+        rpc_cache.enabled = not args.no_cache
+        with instrument(get_instrumentation(args), "follow"):
+            asyncio.run(
+                follow_chain(
+                    args.start_block,
+                    args.confirmations,
+                    args.segment_size,
+                    args.poll_interval,
+                    get_output_options(args),
+                )
+            )
+    else:
+        if command == "replay":
+            args = create_replay_parser().parse_args(sys.argv[2:])
+        else:
+            args = create_trace_parser().parse_args()
+
+        start_block = args.start_block
+        end_block = args.end_block
 
-    args = parser.parse_args()
-    start_block = args.start_block
-    end_block = args.end_block
+        if start_block > end_block:
+            raise ValueError("Start block should be less than or equal to end block number")
 
-    if start_block > end_block:
-        raise ValueError("Start block should be less than or equal to end block number")
+        options = get_output_options(args)
+        instrumentation = get_instrumentation(args)
+        from tracer.cache import rpc_cache
 
-    # Run the tracing process
-    asyncio.run(trace_memory(start_block, end_block))
+        if command == "replay":
+            with instrument(instrumentation, f"{start_block}-{end_block}"):
+                replay_memory(start_block, end_block, options, args.workers)
+        # Run the tracing process
+        elif args.shards > 1 and start_block < end_block:
+            rpc_cache.enabled = not args.no_cache
+            # Shards are instrumented in their own processes
+            trace_shards(
+                start_block,
+                end_block,
+                args.shards,
+                args.trace_blocks,
+                args.fresh,
+                options,
+                instrumentation,
+            )
+        else:
+            rpc_cache.enabled = not args.no_cache
+            with instrument(instrumentation, f"{start_block}-{end_block}"):
+                asyncio.run(
+                    trace_memory(start_block, end_block, args.trace_blocks, args.fresh, options)
+                )
@@ -0,0 +1,430 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from tracer.config import (
+    HISTOGRAM_PRECISION,
+    INSTRUCTIONS,
+    SUMMARY_OFFSET_COUNTERS,
+    SUMMARY_PERCENTILES,
+    SUMMARY_TOP_OFFSETS,
+)
+from tracer.frames import UINT64_MAX, CallFrameColumns, count_rows, saturate_uint64
+
+# Columns summarized for every opcode, like in the analysis notebook
+SUMMARY_COLUMNS = [
+    "memory_access_size",
+    "memory_expansion",
+    "opcode_gas_cost",
+    "memory_access_offset",
+]
+
+# Instructions are summarized in slots, in the order of `INSTRUCTIONS`
+MNEMONICS = list(INSTRUCTIONS)
+OPCODE_SLOTS = np.zeros(256, dtype=np.int64)
+for _slot, _instruction in enumerate(INSTRUCTIONS.values()):
+    OPCODE_SLOTS[int(_instruction["opcode"], 16)] = _slot
+# Offset counters of all the instructions together are kept in an extra slot
+ALL_SLOT = len(MNEMONICS)
+
+# Values below 2**HISTOGRAM_PRECISION have a bucket each. Above it, the buckets of
+# every power of two split it into 2**(HISTOGRAM_PRECISION - 1) equal parts.
+SUB_BUCKETS = 2 ** (HISTOGRAM_PRECISION - 1)
+HISTOGRAM_SIZE = (64 - HISTOGRAM_PRECISION + 2) * SUB_BUCKETS
+
+# The call depth is at most 1024, plus the depth of the transaction itself
+MAX_CALL_DEPTH = 1025
+
+STATE_FILE_NAME = "aggregate.npz"
+SUMMARY_FILE_NAME = "summary.json"
+
+
+def get_bit_lengths(values: np.ndarray) -> np.ndarray:
+    """
+    Get the number of bits of integers, like `int.bit_length`.
+
+    Args:
+        values (np.ndarray): An uint64 array.
+
+    Returns:
+        np.ndarray: The number of bits of each value.
+    """
+    values = values.copy()
+    bit_lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = values >= np.uint64(1 << shift)
+        bit_lengths += wide * shift
+        values[wide] >>= np.uint64(shift)
+    return bit_lengths + (values > 0)
+
+
+def get_buckets(values: np.ndarray) -> np.ndarray:
+    """
+    Get the histogram bucket of values.
+
+    Args:
+        values (np.ndarray): An uint64 array.
+
+    Returns:
+        np.ndarray: The index of the bucket of each value.
+    """
+    shifts = np.maximum(get_bit_lengths(values) - HISTOGRAM_PRECISION, 0)
+    return shifts * SUB_BUCKETS + (values >> shifts.astype(np.uint64)).astype(np.int64)
+
+
+def get_bucket_value(bucket: int) -> int:
+    """
+    Get the value representing a histogram bucket.
+
+    Args:
+        bucket (int): The index of the bucket.
+
+    Returns:
+        int: The middle of the values of the bucket.
+    """
+    shift = max(bucket // SUB_BUCKETS - 1, 0)
+    lower = (bucket - shift * SUB_BUCKETS) << shift
+    return lower + ((1 << shift) - 1) // 2
+
+
+def get_percentiles(histogram: np.ndarray, minimum: int, maximum: int) -> Dict[str, int]:
+    """
+    Estimate percentiles from a histogram.
+
+    Args:
+        histogram (np.ndarray): The number of values of each bucket.
+        minimum (int): The smallest value.
+        maximum (int): The largest value.
+
+    Returns:
+        Dict[str, int]: The value of each percentile of `SUMMARY_PERCENTILES`.
+    """
+    cumulative = np.cumsum(histogram)
+    percentiles = {}
+    for percentile in SUMMARY_PERCENTILES:
+        rank = max(int(np.ceil(percentile / 100 * cumulative[-1])), 1)
+        bucket = int(np.searchsorted(cumulative, rank))
+        percentiles[str(percentile)] = min(max(get_bucket_value(bucket), minimum), maximum)
+    return percentiles
+
+
+def get_statistics(
+    count: int, total: float, minimum: int, maximum: int, histogram: np.ndarray
+) -> Dict[str, Any]:
+    """
+    Summarize a column.
+
+    Args:
+        count (int): The number of values.
+        total (float): The sum of the values.
+        minimum (int): The smallest value.
+        maximum (int): The largest value.
+        histogram (np.ndarray): The number of values of each bucket.
+
+    Returns:
+        Dict[str, Any]: The count, sum, mean, minimum, maximum and percentiles.
+    """
+    if not count:
+        return {"count": 0}
+    return {
+        "count": count,
+        "sum": total,
+        "mean": total / count,
+        "min": minimum,
+        "max": maximum,
+        "percentiles": get_percentiles(histogram, minimum, maximum),
+    }
+
+
+class CallFrameAggregator:
+    def __init__(self):
+        """
+        Initialize the online aggregate of call frames, which computes the statistics of
+        the analysis notebook while tracing instead of from the full dataset.
+
+        Every batch of call frames updates streaming counts, sums, minimums, maximums and
+        histograms of each column per opcode, counters of the most frequently accessed
+        offsets, and the distribution of the maximum call depth of transactions. The state
+        only depends on the number of instructions, not on the number of call frames.
+        """
+        slots = len(MNEMONICS)
+        columns = len(SUMMARY_COLUMNS)
+
+        self.counts = np.zeros(slots, dtype=np.int64)
+        self.sums = np.zeros((columns, slots), dtype=np.float64)
+        self.minimums = np.full((columns, slots), UINT64_MAX, dtype=np.uint64)
+        self.maximums = np.zeros((columns, slots), dtype=np.uint64)
+        self.histograms = np.zeros((columns, slots, HISTOGRAM_SIZE), dtype=np.int64)
+        # The number of transactions by the maximum call depth reached
+        self.depth_counts = np.zeros(MAX_CALL_DEPTH + 1, dtype=np.int64)
+
+        # Counts of accessed offsets per slot, and the largest count dropped from them,
+        # which bounds how much a count may be underestimated.
+        self.offset_counts: List[Dict[int, int]] = [{} for _ in range(slots + 1)]
+        self.offset_errors = np.zeros(slots + 1, dtype=np.int64)
+
+    def is_empty(self) -> bool:
+        """
+        Check whether any call frame was aggregated.
+
+        Returns:
+            bool: True if no call frame was added.
+        """
+        return not self.counts.any()
+
+    def update(self, columns: CallFrameColumns):
+        """
+        Add a batch of call frames to the aggregate.
+
+        Args:
+            columns (CallFrameColumns): The call frame columns. The call frames of a
+                transaction must all be in the same batch.
+        """
+        if not count_rows(columns):
+            return
+
+        slots = OPCODE_SLOTS[columns["opcode"]]
+        self.counts += np.bincount(slots, minlength=len(self.counts))
+
+        for index, name in enumerate(SUMMARY_COLUMNS):
+            values = saturate_uint64(columns[name])
+            self.sums[index] += np.bincount(
+                slots, weights=values.astype(np.float64), minlength=len(self.counts)
+            )
+            np.minimum.at(self.minimums[index], slots, values)
+            np.maximum.at(self.maximums[index], slots, values)
+            self.histograms[index] += np.bincount(
+                slots * HISTOGRAM_SIZE + get_buckets(values),
+                minlength=self.histograms[index].size,
+            ).reshape(self.histograms[index].shape)
+
+        offsets = saturate_uint64(columns["memory_access_offset"])
+        for slot in np.unique(slots):
+            self.count_offsets(slot, offsets[slots == slot])
+        self.count_offsets(ALL_SLOT, offsets)
+
+        # The call frames of a transaction are next to each other
+        transaction_ids = columns["transaction_id"]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(transaction_ids)) + 1))
+        max_depths = np.maximum.reduceat(columns["call_depth"].astype(np.int64), starts)
+        self.depth_counts += np.bincount(
+            np.minimum(max_depths, MAX_CALL_DEPTH), minlength=len(self.depth_counts)
+        )
+
+    def count_offsets(self, slot: int, offsets: np.ndarray):
+        """
+        Count accessed offsets, keeping about `SUMMARY_OFFSET_COUNTERS` distinct offsets.
+
+        Args:
+            slot (int): The slot of the instruction, or `ALL_SLOT` for all of them.
+            offsets (np.ndarray): The accessed offsets.
+        """
+        counts = self.offset_counts[slot]
+        values, value_counts = np.unique(offsets, return_counts=True)
+        for value, count in zip(values.tolist(), value_counts.tolist()):
+            counts[value] = counts.get(value, 0) + count
+
+        # Dropping the rarest offsets only once twice as many are counted amortizes the sort
+        if len(counts) > 2 * SUMMARY_OFFSET_COUNTERS:
+            ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+            self.offset_errors[slot] = max(
+                self.offset_errors[slot], ranked[SUMMARY_OFFSET_COUNTERS][1]
+            )
+            self.offset_counts[slot] = dict(ranked[:SUMMARY_OFFSET_COUNTERS])
+
+    def merge(self, other: "CallFrameAggregator"):
+        """
+        Add the aggregate of other call frames, e.g. of another shard of a range.
+
+        Args:
+            other (CallFrameAggregator): The aggregate to add.
+        """
+        self.counts += other.counts
+        self.sums += other.sums
+        np.minimum(self.minimums, other.minimums, out=self.minimums)
+        np.maximum(self.maximums, other.maximums, out=self.maximums)
+        self.histograms += other.histograms
+        self.depth_counts += other.depth_counts
+
+        for slot, counts in enumerate(other.offset_counts):
+            for value, count in counts.items():
+                self.offset_counts[slot][value] = self.offset_counts[slot].get(value, 0) + count
+        self.offset_errors += other.offset_errors
+
+    def get_top_offsets(self, slot: int) -> List[List[int]]:
+        """
+        Get the most frequently accessed offsets.
+
+        Args:
+            slot (int): The slot of the instruction, or `ALL_SLOT` for all of them.
+
+        Returns:
+            List[List[int]]: Up to `SUMMARY_TOP_OFFSETS` `[offset, count]` pairs, by
+                decreasing count.
+        """
+        ranked = sorted(self.offset_counts[slot].items(), key=lambda item: item[1], reverse=True)
+        return [[value, count] for value, count in ranked[:SUMMARY_TOP_OFFSETS]]
+
+    def get_column_statistics(self, index: int, slot: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Summarize a column of the call frames of an instruction, or of all of them.
+
+        Args:
+            index (int): The index of the column in `SUMMARY_COLUMNS`.
+            slot (Optional[int]): The slot of the instruction, or None for all of them.
+
+        Returns:
+            Dict[str, Any]: The statistics of the column.
+        """
+        if slot is None:
+            return get_statistics(
+                int(self.counts.sum()),
+                float(self.sums[index].sum()),
+                int(self.minimums[index].min()),
+                int(self.maximums[index].max()),
+                self.histograms[index].sum(axis=0),
+            )
+        return get_statistics(
+            int(self.counts[slot]),
+            float(self.sums[index, slot]),
+            int(self.minimums[index, slot]),
+            int(self.maximums[index, slot]),
+            self.histograms[index, slot],
+        )
+
+    def get_summary(self) -> Dict[str, Any]:
+        """
+        Get the headline statistics of the aggregated call frames.
+
+        Returns:
+            Dict[str, Any]: The statistics of every column overall and per opcode, the
+                most frequently accessed offsets, and the distribution of the maximum
+                call depth of transactions.
+        """
+        total = int(self.counts.sum())
+        depths = np.arange(len(self.depth_counts))
+        transactions = int(self.depth_counts.sum())
+        depth_histogram = np.zeros(HISTOGRAM_SIZE, dtype=np.int64)
+        # Depths are small enough for their buckets to be exact
+        depth_histogram[: len(self.depth_counts)] = self.depth_counts
+        present_depths = depths[self.depth_counts > 0]
+
+        opcodes = {}
+        for slot, mnemonic in enumerate(MNEMONICS):
+            if not self.counts[slot]:
+                continue
+            opcodes[mnemonic] = {
+                "count": int(self.counts[slot]),
+                "share": float(self.counts[slot] / total),
+                **{
+                    name: self.get_column_statistics(index, slot)
+                    for index, name in enumerate(SUMMARY_COLUMNS)
+                },
+                "top_offsets": self.get_top_offsets(slot),
+                "top_offsets_error": int(self.offset_errors[slot]),
+            }
+
+        return {
+            "call_frames": total,
+            "columns": {
+                name: self.get_column_statistics(index)
+                for index, name in enumerate(SUMMARY_COLUMNS)
+            },
+            "opcodes": opcodes,
+            "top_offsets": self.get_top_offsets(ALL_SLOT),
+            "top_offsets_error": int(self.offset_errors[ALL_SLOT]),
+            "max_call_depth": get_statistics(
+                transactions,
+                float((depths * self.depth_counts).sum()),
+                int(present_depths.min()) if transactions else 0,
+                int(present_depths.max()) if transactions else 0,
+                depth_histogram,
+            ),
+        }
+
+    def save(self, directory: str, file_name: str = STATE_FILE_NAME):
+        """
+        Atomically write the state of the aggregate, so that it can be resumed or merged.
+
+        Args:
+            directory (str): The output directory of the range.
+            file_name (str): The name of the state file in the directory.
+        """
+        slots, values, counts = [], [], []
+        for slot, offset_counts in enumerate(self.offset_counts):
+            slots.extend([slot] * len(offset_counts))
+            values.extend(offset_counts.keys())
+            counts.extend(offset_counts.values())
+
+        file_name = os.path.join(directory, file_name)
+        # Write to a temporary file first so that a crash never leaves a corrupt state
+        temp_file_name = f"{file_name}.tmp"
+        with open(temp_file_name, "wb") as f:
+            np.savez_compressed(
+                f,
+                counts=self.counts,
+                sums=self.sums,
+                minimums=self.minimums,
+                maximums=self.maximums,
+                histograms=self.histograms,
+                depth_counts=self.depth_counts,
+                offset_slots=np.asarray(slots, dtype=np.int64),
+                offset_values=np.asarray(values, dtype=np.uint64),
+                offset_counts=np.asarray(counts, dtype=np.int64),
+                offset_errors=self.offset_errors,
+            )
+        os.replace(temp_file_name, file_name)
+
+    @classmethod
+    def load(cls, directory: str, file_name: str = STATE_FILE_NAME) -> "CallFrameAggregator":
+        """
+        Read the state of an aggregate.
+
+        Args:
+            directory (str): The output directory of the range.
+            file_name (str): The name of the state file in the directory.
+
+        Returns:
+            CallFrameAggregator: The aggregate, empty if no state was saved.
+        """
+        aggregator = cls()
+        file_name = os.path.join(directory, file_name)
+        if not os.path.exists(file_name):
+            return aggregator
+
+        with np.load(file_name) as state:
+            aggregator.counts = state["counts"]
+            aggregator.sums = state["sums"]
+            aggregator.minimums = state["minimums"]
+            aggregator.maximums = state["maximums"]
+            aggregator.histograms = state["histograms"]
+            aggregator.depth_counts = state["depth_counts"]
+            aggregator.offset_errors = state["offset_errors"]
+            for slot, value, count in zip(
+                state["offset_slots"].tolist(),
+                state["offset_values"].tolist(),
+                state["offset_counts"].tolist(),
+            ):
+                aggregator.offset_counts[slot][value] = count
+        return aggregator
+
+    def write_summary(self, directory: str, start_block: int, end_block: int) -> str:
+        """
+        Write the summary file of a range, along with the state of the aggregate.
+
+        Args:
+            directory (str): The output directory of the range.
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+
+        Returns:
+            str: The path of the summary file.
+        """
+        self.save(directory)
+        file_name = os.path.join(directory, SUMMARY_FILE_NAME)
+        summary = {"start_block": start_block, "end_block": end_block, **self.get_summary()}
+        with open(file_name, "w") as f:
+            json.dump(summary, f, indent=2)
+        return file_name
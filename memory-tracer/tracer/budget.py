@@ -0,0 +1,154 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Optional
+
+from tracer.config import MEMORY_BUDGET, RPC_INITIAL_CONCURRENCY
+from tracer.metrics import metrics
+from tracer.scheduler import moving_average
+
+# Weight of the latest task in the moving average of the response bytes of a task
+SIZE_SMOOTHING = 0.2
+
+
+class Reservation:
+    def __init__(self, budget: "MemoryBudget", amount: int):
+        """
+        Initialize the share of the memory budget held by a single task.
+
+        Args:
+            budget (MemoryBudget): The budget the share is taken from.
+            amount (int): The number of bytes reserved up front.
+        """
+        self.budget = budget
+        self.amount = amount
+        self.used = 0
+
+    def add(self, size: int):
+        """
+        Record response bytes received by the task, growing the reservation if they
+        exceed it. The task already holds the bytes, so this never waits.
+
+        Args:
+            size (int): The number of bytes received.
+        """
+        self.used += size
+        if self.used > self.amount:
+            self.budget.used += self.used - self.amount
+            self.amount = self.used
+
+
+# Reservation of the task running in the current context, if any
+current_reservation: ContextVar[Optional[Reservation]] = ContextVar(
+    "current_reservation", default=None
+)
+
+
+def record_response_size(size: int):
+    """
+    Charge the bytes of an RPC response to the reservation of the current task.
+
+    Args:
+        size (int): The size of the response body in bytes.
+    """
+    reservation = current_reservation.get()
+    if reservation is not None:
+        reservation.add(size)
+
+
+class MemoryBudget:
+    def __init__(self, capacity: int = MEMORY_BUDGET):
+        """
+        Initialize the budget capping the bytes of RPC responses held by tasks in flight.
+
+        The size of responses is only known once they arrive, so every task reserves the
+        average size of previous tasks before starting, and its reservation grows if its
+        responses turn out larger. New tasks wait while the budget is spent, which holds
+        back fetching until earlier tasks have been decoded and written.
+
+        Args:
+            capacity (int): The maximum number of bytes held in flight, 0 for no limit.
+        """
+        self.capacity = capacity
+        self.used = 0
+        self.estimate: Optional[float] = None
+        self.waiters: Deque[asyncio.Future] = deque()
+
+    def get_estimate(self) -> int:
+        """
+        Get the number of bytes a new task reserves.
+
+        Returns:
+            int: The average response bytes of a task, or an equal share of the budget
+                between the initial number of requests in flight before any task finished.
+        """
+        if self.estimate is None:
+            return self.capacity // RPC_INITIAL_CONCURRENCY
+        return int(self.estimate)
+
+    def wake(self):
+        """
+        Wake up waiting tasks, in order, while the budget allows.
+        """
+        while self.waiters and (
+            self.used == 0 or self.used + self.get_estimate() <= self.capacity
+        ):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                # The woken task reserves its share before the next one is considered
+                return
+
+    async def acquire(self) -> Reservation:
+        """
+        Wait until the budget allows a new task, and reserve its share.
+
+        A task is always allowed when nothing else is in flight, so that a single task
+        larger than the budget still runs.
+
+        Returns:
+            Reservation: The share of the budget held by the task.
+        """
+        if self.capacity:
+            while self.used and self.used + self.get_estimate() > self.capacity:
+                waiter = asyncio.get_running_loop().create_future()
+                self.waiters.append(waiter)
+                await waiter
+
+        amount = self.get_estimate()
+        self.used += amount
+        # Let the next waiting task check whether it fits as well
+        self.wake()
+        return Reservation(self, amount)
+
+    def release(self, reservation: Reservation):
+        """
+        Return the share of a finished task to the budget.
+
+        Args:
+            reservation (Reservation): The share of the task.
+        """
+        self.used -= reservation.amount
+        self.estimate = moving_average(self.estimate, reservation.used, SIZE_SMOOTHING)
+        self.wake()
+
+    @asynccontextmanager
+    async def reserve(self):
+        """
+        Hold a share of the budget for the duration of the context. Responses received
+        within the context are charged to it.
+        """
+        reservation = await self.acquire()
+        token = current_reservation.set(reservation)
+        try:
+            yield reservation
+        finally:
+            current_reservation.reset(token)
+            self.release(reservation)
+
+
+memory_budget = MemoryBudget()
+
+metrics.register_gauge("budget_used_bytes", lambda: memory_budget.used)
+metrics.register_gauge("tasks_waiting_for_budget", lambda: len(memory_budget.waiters))
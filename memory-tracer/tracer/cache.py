@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, TypeVar
+
+from tracer.config import RPC_CACHE_FILE, RPC_CACHE_MAX_SIZE
+
+# Methods whose results never change once the block they refer to is final
+CACHEABLE_METHODS = {
+    "eth_getBlockByNumber",
+    "eth_getBlockTransactionCountByNumber",
+    "eth_getBlockReceipts",
+    "debug_traceTransaction",
+    "debug_traceBlockByNumber",
+}
+
+# Share of the maximum size the cache is trimmed down to when it overflows, so that
+# eviction does not run again on the next insert.
+EVICTION_TARGET = 0.9
+
+T = TypeVar("T")
+
+
+def is_cacheable(method: str, params: list) -> bool:
+    """
+    Check whether the result of a request can be cached.
+
+    Block tags such as "latest" refer to a different block over time,
+    so only requests for explicit block numbers or transaction hashes are cached.
+
+    Args:
+        method (str): The JSON-RPC method.
+        params (list): Parameters for the JSON-RPC method.
+
+    Returns:
+        bool: True if the result never changes.
+    """
+    return (
+        method in CACHEABLE_METHODS
+        and bool(params)
+        and isinstance(params[0], str)
+        and params[0].startswith("0x")
+    )
+
+
+def get_cache_key(method: str, params: list) -> str:
+    """
+    Get the key a request is cached under.
+
+    Tracer options, including the source of the JS tracer, are part of the params,
+    so traces are cached separately for every version of the tracer.
+
+    Args:
+        method (str): The JSON-RPC method.
+        params (list): Parameters for the JSON-RPC method.
+
+    Returns:
+        str: The SHA-256 hash of the method and params.
+    """
+    request = json.dumps([method, params], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+class RpcCache:
+    def __init__(self, file_name: str, max_size: int):
+        """
+        Initialize the on-disk cache of RPC results.
+
+        Results are stored as compressed JSON in a SQLite database, addressed by the hash
+        of their request. The database is opened on first use, once per thread of each
+        process, so that neither worker processes nor threads share a connection. Queries
+        made from the event loop run on a dedicated thread of the process, see `run`.
+
+        Args:
+            file_name (str): The path of the SQLite database.
+            max_size (int): The size in bytes of compressed results above which the least
+                recently used results are evicted.
+        """
+        self.file_name = file_name
+        self.max_size = max_size
+        self.enabled = True
+
+        self.local = threading.local()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.executor_pid: Optional[int] = None
+        self.size = 0
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the database of the current thread, creating it if needed.
+
+        Returns:
+            sqlite3.Connection: The connection to the database.
+        """
+        connection = getattr(self.local, "connection", None)
+        # Forked processes inherit the connection of the forking thread
+        if connection is not None and self.local.pid == os.getpid():
+            return connection
+
+        directory = os.path.dirname(self.file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Shards write to the same database from several processes
+        connection = sqlite3.connect(self.file_name, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """)
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)"
+        )
+        connection.commit()
+        self.local.connection = connection
+        self.local.pid = os.getpid()
+        self.size = self.get_size()
+        return connection
+
+    async def run(self, function: Callable[..., T], *args: Any) -> T:
+        """
+        Run a method of the cache on its thread, so that the event loop is not blocked by
+        queries, compression or eviction.
+
+        Queries of the event loop are serialized on a single thread per process, which
+        keeps its own connection to the database.
+
+        Args:
+            function (Callable[..., T]): The method to run, e.g. `rpc_cache.get_many`.
+            *args (Any): Arguments of the method.
+
+        Returns:
+            T: The result of the method.
+        """
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rpc-cache")
+            self.executor_pid = os.getpid()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(function, *args))
+
+    def get_size(self) -> int:
+        """
+        Get the size of the cached results.
+
+        Returns:
+            int: The size in bytes of the compressed results.
+        """
+        (size,) = self.connect().execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        return size
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Look up cached results, marking them as recently used.
+
+        Args:
+            keys (List[str]): The keys of the requests.
+
+        Returns:
+            Dict[str, Any]: The results found in the cache, by key.
+        """
+        if not self.enabled or not keys:
+            return {}
+
+        connection = self.connect()
+        placeholders = ",".join("?" * len(keys))
+        rows = connection.execute(
+            f"SELECT key, value FROM results WHERE key IN ({placeholders})", keys
+        ).fetchall()
+
+        if rows:
+            connection.execute(
+                f"UPDATE results SET accessed_at = ? WHERE key IN ({placeholders})",
+                [time.time(), *keys],
+            )
+            connection.commit()
+
+        return {key: json.loads(zlib.decompress(value)) for key, value in rows}
+
+    def has_many(self, keys: List[str]) -> Set[str]:
+        """
+        Find the requests whose results are cached, without reading the results or marking
+        them as recently used.
+
+        Args:
+            keys (List[str]): The keys of the requests.
+
+        Returns:
+            Set[str]: The keys found in the cache.
+        """
+        if not self.enabled or not keys:
+            return set()
+
+        placeholders = ",".join("?" * len(keys))
+        rows = (
+            self.connect()
+            .execute(f"SELECT key FROM results WHERE key IN ({placeholders})", keys)
+            .fetchall()
+        )
+        return {key for (key,) in rows}
+
+    def put_many(self, results: Dict[str, Any]):
+        """
+        Store results in the cache, evicting the least recently used results if it is full.
+
+        Args:
+            results (Dict[str, Any]): The results to store, by key.
+        """
+        if not self.enabled or not results:
+            return
+
+        connection = self.connect()
+        now = time.time()
+        rows = []
+        for key, result in results.items():
+            value = zlib.compress(json.dumps(result, separators=(",", ":")).encode())
+            rows.append((key, value, len(value), now))
+            self.size += len(value)
+
+        connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+        connection.commit()
+
+        if self.max_size and self.size > self.max_size:
+            self.evict()
+
+    def delete_many(self, keys: List[str]):
+        """
+        Remove results from the cache, e.g. those of blocks replaced by a reorg.
+
+        Args:
+            keys (List[str]): The keys of the requests.
+        """
+        if not self.enabled or not keys:
+            return
+
+        connection = self.connect()
+        connection.executemany("DELETE FROM results WHERE key = ?", [(key,) for key in keys])
+        connection.commit()
+        self.size = self.get_size()
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache is back under its size.
+        """
+        connection = self.connect()
+
+        # Other processes may have added or evicted results
+        self.size = self.get_size()
+        excess = self.size - int(self.max_size * EVICTION_TARGET)
+        if excess <= 0:
+            return
+
+        removed = 0
+        keys = []
+        for key, size in connection.execute("SELECT key, size FROM results ORDER BY accessed_at"):
+            keys.append((key,))
+            removed += size
+            if removed >= excess:
+                break
+
+        connection.executemany("DELETE FROM results WHERE key = ?", keys)
+        connection.commit()
+        self.size -= removed
+
+    def get(self, method: str, params: list) -> Optional[Any]:
+        """
+        Look up the cached result of a single request.
+
+        Args:
+            method (str): The JSON-RPC method.
+            params (list): Parameters for the JSON-RPC method.
+
+        Returns:
+            Optional[Any]: The cached result, or None if the request is not cached.
+        """
+        key = get_cache_key(method, params)
+        return self.get_many([key]).get(key)
+
+
+rpc_cache = RpcCache(RPC_CACHE_FILE, RPC_CACHE_MAX_SIZE)
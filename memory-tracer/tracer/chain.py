@@ -1,32 +1,131 @@
-from typing import Dict, List
+import asyncio
+import logging
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
 
 from aiohttp import ClientSession
 
-from tracer.rpc import get_block, get_transaction_trace
+from tracer.config import INSTRUCTIONS, SKIP_PLAIN_TRANSFERS
+from tracer.metrics import metrics
+from tracer.rpc import (
+    METHOD_NOT_FOUND_ERROR_CODE,
+    RpcError,
+    get_block,
+    get_block_receipts,
+    get_block_traces,
+    get_block_transaction_counts,
+    get_blocks,
+    get_transaction_trace,
+    get_transaction_traces,
+)
+
+# The number of memory regions accessed by each instruction, by opcode number
+REGION_COUNTS = {
+    int(instruction["opcode"], 16): len(instruction["stack_input_positions"])
+    for instruction in INSTRUCTIONS.values()
+}
+
+# The intrinsic gas of a call without input data or access list
+TRANSFER_GAS = 21000
 
 
 class TransactionState:
     def __init__(self):
         self.transaction_id = 1
+        # First transaction id of each block. When set, ids are derived from the position
+        # of transactions in the range instead of the order blocks are fetched in.
+        self.block_offsets: Dict[int, int] = {}
 
     def get_next_id(self) -> int:
         tx_id = self.transaction_id
         self.transaction_id += 1
         return tx_id
 
+    def get_id(self, block_number: int, index: int) -> int:
+        """
+        Get the id of a transaction.
+
+        Args:
+            block_number (int): The number of the block of the transaction.
+            index (int): The position of the transaction in the block.
+
+        Returns:
+            int: The id of the transaction.
+        """
+        if block_number in self.block_offsets:
+            return self.block_offsets[block_number] + index
+        return self.get_next_id()
+
 
 transaction_state = TransactionState()
 
+# Cleared once the node reports that it does not support eth_getBlockReceipts, so that
+# receipts are no longer requested
+block_receipts_supported = True
 
-async def get_transactions_from_block(
-    block_number: int, session: ClientSession
+
+def is_plain_transfer(tx: dict, receipt: dict) -> bool:
+    """
+    Check whether a transaction executed no instruction, so that it never accessed memory.
+
+    A call without input data that used exactly its intrinsic gas sent Ether to an account
+    without code (or to code that stopped right away), as every other instruction costs gas.
+    Gas refunds are lower than the gas of the instructions earning them since London, and
+    could only offset them exactly in contrived cases before.
+
+    Args:
+        tx (dict): The transaction object.
+        receipt (dict): The receipt of the transaction.
+
+    Returns:
+        bool: True if tracing the transaction would return no memory access.
+    """
+    return (
+        bool(tx.get("to"))
+        and tx.get("input", "0x") in ("", "0x")
+        and int(receipt["gasUsed"], 16) == TRANSFER_GAS
+    )
+
+
+def parse_transactions(
+    block_number: int, block: dict, receipts: Optional[List[dict]] = None
 ) -> List[Dict[str, str]]:
+    """
+    Assign ids to the transactions of a block and extract their summary.
+
+    Args:
+        block_number (int): The number of the block.
+        block (dict): The block data, with full transaction objects.
+        receipts (Optional[List[dict]]): The receipts of the transactions of the block,
+            to flag plain transfers as not traced.
+
+    Returns:
+        List[Dict[str, str]]: A list of dictionaries containing transaction information.
 
+    Raises:
+        Exception: If the receipts do not line up with the block's transactions.
+    """
     transactions: List[Dict[str, str]] = []
 
-    block = await get_block(hex(block_number), session)
-    for tx in block.get("transactions", []):
-        tx_id = transaction_state.get_next_id()
+    block_transactions = block.get("transactions", [])
+    if receipts is not None and len(receipts) != len(block_transactions):
+        raise Exception(
+            f"Block {block_number} has {len(block_transactions)} transactions "
+            f"but {len(receipts)} receipts"
+        )
+
+    for index, tx in enumerate(block_transactions):
+        traced = True
+        if receipts is not None:
+            receipt = receipts[index]
+            if receipt.get("transactionHash", tx.get("hash")) != tx.get("hash"):
+                raise Exception(
+                    f"Receipt for {receipt['transactionHash']} does not match "
+                    f"transaction {tx.get('hash')} in block {block_number}"
+                )
+            traced = not is_plain_transfer(tx, receipt)
+
+        tx_id = transaction_state.get_id(block_number, index)
         transactions.append(
             {
                 "id": str(tx_id),
@@ -34,38 +133,130 @@ async def get_transactions_from_block(
                 "tx_hash": tx.get("hash", ""),
                 "to": tx.get("to", ""),
                 "tx_gas": str(int(tx.get("gas", "0x0"), 0)),
+                "traced": "1" if traced else "0",
             }
         )
 
     return transactions
 
 
-async def get_call_frames_from_transaction(
-    transaction: Dict[str, str], session: ClientSession
+async def get_transaction_counts(block_numbers: List[int], session: ClientSession) -> List[int]:
+    """
+    Get the number of transactions of a batch of blocks using a single batched RPC request.
+
+    Args:
+        block_numbers (List[int]): The block numbers to count transactions for.
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        List[int]: The number of transactions of each block.
+    """
+    return await get_block_transaction_counts(
+        [hex(block_number) for block_number in block_numbers], session
+    )
+
+
+async def get_transactions_from_block(
+    block_number: int, session: ClientSession
+) -> List[Dict[str, str]]:
+
+    block = await get_block(hex(block_number), session)
+    return parse_transactions(block_number, block)
+
+
+async def get_receipts_if_supported(
+    block_numbers: List[str], session: ClientSession
+) -> List[Optional[List[dict]]]:
+    """
+    Get the receipts of a batch of blocks, if the node returns them.
+
+    Receipts only serve to skip plain transfers, so a node that does not support
+    eth_getBlockReceipts, or a batch whose receipts cannot be fetched, only costs the
+    traces of the plain transfers.
+
+    Args:
+        block_numbers (List[str]): The block numbers (hexadecimal format).
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        List[Optional[List[dict]]]: For each block, the receipts of its transactions, or
+            None if they could not be fetched.
+    """
+    global block_receipts_supported
+    if block_receipts_supported:
+        try:
+            return await get_block_receipts(block_numbers, session)
+        except Exception as e:
+            if isinstance(e, RpcError) and e.code == METHOD_NOT_FOUND_ERROR_CODE:
+                # Batches already in flight fail the same way, and are not reported again
+                if block_receipts_supported:
+                    block_receipts_supported = False
+                    message = "eth_getBlockReceipts is not supported, tracing every transaction"
+                    logging.warning(message)
+                    print(message)
+            else:
+                logging.warning(f"Tracing every transaction of blocks without receipts: {e}")
+    return [None] * len(block_numbers)
+
+
+async def get_transactions_from_blocks(
+    block_numbers: List[int],
+    session: ClientSession,
+    skip_plain_transfers: bool = SKIP_PLAIN_TRANSFERS,
 ) -> List[Dict[str, str]]:
     """
-    Get call frames from a transaction by fetching the trace data.
+    Get transactions from a batch of blocks using a single batched RPC request.
 
     Args:
-        transaction (Dict[str, str]): The transaction details including 'id' and 'tx_hash'.
+        block_numbers (List[int]): The block numbers to fetch transactions for.
         session (ClientSession): The aiohttp client session for making API requests.
+        skip_plain_transfers (bool): Fetch the receipts of the blocks along with them,
+            in a second batched request, and flag plain transfers as not traced, as their
+            trace would be empty. Otherwise, or if the receipts cannot be fetched, every
+            transaction is flagged as traced.
 
     Returns:
-        List[Dict[str, str]]: A list of dictionaries containing call frame information.
+        List[Dict[str, str]]: A list of dictionaries containing transaction information.
+    """
+    transactions: List[Dict[str, str]] = []
 
-    Raises:
-        ValueError: If 'tx_hash' or 'id' is missing from the transaction.
+    hex_numbers = [hex(block_number) for block_number in block_numbers]
+    if skip_plain_transfers:
+        blocks, block_receipts = await asyncio.gather(
+            get_blocks(hex_numbers, session), get_receipts_if_supported(hex_numbers, session)
+        )
+    else:
+        blocks = await get_blocks(hex_numbers, session)
+        block_receipts = [None] * len(blocks)
+
+    for block_number, block, receipts in zip(block_numbers, blocks, block_receipts):
+        transactions.extend(parse_transactions(block_number, block, receipts))
+
+    metrics.increment("skipped_transactions", sum(tx["traced"] == "0" for tx in transactions))
+    return transactions
+
+
+def parse_call_frames(transaction: Dict[str, str], trace_data: dict) -> List[Dict[str, str]]:
     """
-    if not transaction.get("tx_hash") or not transaction.get("id"):
-        raise ValueError("Transaction must contain 'tx_hash' and 'id'.")
+    Flatten the trace result of a transaction into call frame rows.
 
+    Args:
+        transaction (Dict[str, str]): The transaction details including 'id'.
+        trace_data (dict): The result of the custom memory tracer for the transaction.
+
+    Returns:
+        List[Dict[str, str]]: A list of dictionaries containing call frame information.
+    """
     call_frames: List[Dict[str, str]] = []
-    trace_data = await get_transaction_trace(transaction["tx_hash"], session)
 
     # Ignore failed transactions
     if trace_data["error"]:
         return call_frames
 
+    # Traces of the compact tracer
+    if "packed" in trace_data:
+        return parse_packed_call_frames(transaction, trace_data["packed"])
+
     for instruction in trace_data["data"]:
 
         # Some instructions access multiple memory regions
@@ -84,7 +275,184 @@ async def get_call_frames_from_transaction(
                 "pre_active_memory_size": instruction["pre_memory_size"],
                 "post_active_memory_size": instruction["post_memory_size"],
                 "memory_expansion": instruction["memory_expansion"],
+                "call_frame_index": instruction.get("frame", 0),
+            }
+            call_frames.append(row)
+
+    return call_frames
+
+
+def parse_packed_call_frames(
+    transaction: Dict[str, str], packed: Dict[str, List[int]]
+) -> List[Dict[str, str]]:
+    """
+    Decode the parallel arrays returned by the compact tracer into call frame rows.
+
+    Args:
+        transaction (Dict[str, str]): The transaction details including 'id'.
+        packed (Dict[str, List[int]]): The packed memory accesses of the transaction.
+
+    Returns:
+        List[Dict[str, str]]: A list of dictionaries containing call frame information.
+    """
+    call_frames: List[Dict[str, str]] = []
+
+    opcodes = packed.get("op", [])
+    regions = iter(packed.get("regions", []))
+    for opcode, depth, frame, gas_cost, pre_memory_size, post_memory_size in zip(
+        opcodes,
+        packed.get("depth", []),
+        packed.get("frame") or [0] * len(opcodes),
+        packed.get("gas_cost", []),
+        packed.get("pre_memory_size", []),
+        packed.get("post_memory_size", []),
+    ):
+        # Opcodes are written as hex, like the original tracer does
+        hex_opcode = format(opcode, "02x")
+
+        for _ in range(REGION_COUNTS[opcode]):
+            offset, size = islice(regions, 2)
+            row = {
+                "transaction_id": transaction["id"],
+                "call_depth": depth,
+                "opcode": hex_opcode,
+                "memory_access_offset": offset,
+                "memory_access_size": size,
+                "opcode_gas_cost": gas_cost,
+                "pre_active_memory_size": pre_memory_size,
+                "post_active_memory_size": post_memory_size,
+                "memory_expansion": post_memory_size - pre_memory_size,
+                "call_frame_index": frame,
             }
             call_frames.append(row)
 
     return call_frames
+
+
+async def get_call_frames_from_transaction(
+    transaction: Dict[str, str], session: ClientSession
+) -> List[Dict[str, str]]:
+    """
+    Get call frames from a transaction by fetching the trace data.
+
+    Args:
+        transaction (Dict[str, str]): The transaction details including 'id' and 'tx_hash'.
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        List[Dict[str, str]]: A list of dictionaries containing call frame information.
+
+    Raises:
+        ValueError: If 'tx_hash' or 'id' is missing from the transaction.
+    """
+    if not transaction.get("tx_hash") or not transaction.get("id"):
+        raise ValueError("Transaction must contain 'tx_hash' and 'id'.")
+
+    trace_data = await get_transaction_trace(transaction["tx_hash"], session)
+    return parse_call_frames(transaction, trace_data)
+
+
+async def get_call_frames_from_transactions(
+    transactions: List[Dict[str, str]], session: ClientSession
+) -> List[Dict[str, str]]:
+    """
+    Get call frames from a batch of transactions using a single batched RPC request.
+
+    Args:
+        transactions (List[Dict[str, str]]): The transactions, each including 'id' and 'tx_hash'.
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        List[Dict[str, str]]: A list of dictionaries containing call frame information.
+
+    Raises:
+        ValueError: If 'tx_hash' or 'id' is missing from any transaction.
+    """
+    for transaction in transactions:
+        if not transaction.get("tx_hash") or not transaction.get("id"):
+            raise ValueError("Transaction must contain 'tx_hash' and 'id'.")
+
+    call_frames: List[Dict[str, str]] = []
+
+    traces = await get_transaction_traces([tx["tx_hash"] for tx in transactions], session)
+    for transaction, trace_data in zip(transactions, traces):
+        call_frames.extend(parse_call_frames(transaction, trace_data))
+
+    return call_frames
+
+
+async def get_traced_blocks(
+    block_numbers: List[int], session: ClientSession
+) -> Tuple[List[Dict[str, str]], List[dict]]:
+    """
+    Get the transactions of a batch of blocks and their traces by tracing whole blocks.
+
+    Blocks are traced with `debug_traceBlockByNumber`, so the node executes each block
+    once rather than once per transaction. The per-transaction results are matched to
+    the ids assigned to the block's transactions by position.
+
+    Args:
+        block_numbers (List[int]): The block numbers to trace.
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        Tuple[List[Dict[str, str]], List[dict]]: The transactions of the blocks and the
+            result of the custom memory tracer for each of them.
+
+    Raises:
+        Exception: If a block trace does not line up with the block's transactions, or the
+            node failed to trace a transaction.
+    """
+    hex_numbers = [hex(block_number) for block_number in block_numbers]
+    blocks, block_traces = await asyncio.gather(
+        get_blocks(hex_numbers, session), get_block_traces(hex_numbers, session)
+    )
+
+    transactions: List[Dict[str, str]] = []
+    traces: List[dict] = []
+
+    for block_number, block, block_trace in zip(block_numbers, blocks, block_traces):
+        block_transactions = parse_transactions(block_number, block)
+
+        if len(block_trace) != len(block_transactions):
+            raise Exception(
+                f"Block {block_number} has {len(block_transactions)} transactions "
+                f"but {len(block_trace)} traces"
+            )
+
+        for transaction, trace in zip(block_transactions, block_trace):
+            if trace.get("txHash", transaction["tx_hash"]) != transaction["tx_hash"]:
+                raise Exception(
+                    f"Trace for {trace['txHash']} does not match "
+                    f"transaction {transaction['tx_hash']} in block {block_number}"
+                )
+            if "error" in trace:
+                raise Exception(f"Trace Error ({transaction['tx_hash']}): {trace['error']}")
+            traces.append(trace["result"])
+
+        transactions.extend(block_transactions)
+
+    return transactions, traces
+
+
+async def get_call_frames_from_blocks(
+    block_numbers: List[int], session: ClientSession
+) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Get transactions and their call frames from a batch of blocks by tracing whole blocks.
+
+    Args:
+        block_numbers (List[int]): The block numbers to trace.
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        Tuple[List[Dict[str, str]], List[Dict[str, str]]]: The transactions of the blocks and
+            the call frames of those transactions.
+    """
+    transactions, traces = await get_traced_blocks(block_numbers, session)
+
+    call_frames: List[Dict[str, str]] = []
+    for transaction, trace_data in zip(transactions, traces):
+        call_frames.extend(parse_call_frames(transaction, trace_data))
+
+    return transactions, call_frames
@@ -0,0 +1,320 @@
+import glob
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from tracer.aggregate import STATE_FILE_NAME, CallFrameAggregator
+from tracer.chain import transaction_state
+from tracer.config import CHECKPOINT_INTERVAL, DATA_DIR
+from tracer.fs import (
+    FileType,
+    OutputHandler,
+    OutputOptions,
+    create_output_handler,
+    get_output_directory,
+)
+
+
+def to_ranges(values: Iterable[int]) -> List[List[int]]:
+    """
+    Collapse integers into a sorted list of inclusive `[start, end]` ranges.
+
+    Args:
+        values (Iterable[int]): The integers to collapse.
+
+    Returns:
+        List[List[int]]: The inclusive ranges covering exactly the given integers.
+    """
+    ranges: List[List[int]] = []
+    for value in sorted(values):
+        if ranges and ranges[-1][1] + 1 == value:
+            ranges[-1][1] = value
+        else:
+            ranges.append([value, value])
+    return ranges
+
+
+def from_ranges(ranges: List[List[int]]) -> Set[int]:
+    """
+    Expand inclusive `[start, end]` ranges back into a set of integers.
+
+    Args:
+        ranges (List[List[int]]): The inclusive ranges to expand.
+
+    Returns:
+        Set[int]: The integers covered by the ranges.
+    """
+    return {value for start, end in ranges for value in range(start, end + 1)}
+
+
+class Checkpoint:
+    FILE_NAME = "checkpoint.json"
+    # State of the aggregate covered by each save, numbered so that a new state never
+    # replaces the one the current manifest refers to
+    AGGREGATE_FILE_NAME = "checkpoint_aggregate.{}.npz"
+
+    def __init__(
+        self,
+        start_block: int,
+        end_block: int,
+        options: OutputOptions = OutputOptions(),
+        fresh: bool = False,
+        directory: str = DATA_DIR,
+    ):
+        """
+        Initialize the checkpoint manifest of a tracing run, loading the previous
+        state of the run if one exists.
+
+        Args:
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+            options (OutputOptions): The options the run writes its output with.
+            fresh (bool): Ignore any previous state and start the run from scratch.
+            directory (str): The directory holding the output directories of the ranges.
+        """
+        self.start_block = start_block
+        self.end_block = end_block
+        self.options = options
+        self.data_directory = directory
+        self.directory = get_output_directory(start_block, end_block, directory)
+        self.file_name = os.path.join(self.directory, self.FILE_NAME)
+
+        self.completed_stages: Set[str] = set()
+        self.completed_blocks: Set[int] = set()
+        self.completed_transactions: Set[int] = set()
+        self.last_transaction_id = 0
+        self.total_transactions = 0
+        # Position of each partial output covered by the checkpoint, as returned by `flush`
+        self.segments: Dict[str, Any] = {}
+
+        self.outputs: List[OutputHandler] = []
+        self.pending = 0
+
+        # Statistics of the call frames written so far, and the number of the state file
+        # of the aggregate referred to by the manifest
+        self.aggregator = CallFrameAggregator()
+        self.aggregate_generation: Optional[int] = None
+
+        self.resumed = not fresh and os.path.exists(self.file_name)
+        if self.resumed:
+            self.load()
+
+        # Continue assigning transaction ids where the previous run stopped
+        transaction_state.transaction_id = self.last_transaction_id + 1
+
+    def load(self):
+        """
+        Load the state of a previous run from the manifest.
+        """
+        with open(self.file_name) as f:
+            manifest = json.load(f)
+
+        if manifest["output_options"] != self.serialize_options():
+            raise ValueError(
+                f"Checkpoint {self.file_name} was written with output options "
+                f"{manifest['output_options']}, not {self.serialize_options()}"
+            )
+
+        self.completed_stages = set(manifest["completed_stages"])
+        self.completed_blocks = from_ranges(manifest["completed_blocks"])
+        self.completed_transactions = from_ranges(manifest["completed_transactions"])
+        self.last_transaction_id = manifest["last_transaction_id"]
+        self.total_transactions = manifest["total_transactions"]
+        self.segments = manifest["segments"]
+        # Manifests of older versions have no state file of their own
+        self.aggregate_generation = manifest.get("aggregate_generation")
+        self.aggregator = CallFrameAggregator.load(self.directory, self.get_aggregate_file_name())
+
+    def serialize_options(self) -> Dict[str, Any]:
+        """
+        Serialize the output options, which a resumed run must share.
+
+        Returns:
+            Dict[str, Any]: The output options as JSON values.
+        """
+        return {
+            "output_format": self.options.output_format.value,
+            "compression": self.options.compression and self.options.compression.value,
+            "chunk_size": self.options.chunk_size,
+        }
+
+    def get_aggregate_file_name(self) -> str:
+        """
+        Get the name of the state file of the aggregate referred to by the manifest.
+
+        Returns:
+            str: The name of the file in the output directory of the range.
+        """
+        if self.aggregate_generation is None:
+            return STATE_FILE_NAME
+        return self.AGGREGATE_FILE_NAME.format(self.aggregate_generation)
+
+    def save(self):
+        """
+        Flush the tracked outputs and atomically write the manifest to disk.
+
+        The aggregate is written to a new state file, which the manifest refers to, so
+        that it is committed along with the manifest.
+        """
+        for output in self.outputs:
+            self.segments[output.file_type.value] = output.flush()
+
+        self.last_transaction_id = transaction_state.transaction_id - 1
+
+        # The aggregate covers the same call frames as the flushed outputs
+        previous_aggregate_file_name = None
+        if not self.aggregator.is_empty():
+            if self.aggregate_generation is not None:
+                previous_aggregate_file_name = self.get_aggregate_file_name()
+            self.aggregate_generation = (self.aggregate_generation or 0) + 1
+            self.aggregator.save(self.directory, self.get_aggregate_file_name())
+
+        manifest = {
+            "start_block": self.start_block,
+            "end_block": self.end_block,
+            "output_options": self.serialize_options(),
+            "completed_stages": sorted(self.completed_stages),
+            "completed_blocks": to_ranges(self.completed_blocks),
+            "completed_transactions": to_ranges(self.completed_transactions),
+            "last_transaction_id": self.last_transaction_id,
+            "total_transactions": self.total_transactions,
+            "segments": self.segments,
+            "aggregate_generation": self.aggregate_generation,
+        }
+
+        # Write to a temporary file first so that a crash never leaves a corrupt manifest
+        temp_file_name = f"{self.file_name}.tmp"
+        with open(temp_file_name, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_file_name, self.file_name)
+        self.pending = 0
+
+        # The state of the previous save is no longer referred to
+        if previous_aggregate_file_name is not None:
+            os.remove(os.path.join(self.directory, previous_aggregate_file_name))
+
+    def open_output(self, file_type: FileType) -> OutputHandler:
+        """
+        Open an output handler that continues the segment of a previous run, and track
+        it so its progress is recorded with every save.
+
+        Args:
+            file_type (FileType): The type of file to handle.
+
+        Returns:
+            OutputHandler: The output handler, positioned after the last checkpointed row.
+        """
+        committed_position = self.segments.get(file_type.value)
+        output = create_output_handler(
+            self.start_block,
+            self.end_block,
+            file_type,
+            self.options,
+            committed_position,
+            self.data_directory,
+        )
+        self.outputs.append(output)
+        return output
+
+    async def drain(self):
+        """
+        Wait for the tracked outputs to accept more rows, once they fall behind, and save
+        the manifest once every `CHECKPOINT_INTERVAL` completed tasks.
+        """
+        for output in self.outputs:
+            await output.drain()
+        if self.pending >= CHECKPOINT_INTERVAL:
+            await self.flush_and_save()
+
+    async def flush_and_save(self):
+        """
+        Save the manifest once the tracked outputs have written their queued rows.
+
+        Outputs compressed on a writer thread are waited for without holding the event
+        loop, so the save itself only writes the rows added in the meantime.
+        """
+        # Tasks completed while waiting do not start another save
+        self.pending = 0
+        for output in self.outputs:
+            await output.wait_for_writes()
+        self.save()
+
+    def close_outputs(self):
+        """
+        Close the tracked outputs and stop tracking them. Rows written after the last save
+        are discarded when the outputs are opened again.
+        """
+        for output in self.outputs:
+            output.close()
+        self.outputs = []
+
+    def is_stage_complete(self, file_type: FileType) -> bool:
+        """
+        Check whether the output of a file type was already fully written and compressed.
+
+        Args:
+            file_type (FileType): The type of file produced by the stage.
+
+        Returns:
+            bool: True if the stage completed in a previous run.
+        """
+        return file_type.value in self.completed_stages
+
+    def complete_blocks(self, block_numbers: Iterable[int]):
+        """
+        Record blocks whose output has been written.
+
+        Args:
+            block_numbers (Iterable[int]): The completed block numbers.
+        """
+        self.completed_blocks.update(block_numbers)
+        self.tick()
+
+    def complete_transactions(self, transactions: Iterable[Dict[str, str]]):
+        """
+        Record transactions whose call frames have been written.
+
+        Args:
+            transactions (Iterable[Dict[str, str]]): The completed transactions.
+        """
+        self.completed_transactions.update(int(tx["id"]) for tx in transactions)
+        self.tick()
+
+    def tick(self):
+        """
+        Count a completed task, for `drain` to save the manifest once enough are completed.
+        """
+        self.pending += 1
+
+    def finalize(self, *outputs: OutputHandler):
+        """
+        Compress finished outputs and mark their stages as complete.
+
+        The uncompressed sources are only removed once the manifest records the stages,
+        so a crash while compressing never loses output.
+
+        Args:
+            *outputs (OutputHandler): The finished output handlers.
+        """
+        for output in outputs:
+            output.compress(delete_source=False)
+            self.outputs.remove(output)
+            self.completed_stages.add(output.file_type.value)
+            self.segments.pop(output.file_type.value, None)
+
+        self.save()
+
+        for output in outputs:
+            output.remove_source()
+
+    def remove(self):
+        """
+        Remove the manifest, along with the state of its aggregate, once the run has
+        completed.
+        """
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+        # States left over by interrupted saves or runs are removed as well
+        pattern = os.path.join(glob.escape(self.directory), self.AGGREGATE_FILE_NAME.format("*"))
+        for aggregate_file_name in glob.glob(pattern):
+            os.remove(aggregate_file_name)
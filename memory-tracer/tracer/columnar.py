@@ -0,0 +1,776 @@
+import glob
+import os
+from typing import IO, Dict, Iterator, List, Optional
+
+import numpy as np
+import pyarrow as pa  # type: ignore[import-untyped]
+import pyarrow.compute as pc  # type: ignore[import-untyped]
+import pyarrow.csv as pacsv  # type: ignore[import-untyped]
+import pyarrow.ipc as ipc  # type: ignore[import-untyped]
+import pyarrow.parquet as pq  # type: ignore[import-untyped]
+
+from tracer.config import DATA_DIR, PART_SIZE, ROW_GROUP_SIZE
+from tracer.frames import UINT64_MAX, CallFrameColumns, count_rows, saturate_uint64
+from tracer.fs import (
+    FileType,
+    OutputFormat,
+    OutputOptions,
+    get_output_path,
+    get_part_index,
+    open_compressed_binary,
+)
+from tracer.index import IndexUnit, IndexWriter
+from tracer.metrics import metrics
+
+# The number of bytes of CSV parsed into each record batch when reading CSV output
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Typed schemas of the columnar outputs
+SCHEMAS = {
+    FileType.TRANSACTION: pa.schema(
+        [
+            ("id", pa.uint64()),
+            ("block", pa.uint64()),
+            ("tx_hash", pa.string()),
+            ("tx_gas", pa.uint64()),
+            ("to", pa.string()),
+            ("traced", pa.uint8()),
+        ]
+    ),
+    FileType.CALL_FRAME: pa.schema(
+        [
+            ("transaction_id", pa.uint64()),
+            ("call_depth", pa.uint16()),
+            ("opcode", pa.uint8()),
+            ("memory_access_offset", pa.uint64()),
+            ("memory_access_size", pa.uint64()),
+            ("opcode_gas_cost", pa.uint64()),
+            ("pre_active_memory_size", pa.uint64()),
+            ("post_active_memory_size", pa.uint64()),
+            ("memory_expansion", pa.uint64()),
+            ("call_frame_index", pa.uint32()),
+        ]
+    ),
+    FileType.FRAME: pa.schema(
+        [
+            ("transaction_id", pa.uint64()),
+            ("call_frame_index", pa.uint32()),
+            ("call_depth", pa.uint16()),
+            ("memory_accesses", pa.uint32()),
+            ("peak_active_memory_size", pa.uint64()),
+            ("memory_access_bytes", pa.uint64()),
+            ("memory_expansion_gas", pa.uint64()),
+        ]
+    ),
+}
+
+# Formats whose part files are Parquet files
+PARQUET_FORMATS = (OutputFormat.PARQUET, OutputFormat.COMPACT)
+
+PART_EXTENSIONS = {
+    OutputFormat.PARQUET: "parquet",
+    OutputFormat.ARROW: "arrow",
+    OutputFormat.COMPACT: "parquet",
+}
+
+# Size in bytes of the hex columns stored as raw bytes by the compact format
+COMPACT_BINARY_SIZES = {"tx_hash": 32, "to": 20}
+
+# Physical schemas of the compact format, with raw bytes instead of hex strings
+COMPACT_SCHEMAS = {
+    file_type: pa.schema(
+        [
+            (
+                pa.field(field.name, pa.binary(COMPACT_BINARY_SIZES[field.name]))
+                if field.name in COMPACT_BINARY_SIZES
+                else field
+            )
+            for field in schema
+        ]
+    )
+    for file_type, schema in SCHEMAS.items()
+}
+
+# Columns of the compact format with few distinct values or long runs of the same value,
+# such as opcodes and the transaction ids of consecutive rows, which are dictionary
+# encoded, their codes being run-length encoded. Other integer columns, such as the
+# active memory sizes that grow within a call frame, are delta encoded.
+COMPACT_DICTIONARY_COLUMNS = {
+    "block",
+    "traced",
+    "transaction_id",
+    "call_depth",
+    "opcode",
+    "memory_access_offset",
+    "memory_access_size",
+    "opcode_gas_cost",
+    "memory_expansion",
+    "call_frame_index",
+}
+
+# Compression of the journal of the open part file, which favours speed over size
+JOURNAL_COMPRESSION = "lz4"
+
+# Value of the columns added to the schemas since outputs were first written, for rows of
+# older outputs
+ADDED_COLUMN_VALUES = {"traced": 1, "call_frame_index": 0}
+
+
+def conform_batch(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Cast a record batch to a schema, filling the columns it lacks with their added value.
+
+    Args:
+        batch (pa.RecordBatch): The record batch, possibly written by an older version.
+        schema (pa.Schema): The schema to conform to.
+
+    Returns:
+        pa.RecordBatch: The record batch with the schema.
+    """
+    columns = []
+    for field in schema:
+        if field.name in batch.schema.names:
+            columns.append(pc.cast(batch.column(field.name), field.type))
+        else:
+            value = pa.scalar(ADDED_COLUMN_VALUES[field.name], type=field.type)
+            columns.append(pa.repeat(value, batch.num_rows))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def encode_compact_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """
+    Convert a record batch to the compact format, storing hashes and addresses as bytes.
+
+    Args:
+        batch (pa.RecordBatch): The record batch, with a schema of `SCHEMAS`.
+
+    Returns:
+        pa.RecordBatch: The record batch with the matching schema of `COMPACT_SCHEMAS`.
+    """
+    columns = []
+    fields = []
+    for field in batch.schema:
+        column = batch.column(field.name)
+        if field.name in COMPACT_BINARY_SIZES:
+            field = pa.field(field.name, pa.binary(COMPACT_BINARY_SIZES[field.name]))
+            # Transactions creating a contract have no recipient
+            column = pa.array(
+                [bytes.fromhex(value[2:]) if value else None for value in column.to_pylist()],
+                type=field.type,
+            )
+        columns.append(column)
+        fields.append(field)
+    return pa.RecordBatch.from_arrays(columns, schema=pa.schema(fields))
+
+
+def decode_compact_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """
+    Convert a record batch read from the compact format back to hex strings.
+
+    Args:
+        batch (pa.RecordBatch): The record batch, with a schema of `COMPACT_SCHEMAS`.
+
+    Returns:
+        pa.RecordBatch: The record batch with the matching schema of `SCHEMAS`.
+    """
+    columns = []
+    fields = []
+    for field in batch.schema:
+        column = batch.column(field.name)
+        if field.name in COMPACT_BINARY_SIZES:
+            field = pa.field(field.name, pa.string())
+            column = pa.array(
+                [value and f"0x{value.hex()}" for value in column.to_pylist()], type=field.type
+            )
+        columns.append(column)
+        fields.append(field)
+    return pa.RecordBatch.from_arrays(columns, schema=pa.schema(fields))
+
+
+def get_compact_column_encodings(schema: pa.Schema) -> Dict[str, str]:
+    """
+    Get the Parquet encoding of the columns of the compact format that are not dictionary
+    encoded.
+
+    Args:
+        schema (pa.Schema): The schema of `COMPACT_SCHEMAS`.
+
+    Returns:
+        Dict[str, str]: The encoding of each integer column, by name.
+    """
+    return {
+        field.name: "DELTA_BINARY_PACKED"
+        for field in schema
+        if pa.types.is_integer(field.type) and field.name not in COMPACT_DICTIONARY_COLUMNS
+    }
+
+
+def to_column_value(name: str, data_type: pa.DataType, value):
+    """
+    Convert a value produced by the tracer to the type of its column.
+
+    Args:
+        name (str): The name of the column.
+        data_type (pa.DataType): The type of the column.
+        value: The value to convert, as written to CSV.
+
+    Returns:
+        The converted value.
+    """
+    if value is None or pa.types.is_string(data_type):
+        return value
+
+    # Opcodes are emitted by the tracer as hex strings
+    if name == "opcode":
+        return int(value, 16)
+
+    # Zero sized accesses can have any 256-bit offset, since they never touch memory.
+    # Such offsets are saturated to fit the column.
+    return min(int(value), UINT64_MAX)
+
+
+def from_column_value(name: str, value) -> Optional[str]:
+    """
+    Convert a value read from a column back to its CSV representation.
+
+    Args:
+        name (str): The name of the column.
+        value: The value to convert.
+
+    Returns:
+        Optional[str]: The value as it would appear in the CSV output.
+    """
+    if value is None:
+        return None
+    if name == "opcode":
+        return format(value, "x")
+    return str(value)
+
+
+def to_typed_column(name: str, data_type: pa.DataType, values: pa.Array) -> pa.Array:
+    """
+    Convert a column of CSV values to the type of its column.
+
+    Args:
+        name (str): The name of the column.
+        data_type (pa.DataType): The type of the column.
+        values (pa.Array): The values as written to CSV.
+
+    Returns:
+        pa.Array: The converted values.
+    """
+    if pa.types.is_string(data_type):
+        return values
+
+    if name == "opcode":
+        # There are only a few distinct opcodes, so each is parsed once
+        encoded = pc.dictionary_encode(values)
+        opcodes = np.asarray(
+            [int(opcode, 16) for opcode in encoded.dictionary.to_pylist()], dtype=np.uint8
+        )
+        return pa.array(opcodes[encoded.indices.to_numpy()], type=data_type)
+
+    try:
+        return pc.cast(values, data_type)
+    except pa.ArrowInvalid:
+        # Offsets of zero sized accesses can exceed 64 bits, and are saturated
+        return pa.array(
+            [to_column_value(name, data_type, value) for value in values.to_pylist()],
+            type=data_type,
+        )
+
+
+def read_csv_batches(path: str, file_type: FileType) -> Iterator[pa.RecordBatch]:
+    """
+    Read finished CSV output as typed record batches, parsing whole blocks of rows at once
+    instead of one row at a time.
+
+    Args:
+        path (str): The path of the compressed CSV file, or of a directory of chunk files.
+        file_type (FileType): The type of file.
+
+    Returns:
+        Iterator[pa.RecordBatch]: An iterator over the record batches, with the columnar
+            schema of the file type.
+    """
+    schema = SCHEMAS[file_type]
+    if os.path.isdir(path):
+        chunks = sorted(
+            os.path.join(path, chunk)
+            for chunk in os.listdir(path)
+            if get_part_index(chunk) is not None
+        )
+    else:
+        chunks = [path]
+
+    # Rows are parsed in blocks of this many bytes, a batch each
+    read_options = pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE)
+    # Values are read as strings, as offsets may not fit in their column
+    convert_options = pacsv.ConvertOptions(
+        column_types={name: pa.string() for name in schema.names}
+    )
+    for chunk in chunks:
+        with open_compressed_binary(chunk) as f:
+            for batch in pacsv.open_csv(
+                f, read_options=read_options, convert_options=convert_options
+            ):
+                # Output written by an older version may lack columns added since
+                fields = [field for field in schema if field.name in batch.schema.names]
+                typed = pa.RecordBatch.from_arrays(
+                    [
+                        to_typed_column(field.name, field.type, batch.column(field.name))
+                        for field in fields
+                    ],
+                    schema=pa.schema(fields),
+                )
+                yield conform_batch(typed, schema)
+
+
+def read_unit_rows(
+    part: str,
+    output_format: OutputFormat,
+    index: int,
+    id_column: str,
+    first_id: int,
+    last_id: int,
+) -> List[Dict[str, Optional[str]]]:
+    """
+    Read the rows of a range of transactions from a single row group (or record batch)
+    of a part file, with the same string values as the CSV output.
+
+    Args:
+        part (str): The path of the part file.
+        output_format (OutputFormat): The columnar format (PARQUET, ARROW or COMPACT).
+        index (int): The index of the row group or record batch in the part.
+        id_column (str): The column holding the transaction id of the rows.
+        first_id (int): The first transaction id of the range.
+        last_id (int): The last transaction id of the range.
+
+    Returns:
+        List[Dict[str, Optional[str]]]: The rows as dictionaries.
+    """
+
+    def filter_rows(table: pa.Table) -> List[Dict]:
+        ids = table.column(id_column)
+        return table.filter(
+            pc.and_(pc.greater_equal(ids, first_id), pc.less_equal(ids, last_id))
+        ).to_pylist()
+
+    if output_format == OutputFormat.COMPACT:
+        batches = pq.ParquetFile(part).read_row_group(index).to_batches()
+        rows = filter_rows(
+            pa.Table.from_batches([decode_compact_batch(batch) for batch in batches])
+        )
+    elif output_format == OutputFormat.PARQUET:
+        rows = filter_rows(pq.ParquetFile(part).read_row_group(index))
+    else:
+        with pa.memory_map(part) as source:
+            rows = filter_rows(pa.Table.from_batches([ipc.open_file(source).get_batch(index)]))
+    return [{name: from_column_value(name, value) for name, value in row.items()} for row in rows]
+
+
+class ColumnarOutputHandler:
+    def __init__(
+        self,
+        start_block: int,
+        end_block: int,
+        file_type: FileType,
+        options: OutputOptions,
+        committed_position: Optional[List[int]] = None,
+        directory: str = DATA_DIR,
+    ):
+        """
+        Initialize the columnar handler instance for a specific file type.
+
+        Rows are buffered into typed columns and written as row groups of
+        `ROW_GROUP_SIZE` rows. The output is a directory of part files, a new part
+        being started once a part holds `PART_SIZE` rows. Each row group (or record
+        batch) is a unit of the index of the output.
+
+        The open part stays open across checkpoints, and is unreadable until it is
+        closed. Its row groups are also appended to a journal, an Arrow stream from
+        which a resumed run rebuilds the part.
+
+        Args:
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+            file_type (FileType): The type of file to handle (TRANSACTION or CALL_FRAME).
+            options (OutputOptions): The output options, with the columnar format
+                (PARQUET, ARROW or COMPACT).
+            committed_position (Optional[List[int]]): Resume an existing dataset from the
+                `[part, row_group]` position returned by `flush` at the last checkpoint,
+                discarding the row groups written after it.
+            directory (str): The directory holding the output directories of the ranges.
+        """
+        if file_type not in SCHEMAS:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        if options.output_format == OutputFormat.CSV:
+            raise ValueError(f"Unsupported columnar format: {options.output_format}")
+
+        self.start_block = start_block
+        self.end_block = end_block
+        self.file_type = file_type
+        self.output_format = options.output_format
+        self.schema = SCHEMAS[file_type]
+        # Schema of the row groups as written, with raw bytes for the compact format
+        self.physical_schema = (
+            COMPACT_SCHEMAS[file_type]
+            if self.output_format == OutputFormat.COMPACT
+            else self.schema
+        )
+        self.output_path = get_output_path(start_block, end_block, file_type, options, directory)
+
+        # Buffered rows, as chunks of typed arrays for each column
+        self.chunks: Dict[str, List[pa.Array]] = {name: [] for name in self.schema.names}
+        self.buffered_rows = 0
+        self.writer = None
+        self.journal = None
+        self.journal_file: Optional[IO[bytes]] = None
+
+        # Manifests of older versions hold the number of parts, every part being closed
+        if isinstance(committed_position, int):
+            committed_position = [committed_position, 0]
+        self.part_count, committed_row_groups = committed_position or [0, 0]
+        # The number of row groups and rows written to the current part
+        self.row_groups = 0
+        self.part_rows = 0
+
+        self.index = IndexWriter(
+            start_block,
+            end_block,
+            file_type,
+            None if committed_position is None else (self.part_count, committed_row_groups),
+            directory,
+        )
+        # Summary of the buffered rows
+        self.unit = IndexUnit()
+
+        # Read the committed row groups of the open part before it is discarded
+        committed_batches = (
+            self.read_committed_batches(committed_row_groups) if committed_row_groups else []
+        )
+
+        # Ensure the directory exists
+        os.makedirs(self.output_path, exist_ok=True)
+
+        # Discard parts and journals that are not covered by the checkpoint
+        for part in os.listdir(self.output_path):
+            part_index = get_part_index(part)
+            if part_index is not None and part_index >= self.part_count:
+                os.remove(os.path.join(self.output_path, part))
+        for journal_file_name in glob.glob(f"{glob.escape(self.output_path)}.*.journal"):
+            os.remove(journal_file_name)
+
+        # Rebuild the open part, whose rows are already indexed
+        for batch in committed_batches:
+            self.write_batch(batch)
+
+    def get_part_file_name(self, index: int) -> str:
+        """
+        Get the path of a part file.
+
+        Args:
+            index (int): The index of the part.
+
+        Returns:
+            str: The path of the part file.
+        """
+        extension = PART_EXTENSIONS[self.output_format]
+        return os.path.join(self.output_path, f"part-{index:05d}.{extension}")
+
+    def get_journal_file_name(self, index: int) -> str:
+        """
+        Get the path of the journal of a part, next to the directory of part files.
+
+        Args:
+            index (int): The index of the part.
+
+        Returns:
+            str: The path of the journal file.
+        """
+        return f"{self.output_path}.{index:05d}.journal"
+
+    def read_committed_batches(self, row_groups: int) -> List[pa.RecordBatch]:
+        """
+        Read the row groups of the current part covered by the checkpoint.
+
+        The part is read from its journal while it is open. A part closed after the
+        checkpoint has no journal, and is read instead.
+
+        Args:
+            row_groups (int): The number of row groups covered by the checkpoint.
+
+        Returns:
+            List[pa.RecordBatch]: The row groups, as written to the part.
+        """
+        journal_file_name = self.get_journal_file_name(self.part_count)
+        if os.path.exists(journal_file_name):
+            # Row groups appended after the checkpoint, possibly incomplete, are not read
+            with pa.OSFile(journal_file_name) as source:
+                reader = ipc.open_stream(source)
+                return [reader.read_next_batch() for _ in range(row_groups)]
+
+        part = self.get_part_file_name(self.part_count)
+        if self.output_format in PARQUET_FORMATS:
+            parquet_file = pq.ParquetFile(part)
+            return [
+                batch
+                for index in range(row_groups)
+                for batch in parquet_file.read_row_group(index).combine_chunks().to_batches()
+            ]
+        with pa.OSFile(part) as source:
+            reader = ipc.open_file(source)
+            return [reader.get_batch(index) for index in range(row_groups)]
+
+    def open_writer(self):
+        """
+        Open a writer for the next part file, along with its journal.
+        """
+        file_name = self.get_part_file_name(self.part_count)
+        if self.output_format == OutputFormat.COMPACT:
+            self.writer = pq.ParquetWriter(
+                file_name,
+                self.physical_schema,
+                compression="zstd",
+                use_dictionary=[
+                    name
+                    for name in self.physical_schema.names
+                    if name in COMPACT_DICTIONARY_COLUMNS
+                ],
+                column_encoding=get_compact_column_encodings(self.physical_schema),
+            )
+        elif self.output_format == OutputFormat.PARQUET:
+            self.writer = pq.ParquetWriter(file_name, self.schema)
+        else:
+            self.writer = ipc.new_file(file_name, self.schema)
+
+        self.journal_file = open(self.get_journal_file_name(self.part_count), "wb")
+        self.journal = ipc.new_stream(
+            self.journal_file,
+            self.physical_schema,
+            options=ipc.IpcWriteOptions(compression=JOURNAL_COMPRESSION),
+        )
+
+    def close_part(self):
+        """
+        Close the current part file, which no longer needs its journal.
+        """
+        self.writer.close()
+        self.writer = None
+        self.journal.close()
+        self.journal_file.close()
+        self.journal = None
+        self.journal_file = None
+        os.remove(self.get_journal_file_name(self.part_count))
+        self.part_count += 1
+        self.row_groups = 0
+        self.part_rows = 0
+
+    def write(self, data: List[Dict[str, str]]):
+        """
+        Buffer a list of dictionaries, writing a row group once enough rows are buffered.
+
+        Args:
+            data (List[Dict[str, str]]): The data to write to the file.
+        """
+        with metrics.time("write"):
+            for field in self.schema:
+                values = [
+                    to_column_value(field.name, field.type, entry.get(field.name))
+                    for entry in data
+                ]
+                self.chunks[field.name].append(pa.array(values, type=field.type))
+            self.buffered_rows += len(data)
+            self.unit.add_rows(self.file_type, data)
+        metrics.increment(f"{self.file_type.value}_rows", len(data))
+
+        if self.buffered_rows >= ROW_GROUP_SIZE:
+            self.write_row_group()
+
+    def write_columns(self, columns: CallFrameColumns):
+        """
+        Buffer call frame or frame columns, writing a row group once enough rows are
+        buffered.
+
+        Args:
+            columns (CallFrameColumns): The columns to write.
+        """
+        with metrics.time("write"):
+            for field in self.schema:
+                # Values that do not fit in 64 bits are saturated, like in `to_column_value`
+                values = saturate_uint64(columns[field.name])
+                self.chunks[field.name].append(pa.array(values, type=field.type))
+            self.buffered_rows += count_rows(columns)
+            self.unit.add_columns(columns)
+        metrics.increment(f"{self.file_type.value}_rows", count_rows(columns))
+
+        if self.buffered_rows >= ROW_GROUP_SIZE:
+            self.write_row_group()
+
+    def write_batch(self, batch: pa.RecordBatch):
+        """
+        Write a batch as a single row group (or record batch) of the current part and
+        append it to the journal, opening a new part if needed.
+
+        Args:
+            batch (pa.RecordBatch): The batch, with the physical schema of the format.
+        """
+        if self.writer is None:
+            self.open_writer()
+
+        if self.output_format in PARQUET_FORMATS:
+            # A single row group, however many rows are buffered, to match the index
+            self.writer.write_table(pa.Table.from_batches([batch]), row_group_size=batch.num_rows)
+        else:
+            self.writer.write_batch(batch)
+        self.journal.write_batch(batch)
+
+        self.row_groups += 1
+        self.part_rows += batch.num_rows
+
+    @metrics.timed("compress")
+    def write_row_group(self):
+        """
+        Write the buffered rows as a single row group (or record batch), which encodes
+        and compresses them, starting a new part once the current one is full.
+        """
+        if not self.buffered_rows:
+            return
+
+        batch = pa.RecordBatch.from_arrays(
+            [pa.concat_arrays(self.chunks[name]) for name in self.schema.names],
+            schema=self.schema,
+        )
+        if self.output_format == OutputFormat.COMPACT:
+            batch = encode_compact_batch(batch)
+
+        self.index.add_unit(self.part_count, self.row_groups, self.unit)
+        self.write_batch(batch)
+        self.unit = IndexUnit()
+
+        self.chunks = {name: [] for name in self.schema.names}
+        self.buffered_rows = 0
+
+        if self.part_rows >= PART_SIZE:
+            self.close_part()
+
+    async def drain(self):
+        """
+        Rows are written to disk as they are buffered, so there is nothing to wait for.
+        """
+
+    async def wait_for_writes(self):
+        """
+        Rows are written to disk as they are buffered, so there is nothing to wait for.
+        """
+
+    def flush(self) -> List[int]:
+        """
+        Write the buffered rows to the current part and its journal, which stay open.
+
+        Returns:
+            List[int]: The `[part, row_group]` position of the output written so far.
+        """
+        self.write_row_group()
+
+        if self.journal_file is not None:
+            self.journal_file.flush()
+
+        self.index.save()
+        return [self.part_count, self.row_groups]
+
+    def close(self):
+        """
+        Close the current part file without writing the buffered rows. The part is
+        rebuilt from its journal when the output is resumed by a new handler.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.journal.close()
+            self.journal_file.close()
+            self.journal = None
+            self.journal_file = None
+
+    def compress(self, delete_source=True):
+        """
+        Finish the dataset. Columnar formats are compressed as they are written,
+        so this only writes the remaining rows and closes the current part.
+        """
+        self.write_row_group()
+        if self.writer is not None:
+            self.close_part()
+        self.index.save()
+
+    def remove_source(self):
+        """
+        Columnar output has no uncompressed source to remove.
+        """
+
+
+class ColumnarIterator:
+    def __init__(self, path: str, output_format: OutputFormat):
+        """
+        Initialize the ColumnarIterator instance.
+
+        Args:
+            path (str): Path to the directory holding the part files.
+            output_format (OutputFormat): The columnar format (PARQUET, ARROW or COMPACT).
+        """
+        self.path = path
+        self.output_format = output_format
+        self.parts: Optional[List[str]] = None
+        self.header = None
+
+    def __enter__(self):
+        """
+        Enter the runtime context related to this object.
+        """
+        self.parts = sorted(
+            os.path.join(self.path, part)
+            for part in os.listdir(self.path)
+            if get_part_index(part) is not None
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Exit the runtime context related to this object.
+        """
+        self.parts = None
+
+    def iter_batches(self) -> Iterator[pa.RecordBatch]:
+        """
+        Iterate over the record batches of every part file, in order.
+
+        Returns:
+            Iterator[pa.RecordBatch]: An iterator over the record batches, hashes and
+                addresses of the compact format being converted back to hex strings.
+        """
+        for part in self.parts or []:
+            if self.output_format == OutputFormat.COMPACT:
+                for batch in pq.ParquetFile(part).iter_batches():
+                    yield decode_compact_batch(batch)
+            elif self.output_format == OutputFormat.PARQUET:
+                yield from pq.ParquetFile(part).iter_batches()
+            else:
+                with pa.memory_map(part) as source:
+                    reader = ipc.open_file(source)
+                    for index in range(reader.num_record_batches):
+                        yield reader.get_batch(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Optional[str]]]:
+        """
+        Return an iterator over the rows of the dataset, with the same string values
+        as the CSV output.
+
+        Returns:
+            Iterator[Dict[str, Optional[str]]]: An iterator over the rows as dictionaries.
+        """
+        if self.parts is None:
+            raise RuntimeError("Iterator not initialized. Ensure you use the context manager.")
+
+        for batch in self.iter_batches():
+            self.header = batch.schema.names
+            for row in batch.to_pylist():
+                yield {name: from_column_value(name, value) for name, value in row.items()}
@@ -0,0 +1,364 @@
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa  # type: ignore[import-untyped]
+import pyarrow.compute as pc  # type: ignore[import-untyped]
+import pyarrow.ipc as ipc  # type: ignore[import-untyped]
+import pyarrow.parquet as pq  # type: ignore[import-untyped]
+
+from tracer.checkpoint import Checkpoint
+from tracer.columnar import SCHEMAS, ColumnarIterator, conform_batch, read_csv_batches
+from tracer.config import DATA_DIR, HDF5_CHUNK_SIZE
+from tracer.fs import ID_COLUMNS, CombinedFormat, FileType, OutputFormat, find_range_output
+
+# HDF5 columns must have a fixed size, which is that of a hex encoded hash or address
+HDF5_STRING_SIZES = {"tx_hash": 66, "to": 42}
+
+
+def parse_range_directory(directory: str) -> Tuple[int, int, str]:
+    """
+    Get the block range of an output directory, and the directory holding it.
+
+    Args:
+        directory (str): The output directory, e.g. "data/100_to_199".
+
+    Returns:
+        Tuple[int, int, str]: The `(start, end)` block range, and the directory holding
+            the output directory, e.g. "data".
+
+    Raises:
+        ValueError: If the directory is not named after a block range.
+    """
+    parent, name = os.path.split(os.path.normpath(directory))
+    match = re.fullmatch(r"(\d+)_to_(\d+)", name)
+    if not match:
+        raise ValueError(f"{directory} is not the output directory of a block range")
+    return int(match.group(1)), int(match.group(2)), parent or os.curdir
+
+
+def find_ranges(directory: str = DATA_DIR) -> List[Tuple[int, int, str]]:
+    """
+    Find the block ranges with finished output.
+
+    Args:
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        List[Tuple[int, int, str]]: The `(start, end)` block ranges, in block order, along
+            with the directory holding them.
+    """
+    ranges = []
+    for name in os.listdir(directory):
+        if not re.fullmatch(r"\d+_to_\d+", name):
+            continue
+        # Ranges with a checkpoint are still being traced
+        if os.path.exists(os.path.join(directory, name, Checkpoint.FILE_NAME)):
+            continue
+        start_block, end_block, _ = parse_range_directory(name)
+        if not has_range_output(start_block, end_block, FileType.CALL_FRAME, directory):
+            continue
+        ranges.append((start_block, end_block, directory))
+    return sorted(ranges)
+
+
+def has_range_output(
+    start_block: int, end_block: int, file_type: FileType, directory: str = DATA_DIR
+) -> bool:
+    """
+    Check whether a block range has a finished output of a file type.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        bool: True if the output exists.
+    """
+    try:
+        find_range_output(start_block, end_block, file_type, directory)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def iter_range_batches(
+    start_block: int, end_block: int, file_type: FileType, directory: str = DATA_DIR
+) -> Iterator[pa.RecordBatch]:
+    """
+    Read the finished output of a block range as typed record batches.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        Iterator[pa.RecordBatch]: An iterator over the record batches, in order.
+    """
+    path, output_format = find_range_output(start_block, end_block, file_type, directory)
+    if output_format == OutputFormat.CSV:
+        yield from read_csv_batches(path, file_type)
+        return
+
+    with ColumnarIterator(path, output_format) as iterator:
+        for batch in iterator.iter_batches():
+            # Conform to the current schema, in case the dataset was written by an older version
+            yield conform_batch(batch, SCHEMAS[file_type])
+
+
+def count_transactions(start_block: int, end_block: int, directory: str = DATA_DIR) -> int:
+    """
+    Get the largest transaction id of a block range, in a worker process.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        int: The largest transaction id, 0 if the range has no transactions.
+    """
+    largest_id = 0
+    for batch in iter_range_batches(start_block, end_block, FileType.TRANSACTION, directory):
+        if batch.num_rows:
+            largest_id = max(largest_id, pc.max(batch.column("id")).as_py())
+    return largest_id
+
+
+def convert_range(
+    start_block: int,
+    end_block: int,
+    file_type: FileType,
+    id_offset: int,
+    part_file_name: str,
+    combined_format: CombinedFormat,
+    directory: str = DATA_DIR,
+) -> int:
+    """
+    Copy the output of a block range into a part file of the combined dataset, shifting
+    its transaction ids, in a worker process. Batches are streamed one at a time.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        id_offset (int): The number added to the transaction ids of the range.
+        part_file_name (str): The path of the part file to write.
+        combined_format (CombinedFormat): Write a Parquet part of the final dataset, or an
+            Arrow IPC part that is appended to the HDF5 file.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        int: The number of rows copied.
+    """
+    schema = SCHEMAS[file_type]
+    id_column = ID_COLUMNS[file_type]
+    id_index = schema.get_field_index(id_column)
+
+    if combined_format == CombinedFormat.PARQUET:
+        writer = pq.ParquetWriter(part_file_name, schema)
+    else:
+        writer = ipc.new_file(part_file_name, schema)
+
+    rows = 0
+    with writer:
+        for batch in iter_range_batches(start_block, end_block, file_type, directory):
+            ids = pc.add(batch.column(id_column), pa.scalar(id_offset, pa.uint64()))
+            batch = batch.set_column(id_index, id_column, ids)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+class HDF5Writer:
+    def __init__(self, file_name: str, schema: pa.Schema):
+        """
+        Initialize the writer of a combined HDF5 file, laid out as a vaex table.
+
+        Every column is a resizable dataset, chunked along its rows, so that rows are
+        appended without knowing the final size and read back without loading the file.
+
+        Args:
+            file_name (str): The path of the HDF5 file.
+            schema (pa.Schema): The schema of the rows.
+        """
+        # h5py is only required for HDF5 output
+        import h5py  # type: ignore[import-untyped]
+
+        self.file = h5py.File(file_name, "w")
+        self.schema = schema
+        self.rows = 0
+
+        columns = self.file.create_group("table").create_group("columns")
+        columns.attrs["column_order"] = ",".join(schema.names)
+
+        self.datasets = {}
+        for field in schema:
+            if pa.types.is_string(field.type):
+                dtype = np.dtype(f"S{HDF5_STRING_SIZES[field.name]}")
+            else:
+                dtype = np.dtype(field.type.to_pandas_dtype())
+            self.datasets[field.name] = columns.create_group(field.name).create_dataset(
+                "data",
+                shape=(0,),
+                maxshape=(None,),
+                chunks=(HDF5_CHUNK_SIZE,),
+                dtype=dtype,
+            )
+
+    def write_batch(self, batch: pa.RecordBatch):
+        """
+        Append a batch of rows.
+
+        Args:
+            batch (pa.RecordBatch): The rows to append.
+        """
+        start = self.rows
+        end = start + batch.num_rows
+        for field in self.schema:
+            dataset = self.datasets[field.name]
+            column = batch.column(field.name)
+            if pa.types.is_string(field.type):
+                values = np.asarray(column.fill_null("").to_pylist(), dtype=dataset.dtype)
+            else:
+                values = column.to_numpy(zero_copy_only=False)
+            dataset.resize((end,))
+            dataset[start:end] = values
+        self.rows = end
+
+    def close(self):
+        """
+        Close the HDF5 file.
+        """
+        self.file.close()
+
+
+def get_combined_path(name: str, file_type: FileType, combined_format: CombinedFormat) -> str:
+    """
+    Get the path of a combined dataset.
+
+    Args:
+        name (str): The name of the combined datasets, e.g. "combined".
+        file_type (FileType): The type of file.
+        combined_format (CombinedFormat): The format of the dataset.
+
+    Returns:
+        str: The path of the HDF5 file, or of the directory of Parquet part files.
+    """
+    return os.path.join(DATA_DIR, f"{name}_{file_type.value}.{combined_format.value}")
+
+
+def combine_ranges(
+    ranges: List[Tuple[int, int, str]],
+    combined_format: CombinedFormat = CombinedFormat.HDF5,
+    name: str = "combined",
+    workers: Optional[int] = None,
+    on_progress: Optional[Callable[[FileType, int], None]] = None,
+) -> Dict[FileType, str]:
+    """
+    Combine the outputs of several block ranges into one dataset per file type.
+
+    The transaction ids of every range start at 1, so they are shifted by the number of
+    transactions of the previous ranges to stay unique. Ranges are copied in parallel
+    worker processes, one batch at a time, into part files: these are the final Parquet
+    dataset, or are appended in order to the HDF5 file as they complete. The frames table
+    is only combined when every range has one, ranges traced by older versions having none.
+
+    Args:
+        ranges (List[Tuple[int, int, str]]): The block ranges to combine, along with the
+            directory holding the output directory of each.
+        combined_format (CombinedFormat): The format of the combined datasets.
+        name (str): The name of the combined datasets.
+        workers (Optional[int]): The number of worker processes, one per core by default.
+        on_progress (Optional[Callable[[FileType, int], None]]): Called with the file type
+            and the number of ranges combined so far after every range.
+
+    Returns:
+        Dict[FileType, str]: The path of the combined dataset of each file type.
+
+    Raises:
+        ValueError: If ranges overlap, as their rows would be combined twice.
+    """
+    ranges = sorted(ranges)
+    for (_, previous_end, _), (start_block, _, _) in zip(ranges, ranges[1:]):
+        if start_block <= previous_end:
+            raise ValueError(f"Block ranges overlap at block {start_block}")
+
+    workers = workers or os.cpu_count() or 1
+    paths = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        transaction_counts = list(
+            executor.map(count_transactions, *zip(*ranges)) if ranges else []
+        )
+        id_offsets = np.cumsum([0] + transaction_counts[:-1]).tolist()
+
+        for file_type in FileType:
+            if file_type == FileType.FRAME and not all(
+                has_range_output(start_block, end_block, file_type, directory)
+                for start_block, end_block, directory in ranges
+            ):
+                continue
+
+            path = get_combined_path(name, file_type, combined_format)
+            paths[file_type] = path
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+            # Parts are written next to the HDF5 file, and removed once appended
+            parts_directory = (
+                path if combined_format == CombinedFormat.PARQUET else f"{path}.parts"
+            )
+            os.makedirs(parts_directory, exist_ok=True)
+            extension = "parquet" if combined_format == CombinedFormat.PARQUET else "arrow"
+
+            futures = []
+            for index, ((start_block, end_block, directory), id_offset) in enumerate(
+                zip(ranges, id_offsets)
+            ):
+                part_file_name = os.path.join(parts_directory, f"part-{index:05d}.{extension}")
+                futures.append(
+                    (
+                        part_file_name,
+                        executor.submit(
+                            convert_range,
+                            start_block,
+                            end_block,
+                            file_type,
+                            id_offset,
+                            part_file_name,
+                            combined_format,
+                            directory,
+                        ),
+                    )
+                )
+
+            writer = None
+            if combined_format == CombinedFormat.HDF5:
+                writer = HDF5Writer(path, SCHEMAS[file_type])
+
+            for combined, (part_file_name, future) in enumerate(futures, start=1):
+                future.result()
+                if writer is not None:
+                    with pa.memory_map(part_file_name) as source:
+                        reader = ipc.open_file(source)
+                        for batch_index in range(reader.num_record_batches):
+                            writer.write_batch(reader.get_batch(batch_index))
+                    os.remove(part_file_name)
+                if on_progress:
+                    on_progress(file_type, combined)
+
+            if writer is not None:
+                writer.close()
+                shutil.rmtree(parts_directory)
+
+    return paths
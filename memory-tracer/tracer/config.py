@@ -1,5 +1,6 @@
 import os
 from enum import Enum
+from typing import List, Tuple
 
 from dotenv import load_dotenv
 
@@ -8,15 +9,148 @@ load_dotenv(override=True)
 EVM_WORD_SIZE = 32
 DATA_DIR = "data"
 
+# Gas of each word of memory, and divisor of the quadratic term of the cost of memory of
+# the current schedule: C(w) = 3 * w + w**2 // 512
+MEMORY_GAS_PER_WORD = 3
+QUADRATIC_DIVISOR = 512
+
 # The number of concurrent workers for network calls
 # Read: https://cgarciae.github.io/pypeln/advanced/#workers
 ASYNC_WORKERS_LIMIT = 1000
 
+# The number of requests in flight is adjusted between these bounds from the observed
+# latency and errors of the node: it grows by one request per round trip while the node
+# keeps up, and is halved when the node throttles, fails or slows down (AIMD).
+RPC_INITIAL_CONCURRENCY = 16
+RPC_MIN_CONCURRENCY = 1
+RPC_MAX_CONCURRENCY = ASYNC_WORKERS_LIMIT
+# Recent latency above this multiple of the long term average is treated as congestion.
+RPC_LATENCY_TOLERANCE = 2.0
+
+# Transient failures (timeouts, connection errors, HTTP 429 and 5xx) are retried this many
+# times, with exponential backoff and full jitter between attempts.
+RPC_MAX_RETRIES = 5
+RPC_RETRY_BASE_DELAY = 0.5
+RPC_RETRY_MAX_DELAY = 30.0
+
+# The number of batches of blocks or transactions read ahead of the tasks processing them.
+STAGE_QUEUE_SIZE = 100
+
+# The number of blocks or transactions grouped into a single JSON-RPC batch request.
+# Set to 1 to send one request per HTTP call.
+RPC_BATCH_SIZE = 10
+
+# The number of transactions whose call frames are rebuilt together by a replay worker.
+REPLAY_BATCH_SIZE = 1000
+
+# The `follow` command traces blocks once this many blocks were built on top of them,
+# into segments of this many blocks, polling the head of the chain every few seconds.
+FOLLOW_CONFIRMATIONS = 12
+FOLLOW_SEGMENT_SIZE = 1000
+FOLLOW_POLL_INTERVAL = 12.0
+# The maximum number of blocks traced between two polls while catching up with the chain.
+FOLLOW_MAX_BLOCKS = 100
+# The number of recently traced blocks whose hash is checked for reorgs on every poll.
+REORG_WINDOW = 64
+
+# Percentiles of the call frame columns reported in the summary of a range.
+SUMMARY_PERCENTILES = [25, 50, 75, 95, 99]
+# The number of most frequently accessed offsets reported per opcode, and the number of
+# distinct offsets counted per opcode while tracing, beyond which the rarest are dropped.
+SUMMARY_TOP_OFFSETS = 10
+SUMMARY_OFFSET_COUNTERS = 1000
+# Percentiles are estimated from histograms with exact buckets for values below
+# 2**HISTOGRAM_PRECISION, and buckets within 1% of their values above it.
+HISTOGRAM_PRECISION = 7
+
+# The number of rows of each chunk of the columns of combined HDF5 files.
+HDF5_CHUNK_SIZE = 128 * 1024
+
+# The number of completed tasks between two saves of the checkpoint manifest.
+CHECKPOINT_INTERVAL = 100
+
+# The number of rows buffered by columnar writers before writing a row group.
+ROW_GROUP_SIZE = 100_000
+
+# The number of rows written to each part file of columnar outputs before a new part is
+# started. Parts stay open across checkpoints.
+PART_SIZE = 20 * ROW_GROUP_SIZE
+
+# The number of bytes of CSV rows rendered before they are handed to the compression thread
+# of streamed output, and the number of such buffers that can be queued for compression.
+STREAM_BUFFER_SIZE = 1024 * 1024
+STREAM_QUEUE_SIZE = 8
+
+# The number of bytes of CSV rows indexed together. Compressed CSV output is split into
+# frames (or gzip members) of about this size, so that each can be decompressed on its own.
+INDEX_UNIT_SIZE = 256 * 1024
+
+# The number of seconds between two snapshots written to the metrics log.
+METRICS_INTERVAL = 10.0
+
+
+# An endpoint is ejected from the pool after this many consecutive failures. It is
+# re-admitted after the ejection duration, which doubles with every repeated ejection.
+RPC_EJECTION_THRESHOLD = 5
+RPC_EJECTION_DURATION = 30.0
+RPC_MAX_EJECTION_DURATION = 300.0
+
+
+def parse_endpoints(value: str) -> List[Tuple[str, float]]:
+    """
+    Parse a comma separated list of endpoints, each optionally followed by its weight.
+
+    Args:
+        value (str): The endpoints, e.g. "https://node-a 2, https://node-b".
+
+    Returns:
+        List[Tuple[str, float]]: The url and weight (1 by default) of each endpoint.
+
+    Raises:
+        ValueError: If a weight is not a positive number.
+    """
+    endpoints = []
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        url, *weight = entry.split()
+        endpoint_weight = float(weight[0]) if weight else 1.0
+        # Endpoints are ranked by their outstanding requests divided by their weight
+        if not endpoint_weight > 0:
+            raise ValueError(f"Weight of endpoint {url} must be positive, got {weight[0]}")
+        endpoints.append((url, endpoint_weight))
+    return endpoints
+
 
 # Retrieve the RPC endpoint from environment variables
 RPC_ENDPOINT = os.getenv("RPC_ENDPOINT")
 API_KEY = os.getenv("RPC_API_KEY")
 
+# Requests are spread across several endpoints when `RPC_ENDPOINTS` is set
+RPC_ENDPOINTS = parse_endpoints(os.getenv("RPC_ENDPOINTS") or RPC_ENDPOINT or "")
+
+# Maximum number of requests per second sent to each endpoint, 0 for no limit
+RPC_MAX_REQUESTS_PER_SECOND = float(os.getenv("RPC_MAX_REQUESTS_PER_SECOND") or 0)
+
+# Maximum size in MB of the RPC responses held by tasks until their output is written,
+# 0 for no limit. Decoded responses take a few times more memory than their raw size.
+MEMORY_BUDGET = int(os.getenv("MEMORY_BUDGET") or 512) * 1024 * 1024
+
+# Responses of historical blocks and traces never change, so they are cached on disk.
+# The least recently used responses are evicted once the cache exceeds its size (in MB).
+RPC_CACHE_FILE = os.getenv("RPC_CACHE_FILE") or os.path.join(DATA_DIR, "rpc_cache.sqlite")
+RPC_CACHE_MAX_SIZE = int(os.getenv("RPC_CACHE_MAX_SIZE") or 10 * 1024) * 1024 * 1024
+
+
+# The compact tracer returns the memory accesses of a transaction as parallel integer arrays
+# instead of one object per instruction. Set `COMPACT_TRACER=false` to use the original one.
+COMPACT_TRACER = (os.getenv("COMPACT_TRACER") or "true").lower() != "false"
+
+
+# Plain Ether transfers never execute an instruction, so they are recognized from their
+# receipt and not traced. Set `SKIP_PLAIN_TRANSFERS=false` to trace every transaction.
+SKIP_PLAIN_TRANSFERS = (os.getenv("SKIP_PLAIN_TRANSFERS") or "true").lower() != "false"
+
 
 class MEMORY_ACCESS_SIZE(Enum):
     VARIABLE = "variable"
@@ -0,0 +1,317 @@
+import asyncio
+import copy
+import logging
+import os
+import shutil
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, TCPConnector
+
+from tracer.cache import get_cache_key, rpc_cache
+from tracer.chain import transaction_state
+from tracer.checkpoint import Checkpoint
+from tracer.config import FOLLOW_MAX_BLOCKS, REORG_WINDOW, RPC_BATCH_SIZE
+from tracer.frames import get_call_frame_columns_from_blocks, summarize_frames
+from tracer.fs import FileType, OutputOptions, get_output_directory, get_output_path
+from tracer.pipeline import batch_stage, schedule_rpc_tasks
+from tracer.rpc import get_block_hashes, get_block_number, get_memory_tracer
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    # The first block not covered by the snapshot
+    next_block: int
+    # Position of each output of the segment, as recorded by the checkpoint
+    segments: Dict[str, Any]
+    transaction_id: int
+    total_transactions: int
+
+
+def invalidate_cached_block(block_number: int):
+    """
+    Remove the cached results of a block replaced by a reorg, along with the traces of
+    its transactions, so that they are fetched again from the new chain.
+
+    Args:
+        block_number (int): The number of the replaced block.
+    """
+    tracer = get_memory_tracer()
+    block_params = [hex(block_number), True]
+    keys = [
+        get_cache_key("eth_getBlockByNumber", block_params),
+        get_cache_key("eth_getBlockTransactionCountByNumber", [hex(block_number)]),
+        get_cache_key("eth_getBlockReceipts", [hex(block_number)]),
+        get_cache_key("debug_traceBlockByNumber", [hex(block_number), {"tracer": tracer}]),
+    ]
+
+    block = rpc_cache.get("eth_getBlockByNumber", block_params)
+    for transaction in (block or {}).get("transactions", []):
+        keys.append(
+            get_cache_key("debug_traceTransaction", [transaction["hash"], {"tracer": tracer}])
+        )
+
+    rpc_cache.delete_many(keys)
+
+
+class Follower:
+    def __init__(
+        self,
+        start_block: int,
+        segment_size: int,
+        confirmations: int,
+        options: OutputOptions = OutputOptions(),
+    ):
+        """
+        Initialize the follower of the head of the chain.
+
+        Blocks are traced once they are `confirmations` blocks deep, in order, into
+        rolling segments of `segment_size` blocks. Each segment is written like the
+        output of a block range, `start_block` to `start_block + segment_size - 1` for
+        the first one, and finalized as soon as its last block is traced.
+
+        The hashes of the last `REORG_WINDOW` traced blocks are checked on every poll.
+        When a block was replaced, the output is rolled back to the checkpoint preceding
+        it and the new blocks are traced instead.
+
+        Args:
+            start_block (int): The first block to trace, where segments are aligned to.
+            segment_size (int): The number of blocks of each segment.
+            confirmations (int): The number of blocks on top of a block before it is traced.
+            options (OutputOptions): The options to write the output with.
+        """
+        self.start_block = start_block
+        self.segment_size = segment_size
+        self.confirmations = confirmations
+        self.options = options
+
+        self.checkpoint: Optional[Checkpoint] = None
+        self.next_block = start_block
+        # Hash of the recently traced blocks, by block number
+        self.hashes: Dict[int, str] = {}
+        # States of the current segment that the output can be rolled back to
+        self.snapshots: Deque[Snapshot] = deque(maxlen=REORG_WINDOW)
+
+    def get_segment_range(self, block_number: int) -> Tuple[int, int]:
+        """
+        Get the block range of the segment a block belongs to.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            Tuple[int, int]: The inclusive `(start, end)` block range of the segment.
+        """
+        index = (block_number - self.start_block) // self.segment_size
+        segment_start = self.start_block + index * self.segment_size
+        return segment_start, segment_start + self.segment_size - 1
+
+    def is_segment_finalized(self, segment_start: int) -> bool:
+        """
+        Check whether a segment was finalized by a previous run.
+
+        Args:
+            segment_start (int): The first block of the segment.
+
+        Returns:
+            bool: True if the segment has an output but no checkpoint left.
+        """
+        _, segment_end = self.get_segment_range(segment_start)
+        directory = get_output_directory(segment_start, segment_end)
+        output_path = get_output_path(
+            segment_start, segment_end, FileType.CALL_FRAME, self.options
+        )
+        return not os.path.exists(os.path.join(directory, Checkpoint.FILE_NAME)) and (
+            os.path.exists(output_path)
+        )
+
+    def open_segment(self, segment_start: int, fresh: bool = False):
+        """
+        Open the outputs of a segment, resuming it from its checkpoint if one exists.
+
+        Args:
+            segment_start (int): The first block of the segment.
+            fresh (bool): Discard the previous output of the segment.
+        """
+        _, segment_end = self.get_segment_range(segment_start)
+        self.checkpoint = Checkpoint(segment_start, segment_end, self.options, fresh=fresh)
+        self.transaction_output = self.checkpoint.open_output(FileType.TRANSACTION)
+        self.call_frame_output = self.checkpoint.open_output(FileType.CALL_FRAME)
+        self.frame_output = self.checkpoint.open_output(FileType.FRAME)
+
+        # Blocks are traced in order, so the completed blocks are a prefix of the segment
+        completed_blocks = self.checkpoint.completed_blocks
+        self.next_block = max(completed_blocks) + 1 if completed_blocks else segment_start
+
+        self.snapshots.clear()
+        self.take_snapshot()
+
+    def take_snapshot(self):
+        """
+        Record the state of the current segment, as of its last save.
+        """
+        self.snapshots.append(
+            Snapshot(
+                next_block=self.next_block,
+                segments=copy.deepcopy(self.checkpoint.segments),
+                transaction_id=transaction_state.transaction_id,
+                total_transactions=self.checkpoint.total_transactions,
+            )
+        )
+
+    def finish_segment(self):
+        """
+        Finalize the outputs of the current segment and open the next one.
+        """
+        checkpoint = self.checkpoint
+        checkpoint.finalize(self.transaction_output, self.call_frame_output, self.frame_output)
+        checkpoint.remove()
+        print(f"Finished segment {checkpoint.start_block}-{checkpoint.end_block}")
+
+        self.open_segment(checkpoint.end_block + 1, fresh=True)
+
+    async def trace_blocks(self, block_numbers: List[int], session: ClientSession):
+        """
+        Trace confirmed blocks of the current segment and save the checkpoint.
+
+        Args:
+            block_numbers (List[int]): The consecutive block numbers to trace.
+            session (ClientSession): The aiohttp client session for making API requests.
+        """
+        # Hashes are read before tracing, so a reorg in between is caught by the next check
+        hashes = await get_block_hashes([hex(block) for block in block_numbers], session)
+
+        async def task(batch: List[int], session):
+            transactions, call_frames = await get_call_frame_columns_from_blocks(batch, session)
+            self.transaction_output.write(transactions)
+            self.call_frame_output.write_columns(call_frames)
+            self.frame_output.write_columns(summarize_frames(call_frames))
+            self.checkpoint.total_transactions += len(transactions)
+            await self.checkpoint.drain()
+
+        await schedule_rpc_tasks(task=task, stage=batch_stage(block_numbers, RPC_BATCH_SIZE))
+
+        self.next_block = block_numbers[-1] + 1
+        for block_number, block_hash in zip(block_numbers, hashes):
+            self.hashes[block_number] = block_hash
+        # Only the last blocks are checked, older ones being deep enough to stay final
+        for block_number in [
+            block for block in self.hashes if block < self.next_block - REORG_WINDOW
+        ]:
+            del self.hashes[block_number]
+
+        self.checkpoint.completed_blocks.update(block_numbers)
+        await self.checkpoint.flush_and_save()
+        self.take_snapshot()
+
+    async def find_reorg(self, session: ClientSession) -> Optional[int]:
+        """
+        Compare the hashes of the recently traced blocks with those of the chain.
+
+        Args:
+            session (ClientSession): The aiohttp client session for making API requests.
+
+        Returns:
+            Optional[int]: The first traced block that was replaced, if any.
+        """
+        block_numbers = sorted(self.hashes)
+        if not block_numbers:
+            return None
+
+        hashes = await get_block_hashes([hex(block) for block in block_numbers], session)
+        for block_number, block_hash in zip(block_numbers, hashes):
+            if block_hash != self.hashes[block_number]:
+                return block_number
+        return None
+
+    async def rewind(self, block_number: int):
+        """
+        Discard the output of the blocks from a replaced block onwards, so that they are
+        traced again from the new chain.
+
+        Args:
+            block_number (int): The first replaced block.
+        """
+        logging.warning(f"Reorg detected at block {block_number}")
+        print(f"Reorg detected at block {block_number}, tracing again from it")
+
+        for replaced_block in [block for block in self.hashes if block >= block_number]:
+            await rpc_cache.run(invalidate_cached_block, replaced_block)
+            del self.hashes[replaced_block]
+
+        self.checkpoint.close_outputs()
+        segment_start = self.checkpoint.start_block
+
+        if block_number < segment_start:
+            # The reorg replaced blocks of finalized segments, which are traced again
+            first_segment_start, _ = self.get_segment_range(block_number)
+            for start in range(first_segment_start, segment_start + 1, self.segment_size):
+                directory = get_output_directory(*self.get_segment_range(start))
+                if os.path.isdir(directory):
+                    shutil.rmtree(directory)
+            self.open_segment(first_segment_start, fresh=True)
+            return
+
+        snapshots = [
+            snapshot for snapshot in self.snapshots if snapshot.next_block <= block_number
+        ]
+        if not snapshots:
+            self.open_segment(segment_start, fresh=True)
+            return
+
+        # Roll the segment back to the last save that precedes the replaced block
+        snapshot = snapshots[-1]
+        while self.snapshots[-1] is not snapshot:
+            self.snapshots.pop()
+
+        checkpoint = self.checkpoint
+        checkpoint.segments = copy.deepcopy(snapshot.segments)
+        checkpoint.completed_blocks = set(range(segment_start, snapshot.next_block))
+        checkpoint.total_transactions = snapshot.total_transactions
+        transaction_state.transaction_id = snapshot.transaction_id
+        checkpoint.save()
+
+        self.transaction_output = checkpoint.open_output(FileType.TRANSACTION)
+        self.call_frame_output = checkpoint.open_output(FileType.CALL_FRAME)
+        self.frame_output = checkpoint.open_output(FileType.FRAME)
+        self.next_block = snapshot.next_block
+
+    async def follow(self, poll_interval: float):
+        """
+        Poll the head of the chain and trace new blocks once they are confirmed, until
+        interrupted.
+
+        Args:
+            poll_interval (float): The number of seconds between two polls once the
+                follower caught up with the chain.
+        """
+        segment_start, _ = self.get_segment_range(self.start_block)
+        # Skip the segments finalized by a previous run
+        while self.is_segment_finalized(segment_start):
+            segment_start += self.segment_size
+        self.open_segment(segment_start)
+        if self.checkpoint.resumed:
+            print(f"Resuming from checkpoint {self.checkpoint.file_name}")
+
+        async with ClientSession(connector=TCPConnector(limit=0)) as session:
+            while True:
+                replaced_block = await self.find_reorg(session)
+                if replaced_block is not None:
+                    await self.rewind(replaced_block)
+
+                head = await get_block_number(session)
+                last_block = min(
+                    head - self.confirmations,
+                    self.next_block + FOLLOW_MAX_BLOCKS - 1,
+                    self.checkpoint.end_block,
+                )
+                if last_block < self.next_block:
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+                await self.trace_blocks(list(range(self.next_block, last_block + 1)), session)
+                print(f"Traced blocks up to {last_block} (head {head})")
+
+                if self.next_block > self.checkpoint.end_block:
+                    self.finish_segment()
@@ -0,0 +1,317 @@
+from itertools import chain
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from aiohttp import ClientSession
+
+from tracer.chain import REGION_COUNTS, get_traced_blocks, parse_call_frames
+from tracer.config import EVM_WORD_SIZE, MEMORY_GAS_PER_WORD, QUADRATIC_DIVISOR
+from tracer.fs import CSV_FIELDNAMES, FileType
+from tracer.metrics import metrics
+from tracer.rpc import get_transaction_traces
+
+# Call frames of a batch of transactions, one array per output column
+CallFrameColumns = Dict[str, np.ndarray]
+
+UINT64_MAX = 2**64 - 1
+
+# The number of memory regions accessed by each instruction, by opcode number
+REGION_COUNT_TABLE = np.zeros(256, dtype=np.int64)
+for _opcode, _count in REGION_COUNTS.items():
+    REGION_COUNT_TABLE[_opcode] = _count
+
+# printf-style format of each CSV column by file type, opcodes being written as hex like the
+# tracer does
+CSV_FORMATS = {
+    file_type: {
+        field: "%02x" if field == "opcode" else "%d" for field in CSV_FIELDNAMES[file_type]
+    }
+    for file_type in (FileType.CALL_FRAME, FileType.FRAME)
+}
+
+
+def to_uint64_array(values: Sequence[int]) -> np.ndarray:
+    """
+    Convert integers to an array, keeping their exact values.
+
+    Args:
+        values (Sequence[int]): The integers to convert.
+
+    Returns:
+        np.ndarray: An uint64 array, or an object array of Python integers if any value
+            does not fit in 64 bits, such as the offset of a zero sized access.
+    """
+    try:
+        return np.asarray(values, dtype=np.uint64)
+    except OverflowError:
+        return np.asarray(values, dtype=object)
+
+
+def saturate_uint64(values: np.ndarray) -> np.ndarray:
+    """
+    Convert a column to uint64, saturating values that do not fit in 64 bits.
+
+    Args:
+        values (np.ndarray): An uint64 array, or an object array of Python integers.
+
+    Returns:
+        np.ndarray: The uint64 array.
+    """
+    if values.dtype == object:
+        return np.minimum(values, UINT64_MAX).astype(np.uint64)
+    return values
+
+
+def empty_columns() -> CallFrameColumns:
+    """
+    Create the columns of an empty batch of call frames.
+
+    Returns:
+        CallFrameColumns: An empty array per column.
+    """
+    columns = {
+        field: np.zeros(0, dtype=np.uint64) for field in CSV_FIELDNAMES[FileType.CALL_FRAME]
+    }
+    columns["call_depth"] = np.zeros(0, dtype=np.uint16)
+    columns["opcode"] = np.zeros(0, dtype=np.uint8)
+    columns["call_frame_index"] = np.zeros(0, dtype=np.uint32)
+    return columns
+
+
+def decode_packed_columns(transaction_id: int, packed: Dict[str, List[int]]) -> CallFrameColumns:
+    """
+    Decode the parallel arrays returned by the compact tracer into call frame columns.
+
+    Instructions that access several memory regions, such as `CALL` and `MCOPY`, are
+    flattened into a row per region by repeating their columns. Traces without call frame
+    ordinals get the ordinal 0.
+
+    Args:
+        transaction_id (int): The id of the transaction.
+        packed (Dict[str, List[int]]): The packed memory accesses of the transaction.
+
+    Returns:
+        CallFrameColumns: The call frame columns of the transaction.
+    """
+    if not packed.get("op"):
+        return empty_columns()
+
+    opcodes = np.asarray(packed["op"], dtype=np.uint8)
+    region_counts = REGION_COUNT_TABLE[opcodes]
+    regions = to_uint64_array(packed["regions"]).reshape(-1, 2)
+
+    frames = packed.get("frame") or np.zeros(len(opcodes), dtype=np.uint32)
+    pre_memory_size = np.repeat(to_uint64_array(packed["pre_memory_size"]), region_counts)
+    post_memory_size = np.repeat(to_uint64_array(packed["post_memory_size"]), region_counts)
+
+    return {
+        "transaction_id": np.full(len(regions), transaction_id, dtype=np.uint64),
+        "call_depth": np.repeat(np.asarray(packed["depth"], dtype=np.uint16), region_counts),
+        "opcode": np.repeat(opcodes, region_counts),
+        "memory_access_offset": regions[:, 0],
+        "memory_access_size": regions[:, 1],
+        "opcode_gas_cost": np.repeat(to_uint64_array(packed["gas_cost"]), region_counts),
+        "pre_active_memory_size": pre_memory_size,
+        "post_active_memory_size": post_memory_size,
+        "memory_expansion": post_memory_size - pre_memory_size,
+        "call_frame_index": np.repeat(np.asarray(frames, dtype=np.uint32), region_counts),
+    }
+
+
+def rows_to_columns(rows: List[Dict[str, str]]) -> CallFrameColumns:
+    """
+    Convert call frame rows to columns.
+
+    Args:
+        rows (List[Dict[str, str]]): The call frame rows.
+
+    Returns:
+        CallFrameColumns: The call frame columns.
+    """
+    if not rows:
+        return empty_columns()
+
+    columns = {
+        field: to_uint64_array([int(row[field]) for row in rows])
+        for field in CSV_FIELDNAMES[FileType.CALL_FRAME]
+        if field != "opcode"
+    }
+    columns["call_depth"] = columns["call_depth"].astype(np.uint16)
+    columns["call_frame_index"] = columns["call_frame_index"].astype(np.uint32)
+    columns["opcode"] = np.asarray([int(row["opcode"], 16) for row in rows], dtype=np.uint8)
+    return {field: columns[field] for field in CSV_FIELDNAMES[FileType.CALL_FRAME]}
+
+
+def concat_columns(batches: List[CallFrameColumns]) -> CallFrameColumns:
+    """
+    Concatenate the call frame columns of several batches.
+
+    Args:
+        batches (List[CallFrameColumns]): The columns of each batch, in order.
+
+    Returns:
+        CallFrameColumns: The columns of all the batches.
+    """
+    if not batches:
+        return empty_columns()
+    return {field: np.concatenate([batch[field] for batch in batches]) for field in batches[0]}
+
+
+@metrics.timed("extract")
+def decode_call_frame_columns(
+    transactions: List[Dict[str, str]], traces: List[dict]
+) -> CallFrameColumns:
+    """
+    Decode the trace results of a batch of transactions into call frame columns.
+
+    Args:
+        transactions (List[Dict[str, str]]): The transactions, each including 'id'.
+        traces (List[dict]): The result of the custom memory tracer for each transaction.
+
+    Returns:
+        CallFrameColumns: The call frame columns of the transactions, in order.
+    """
+    batches = []
+    for transaction, trace_data in zip(transactions, traces):
+        # Ignore failed transactions
+        if trace_data["error"]:
+            continue
+
+        if "packed" in trace_data:
+            batches.append(decode_packed_columns(int(transaction["id"]), trace_data["packed"]))
+        else:
+            # Traces of the original tracer
+            batches.append(rows_to_columns(parse_call_frames(transaction, trace_data)))
+
+    return concat_columns(batches)
+
+
+async def get_call_frame_columns_from_transactions(
+    transactions: List[Dict[str, str]], session: ClientSession
+) -> CallFrameColumns:
+    """
+    Get the call frame columns of a batch of transactions using a single batched RPC request.
+
+    Args:
+        transactions (List[Dict[str, str]]): The transactions, each including 'id' and 'tx_hash'.
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        CallFrameColumns: The call frame columns of the transactions, in order.
+
+    Raises:
+        ValueError: If 'tx_hash' or 'id' is missing from any transaction.
+    """
+    for transaction in transactions:
+        if not transaction.get("tx_hash") or not transaction.get("id"):
+            raise ValueError("Transaction must contain 'tx_hash' and 'id'.")
+
+    traces = await get_transaction_traces([tx["tx_hash"] for tx in transactions], session)
+    return decode_call_frame_columns(transactions, traces)
+
+
+async def get_call_frame_columns_from_blocks(
+    block_numbers: List[int], session: ClientSession
+) -> Tuple[List[Dict[str, str]], CallFrameColumns]:
+    """
+    Get transactions and their call frame columns from a batch of blocks by tracing
+    whole blocks.
+
+    Args:
+        block_numbers (List[int]): The block numbers to trace.
+        session (ClientSession): The aiohttp client session for making API requests.
+
+    Returns:
+        Tuple[List[Dict[str, str]], CallFrameColumns]: The transactions of the blocks and
+            the call frame columns of those transactions.
+    """
+    transactions, traces = await get_traced_blocks(block_numbers, session)
+    return transactions, decode_call_frame_columns(transactions, traces)
+
+
+def count_rows(columns: CallFrameColumns) -> int:
+    """
+    Count the call frames of a batch.
+
+    Args:
+        columns (CallFrameColumns): The call frame columns.
+
+    Returns:
+        int: The number of call frames.
+    """
+    return len(columns["transaction_id"])
+
+
+def summarize_frames(columns: CallFrameColumns) -> CallFrameColumns:
+    """
+    Summarize call frame rows into a row per call frame, identified by its transaction and
+    its ordinal within the transaction.
+
+    As the memory of a call frame starts empty, the memory expansion gas it paid is the
+    quadratic cost of its peak active memory size. Call frames without memory accesses
+    are not included.
+
+    Args:
+        columns (CallFrameColumns): The call frame columns, including every row of each of
+            their transactions.
+
+    Returns:
+        CallFrameColumns: The columns of the frames table, ordered by transaction and
+            call frame ordinal.
+    """
+    fields = CSV_FIELDNAMES[FileType.FRAME]
+    if not count_rows(columns):
+        return {field: np.zeros(0, dtype=np.uint64) for field in fields}
+
+    order = np.lexsort((columns["call_frame_index"], columns["transaction_id"]))
+    transaction_ids = columns["transaction_id"][order]
+    frames = columns["call_frame_index"][order]
+
+    # First row of each call frame
+    starts = np.flatnonzero(
+        np.concatenate(
+            ([True], (transaction_ids[1:] != transaction_ids[:-1]) | (frames[1:] != frames[:-1]))
+        )
+    )
+    peak_memory_size = np.maximum.reduceat(
+        saturate_uint64(columns["post_active_memory_size"])[order], starts
+    )
+    access_bytes = np.add.reduceat(saturate_uint64(columns["memory_access_size"])[order], starts)
+    words = (peak_memory_size + EVM_WORD_SIZE - 1) // EVM_WORD_SIZE
+
+    return {
+        "transaction_id": transaction_ids[starts],
+        "call_frame_index": frames[starts],
+        "call_depth": columns["call_depth"][order][starts],
+        "memory_accesses": np.diff(np.append(starts, len(order))).astype(np.uint64),
+        "peak_active_memory_size": peak_memory_size,
+        "memory_access_bytes": access_bytes,
+        "memory_expansion_gas": MEMORY_GAS_PER_WORD * words + words * words // QUADRATIC_DIVISOR,
+    }
+
+
+def format_csv_rows(columns: CallFrameColumns, file_type: FileType = FileType.CALL_FRAME) -> str:
+    """
+    Render call frame or frame columns as CSV rows in bulk.
+
+    All the values are formatted with a single printf-style operation instead of a
+    writer call per row.
+
+    Args:
+        columns (CallFrameColumns): The columns.
+        file_type (FileType): The type of file the columns belong to.
+
+    Returns:
+        str: The CSV rows, without header.
+    """
+    row_count = count_rows(columns)
+    if not row_count:
+        return ""
+
+    fields = CSV_FIELDNAMES[file_type]
+    row_format = ",".join(CSV_FORMATS[file_type][field] for field in fields) + "\n"
+
+    # Interleave the columns into row-major order
+    values = chain.from_iterable(zip(*(columns[field].tolist() for field in fields)))
+
+    return (row_format * row_count) % tuple(values)
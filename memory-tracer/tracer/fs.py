@@ -1,21 +1,334 @@
 import csv
 import gzip
+import io
 import os
-import shutil
+import re
+from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Iterator, List
+from typing import IO, Dict, Iterator, List, Optional, Tuple
 
-from tracer.config import DATA_DIR
+from tracer.config import DATA_DIR, INDEX_UNIT_SIZE
+from tracer.metrics import metrics
 
 
 # Enum to define the type of files this handler can manage
 class FileType(Enum):
     TRANSACTION = "transactions"
     CALL_FRAME = "call_frames"
+    FRAME = "frames"
+
+
+# Enum to define the formats output can be written in
+class OutputFormat(Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+    ARROW = "arrow"
+    COMPACT = "compact"
+
+
+# Enum to define the formats a combined dataset can be written in
+class CombinedFormat(Enum):
+    HDF5 = "hdf5"
+    PARQUET = "parquet"
+
+
+# Enum to define the codecs CSV output can be compressed with while it is written
+class Compression(Enum):
+    GZIP = "gzip"
+    ZSTD = "zstd"
+    LZ4 = "lz4"
+
+
+COMPRESSION_EXTENSIONS = {
+    Compression.GZIP: "gz",
+    Compression.ZSTD: "zst",
+    Compression.LZ4: "lz4",
+}
+
+CSV_FIELDNAMES = {
+    FileType.TRANSACTION: ["id", "block", "tx_hash", "tx_gas", "to", "traced"],
+    FileType.CALL_FRAME: [
+        "transaction_id",
+        "call_depth",
+        "opcode",
+        "memory_access_offset",
+        "memory_access_size",
+        "opcode_gas_cost",
+        "pre_active_memory_size",
+        "post_active_memory_size",
+        "memory_expansion",
+        "call_frame_index",
+    ],
+    FileType.FRAME: [
+        "transaction_id",
+        "call_frame_index",
+        "call_depth",
+        "memory_accesses",
+        "peak_active_memory_size",
+        "memory_access_bytes",
+        "memory_expansion_gas",
+    ],
+}
+
+# Column holding the transaction id of each file type
+ID_COLUMNS = {
+    FileType.TRANSACTION: "id",
+    FileType.CALL_FRAME: "transaction_id",
+    FileType.FRAME: "transaction_id",
+}
+
+# Name of the part files of a directory output, e.g. "part-00012.parquet"
+PART_FILE_PATTERN = re.compile(r"part-(\d+)\.")
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    output_format: OutputFormat = OutputFormat.CSV
+    # Compress CSV output while it is written instead of once it is complete
+    compression: Optional[Compression] = None
+    # Rotate streamed CSV output into chunk files of about this many uncompressed bytes.
+    # Zero writes a single file.
+    chunk_size: int = 0
+
+
+def get_output_directory(start_block: int, end_block: int, directory: str = DATA_DIR) -> str:
+    """
+    Get the directory holding the output of a block range.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        str: The path of the output directory.
+    """
+    return os.path.join(directory, f"{start_block}_to_{end_block}")
+
+
+def get_output_file_name(
+    start_block: int, end_block: int, file_type: FileType, directory: str = DATA_DIR
+) -> str:
+    """
+    Get the path of the uncompressed output file of a block range.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        str: The path of the CSV file.
+    """
+    return os.path.join(
+        get_output_directory(start_block, end_block, directory), f"{file_type.value}.csv"
+    )
+
+
+def get_output_path(
+    start_block: int,
+    end_block: int,
+    file_type: FileType,
+    options: OutputOptions,
+    directory: str = DATA_DIR,
+) -> str:
+    """
+    Get the path of the finished output of a block range.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        options (OutputOptions): The options the output is written with.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        str: The path of the compressed CSV file, or of the directory holding the
+            part files of a columnar or chunked dataset.
+    """
+    file_name = get_output_file_name(start_block, end_block, file_type, directory)
+
+    if options.output_format != OutputFormat.CSV:
+        return os.path.join(
+            get_output_directory(start_block, end_block, directory),
+            f"{file_type.value}.{options.output_format.value}",
+        )
+    if options.compression is None:
+        return f"{file_name}.gz"
+    if options.chunk_size:
+        return file_name
+    return f"{file_name}.{COMPRESSION_EXTENSIONS[options.compression]}"
+
+
+def find_range_output(
+    start_block: int, end_block: int, file_type: FileType, directory: str = DATA_DIR
+) -> Tuple[str, OutputFormat]:
+    """
+    Find the finished output of a block range, whatever the options it was written with.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        Tuple[str, OutputFormat]: The path of the output and its format.
+
+    Raises:
+        FileNotFoundError: If the range has no finished output.
+    """
+    base_name = os.path.join(directory, f"{start_block}_to_{end_block}", file_type.value)
+
+    candidates = [
+        (f"{base_name}.{OutputFormat.PARQUET.value}", OutputFormat.PARQUET),
+        (f"{base_name}.{OutputFormat.ARROW.value}", OutputFormat.ARROW),
+        (f"{base_name}.{OutputFormat.COMPACT.value}", OutputFormat.COMPACT),
+    ]
+    # Compressed CSV files, or a directory of chunks or of merged shards
+    candidates += [
+        (f"{base_name}.csv.{extension}", OutputFormat.CSV)
+        for extension in COMPRESSION_EXTENSIONS.values()
+    ]
+    candidates.append((f"{base_name}.csv", OutputFormat.CSV))
+
+    for path, output_format in candidates:
+        # A plain CSV file is the uncompressed source of an unfinished output
+        if path == f"{base_name}.csv" and not os.path.isdir(path):
+            continue
+        if os.path.exists(path):
+            return path, output_format
+    raise FileNotFoundError(
+        f"No {file_type.value} output found for blocks {start_block}-{end_block}"
+    )
+
+
+def get_part_index(file_name: str) -> Optional[int]:
+    """
+    Get the index of a part file of a directory output from its name.
+
+    Args:
+        file_name (str): The name of the file.
+
+    Returns:
+        Optional[int]: The index of the part, or None if the file is not a part file.
+    """
+    match = PART_FILE_PATTERN.match(file_name)
+    return int(match.group(1)) if match else None
+
+
+def create_output_handler(
+    start_block: int,
+    end_block: int,
+    file_type: FileType,
+    options: OutputOptions = OutputOptions(),
+    committed_position=None,
+    directory: str = DATA_DIR,
+):
+    """
+    Create the output handler for a file type with the requested options.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file to handle (TRANSACTION or CALL_FRAME).
+        options (OutputOptions): The options to write the output with.
+        committed_position: The position returned by `flush` at the last
+            checkpoint, to resume the output of a previous run.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        OutputHandler | StreamingOutputHandler | ColumnarOutputHandler: The output handler.
+    """
+    if options.output_format == OutputFormat.CSV:
+        if options.compression is None:
+            return OutputHandler(start_block, end_block, file_type, committed_position, directory)
+
+        from tracer.stream import StreamingOutputHandler
+
+        return StreamingOutputHandler(
+            start_block, end_block, file_type, options, committed_position, directory
+        )
+
+    # pyarrow is only required for columnar output
+    from tracer.columnar import ColumnarOutputHandler
+
+    return ColumnarOutputHandler(
+        start_block, end_block, file_type, options, committed_position, directory
+    )
+
+
+def create_iterator(path: str, options: OutputOptions = OutputOptions()):
+    """
+    Create an iterator over the rows of a finished output.
+
+    Args:
+        path (str): The path of the finished output, as returned by `get_output_path`.
+        options (OutputOptions): The options the output was written with.
+
+    Returns:
+        CSVIterator | ColumnarIterator: The iterator, to be used as a context manager.
+    """
+    if options.output_format == OutputFormat.CSV:
+        return CSVIterator(path)
+
+    from tracer.columnar import ColumnarIterator
+
+    return ColumnarIterator(path, options.output_format)
+
+
+def open_compressed_binary(file_name: str, source: Optional[IO[bytes]] = None) -> IO[bytes]:
+    """
+    Open a compressed CSV file for reading bytes, based on its extension.
+
+    Files may hold several concatenated gzip members or zstd/lz4 frames.
+
+    Args:
+        file_name (str): Path to the compressed file.
+        source (Optional[IO[bytes]]): Read the compressed data from this stream instead of
+            the file, e.g. some of the frames of the file.
+
+    Returns:
+        IO[bytes]: The decompressed byte stream.
+    """
+    if file_name.endswith(".zst"):
+        import zstandard  # type: ignore[import-untyped]
+
+        return zstandard.ZstdDecompressor().stream_reader(
+            source or open(file_name, "rb"), read_across_frames=True, closefd=True
+        )
+
+    if file_name.endswith(".lz4"):
+        import lz4.frame  # type: ignore[import-untyped]
+
+        return lz4.frame.open(source or file_name, "rb")
+
+    return gzip.open(source or file_name, "rb")
+
+
+def open_compressed(file_name: str) -> IO[str]:
+    """
+    Open a compressed CSV file for reading text, based on its extension.
+
+    Args:
+        file_name (str): Path to the compressed file.
+
+    Returns:
+        IO[str]: The decompressed text stream.
+    """
+    return io.TextIOWrapper(open_compressed_binary(file_name), encoding="utf-8")
 
 
 class OutputHandler:
-    def __init__(self, start_block: int, end_block: int, file_type: FileType):
+    def __init__(
+        self,
+        start_block: int,
+        end_block: int,
+        file_type: FileType,
+        committed_position: Optional[int] = None,
+        directory: str = DATA_DIR,
+    ):
         """
         Initialize the Handler instance for a specific file type.
 
@@ -23,21 +336,46 @@ class OutputHandler:
             start_block (int): The starting block number.
             end_block (int): The ending block number.
             file_type (FileType): The type of file to handle (TRANSACTION or CALL_FRAME).
+            committed_position (Optional[int]): Resume an existing CSV file by truncating it
+                to this many bytes and appending to it, discarding rows written after the last
+                checkpoint.
+            directory (str): The directory holding the output directories of the ranges.
         """
         self.start_block = start_block
         self.end_block = end_block
         self.file_type = file_type
-        self.directory = os.path.join(DATA_DIR, f"{self.start_block}_to_{self.end_block}")
-        self.file_name = os.path.join(self.directory, f"{self.file_type.value}.csv")
+        self.directory = get_output_directory(self.start_block, self.end_block, directory)
+        self.file_name = get_output_file_name(
+            self.start_block, self.end_block, self.file_type, directory
+        )
         self.compressed_file_name = f"{self.file_name}.gz"
+        self.output_path = self.compressed_file_name
 
         # Ensure the directory exists
         os.makedirs(self.directory, exist_ok=True)
 
+        # The index of the output is resumed along with it
+        from tracer.index import IndexUnit, IndexWriter
+
         # Open the CSV file and initialize the CSV writer with appropriate headers
-        self.csv_file = open(self.file_name, "w", newline="")
-        self.writer = self.create_writer()
-        self.writer.writeheader()
+        if committed_position is not None and os.path.exists(self.file_name):
+            self.csv_file = open(self.file_name, "r+", newline="")
+            self.csv_file.truncate(committed_position)
+            self.csv_file.seek(committed_position)
+            self.writer = self.create_writer()
+            self.index = IndexWriter(
+                start_block, end_block, file_type, (0, committed_position), directory
+            )
+        else:
+            self.csv_file = open(self.file_name, "w", newline="")
+            self.writer = self.create_writer()
+            self.writer.writeheader()
+            self.index = IndexWriter(start_block, end_block, file_type, directory=directory)
+
+        # Rows are indexed in units of about `INDEX_UNIT_SIZE` bytes, each compressed into
+        # its own gzip member once the output is finished
+        self.unit = IndexUnit()
+        self.unit_start = self.csv_file.tell()
 
     def create_writer(self):
         """
@@ -46,21 +384,7 @@ class OutputHandler:
         Returns:
             csv.DictWriter: The CSV writer instance configured with appropriate headers.
         """
-        # Define fieldnames based on file type
-        fieldnames = {
-            FileType.TRANSACTION: ["id", "block", "tx_hash", "tx_gas", "to"],
-            FileType.CALL_FRAME: [
-                "transaction_id",
-                "call_depth",
-                "opcode",
-                "memory_access_offset",
-                "memory_access_size",
-                "opcode_gas_cost",
-                "pre_active_memory_size",
-                "post_active_memory_size",
-                "memory_expansion",
-            ],
-        }.get(self.file_type, [])
+        fieldnames = CSV_FIELDNAMES.get(self.file_type, [])
 
         if not fieldnames:
             raise ValueError(f"Unsupported file type: {self.file_type}")
@@ -69,6 +393,7 @@ class OutputHandler:
             self.csv_file, fieldnames=fieldnames, extrasaction="ignore", lineterminator="\n"
         )
 
+    @metrics.timed("write")
     def write(self, data: List[Dict[str, str]]):
         """
         Write a list of dictionaries to the CSV file.
@@ -76,20 +401,103 @@ class OutputHandler:
         Args:
             data (List[Dict[str, str]]): The data to write to the file.
         """
+        metrics.increment(f"{self.file_type.value}_rows", len(data))
+        self.unit.add_rows(self.file_type, data)
         for entry in data:
             self.writer.writerow(entry)
 
+        if self.csv_file.tell() - self.unit_start >= INDEX_UNIT_SIZE:
+            self.end_unit()
+
+    @metrics.timed("write")
+    def write_columns(self, columns):
+        """
+        Write call frame or frame columns to the CSV file in bulk.
+
+        Args:
+            columns (CallFrameColumns): The columns to write.
+        """
+        from tracer.frames import count_rows, format_csv_rows
+
+        metrics.increment(f"{self.file_type.value}_rows", count_rows(columns))
+        self.unit.add_columns(columns)
+        self.csv_file.write(format_csv_rows(columns, self.file_type))
+
+        if self.csv_file.tell() - self.unit_start >= INDEX_UNIT_SIZE:
+            self.end_unit()
+
+    def end_unit(self):
+        """
+        Index the rows written since the start of the current unit, and start a new one.
+        """
+        from tracer.index import IndexUnit
+
+        self.index.add_unit(0, self.unit_start, self.unit)
+        self.unit = IndexUnit()
+        self.unit_start = self.csv_file.tell()
+
+    async def drain(self):
+        """
+        Rows are written to disk as they are buffered, so there is nothing to wait for.
+        """
+
+    async def wait_for_writes(self):
+        """
+        Rows are written to disk as they are buffered, so there is nothing to wait for.
+        """
+
+    @metrics.timed("flush")
+    def flush(self) -> int:
+        """
+        Flush buffered rows to disk, along with the index of the rows.
+
+        Returns:
+            int: The number of bytes written to the CSV file so far.
+        """
+        # A unit never spans a checkpoint, so that resuming discards whole units
+        self.end_unit()
+        self.csv_file.flush()
+        self.index.save()
+        return self.csv_file.tell()
+
+    def close(self):
+        """
+        Close the CSV file without finishing the output, which is resumed by a new handler.
+        """
+        self.csv_file.close()
+
+    @metrics.timed("compress")
     def compress(self, delete_source=True):
         """
         Compress the CSV file into a gzip format and remove the original file.
+
+        Every unit of the index is compressed into its own gzip member, so that it can
+        be decompressed without reading the members before it. Readers of gzip files
+        decompress consecutive members as a single stream.
         """
+        self.end_unit()
         # Important to close the file so that buffers are written to disk
         self.csv_file.close()
+        self.index.save()
+
+        positions = self.index.read_units()["position"].tolist()
+        # The first member also holds the CSV header
+        boundaries = [0] + positions[1:]
 
+        offsets = []
         with open(self.file_name, "rb") as f_in:
-            with gzip.open(self.compressed_file_name, "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        delete_source and os.remove(self.file_name)
+            with open(self.compressed_file_name, "wb") as f_out:
+                for start, end in zip(boundaries, boundaries[1:] + [None]):
+                    offsets.append(f_out.tell())
+                    f_out.write(gzip.compress(f_in.read(-1 if end is None else end - start)))
+        self.index.set_offsets(offsets[: len(positions)])
+        delete_source and self.remove_source()
+
+    def remove_source(self):
+        """
+        Remove the uncompressed CSV file.
+        """
+        os.remove(self.file_name)
 
     def __del__(self):
         """
@@ -104,21 +512,45 @@ class CSVIterator:
         Initialize the CSVIterator instance.
 
         Args:
-            file_path (str): Path to the gzip-compressed CSV file.
+            file_path (str): Path to the compressed CSV file (gzip, zstd or lz4), or to a
+                directory of compressed chunk files sharing the same header.
         """
         self.file_path = file_path
         self._file = None
         self._csv_reader = None
+        self._chunks: Optional[List[str]] = None
         self.header = None
 
     def __enter__(self):
         """
-        Enter the runtime context related to this object.
+        Enter the runtime context related to this object. A directory without chunk
+        files has no rows.
+        """
+        if os.path.isdir(self.file_path):
+            self._chunks = sorted(
+                os.path.join(self.file_path, chunk)
+                for chunk in os.listdir(self.file_path)
+                if get_part_index(chunk) is not None
+            )
+        else:
+            self._chunks = [self.file_path]
+
+        if self._chunks:
+            self.open_chunk(self._chunks.pop(0))
+        return self
+
+    def open_chunk(self, chunk_path: str):
+        """
+        Open a compressed file and read its header row.
+
+        Args:
+            chunk_path (str): Path to the compressed file.
         """
-        self._file = gzip.open(self.file_path, "rt", encoding="utf-8")
+        if self._file:
+            self._file.close()
+        self._file = open_compressed(chunk_path)
         self._csv_reader = csv.reader(self._file)
         self.header = next(self._csv_reader)  # Read and skip the header row
-        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
@@ -134,9 +566,14 @@ class CSVIterator:
         Returns:
             Iterator[Dict[str, str]]: An iterator over the CSV rows as dictionaries.
         """
-        if self._csv_reader is None:
+        if self._chunks is None:
             raise RuntimeError("Iterator not initialized. Ensure you use the context manager.")
 
-        # Process each row, skipping the header
-        for row in self._csv_reader:
-            yield dict(zip(self.header, row))
+        while True:
+            # Process each row, skipping the header
+            for row in self._csv_reader or []:
+                yield dict(zip(self.header, row))
+
+            if not self._chunks:
+                return
+            self.open_chunk(self._chunks.pop(0))
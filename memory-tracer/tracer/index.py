@@ -0,0 +1,331 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tracer.config import DATA_DIR
+from tracer.fs import FileType, get_output_directory
+
+# Record of a unit of rows of an output: the part file holding it, the position the writer
+# resumes from before it, the offset it is read from in the finished output (a byte offset
+# in compressed CSV, a row group or record batch index in columnar output), the range of
+# transaction ids of its rows and the set of opcodes of its call frames.
+UNIT_DTYPE = np.dtype(
+    [
+        ("part", "<u8"),
+        ("position", "<u8"),
+        ("offset", "<u8"),
+        ("first_id", "<u8"),
+        ("last_id", "<u8"),
+        ("rows", "<u8"),
+        ("opcodes", "u1", (32,)),
+    ]
+)
+
+# Record of a transaction, to look transactions up by block or hash, and the unit of the
+# transactions output holding it
+TRANSACTION_DTYPE = np.dtype(
+    [("id", "<u8"), ("block", "<u8"), ("hash_key", "<u8"), ("unit", "<u8")]
+)
+
+
+def get_index_file_names(
+    start_block: int, end_block: int, file_type: FileType, directory: str = DATA_DIR
+) -> Tuple[str, str]:
+    """
+    Get the paths of the sidecar index files of an output.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        Tuple[str, str]: The paths of the file of units, and of the file of transactions
+            (only written for the transactions output).
+    """
+    base_name = os.path.join(
+        get_output_directory(start_block, end_block, directory), file_type.value
+    )
+    return f"{base_name}.index", f"{base_name}.lookup"
+
+
+def get_hash_key(tx_hash: str) -> int:
+    """
+    Get the key a transaction hash is looked up by, its last 8 bytes.
+
+    Args:
+        tx_hash (str): The hex encoded transaction hash.
+
+    Returns:
+        int: The key, as an unsigned 64-bit integer.
+    """
+    return int(tx_hash.removeprefix("0x")[-16:] or "0", 16)
+
+
+def read_records(file_name: str, dtype: np.dtype) -> np.ndarray:
+    """
+    Read the records of an index file.
+
+    Args:
+        file_name (str): The path of the index file.
+        dtype (np.dtype): The type of the records.
+
+    Returns:
+        np.ndarray: The records, empty if the file does not exist.
+    """
+    if not os.path.exists(file_name):
+        return np.zeros(0, dtype=dtype)
+
+    with open(file_name, "rb") as f:
+        data = f.read()
+    # A record torn by a crash is ignored, its rows being discarded on resume
+    return np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize).copy()
+
+
+def load_index(
+    start_block: int, end_block: int, file_type: FileType, directory: str = DATA_DIR
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the index of an output.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        directory (str): The directory holding the output directories of the ranges.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The unit records and the transaction records.
+    """
+    file_name, lookup_file_name = get_index_file_names(
+        start_block, end_block, file_type, directory
+    )
+    return read_records(file_name, UNIT_DTYPE), read_records(lookup_file_name, TRANSACTION_DTYPE)
+
+
+class IndexUnit:
+    def __init__(self):
+        """
+        Initialize the summary of a unit of rows, as they are written.
+        """
+        self.first_id: Optional[int] = None
+        self.last_id: Optional[int] = None
+        self.rows = 0
+        self.opcodes = np.zeros(256, dtype=bool)
+        self.transactions: List[np.ndarray] = []
+
+    def add_ids(self, ids: np.ndarray):
+        """
+        Add the transaction ids of written rows.
+
+        Args:
+            ids (np.ndarray): The transaction id of each row.
+        """
+        if not len(ids):
+            return
+        first_id, last_id = int(ids.min()), int(ids.max())
+        self.first_id = first_id if self.first_id is None else min(self.first_id, first_id)
+        self.last_id = last_id if self.last_id is None else max(self.last_id, last_id)
+        self.rows += len(ids)
+
+    def add_rows(self, file_type: FileType, data: List[Dict[str, str]]):
+        """
+        Add rows written as dictionaries.
+
+        Args:
+            file_type (FileType): The type of file the rows are written to.
+            data (List[Dict[str, str]]): The rows.
+        """
+        if file_type == FileType.TRANSACTION:
+            transactions = np.zeros(len(data), dtype=TRANSACTION_DTYPE)
+            transactions["id"] = [int(tx["id"]) for tx in data]
+            transactions["block"] = [int(tx["block"]) for tx in data]
+            transactions["hash_key"] = [get_hash_key(tx["tx_hash"]) for tx in data]
+            self.transactions.append(transactions)
+            self.add_ids(transactions["id"])
+        elif file_type == FileType.CALL_FRAME:
+            self.opcodes[[int(row["opcode"], 16) for row in data]] = True
+            self.add_ids(np.asarray([int(row["transaction_id"]) for row in data]))
+
+    def add_columns(self, columns):
+        """
+        Add call frames or frames written as columns.
+
+        Args:
+            columns (CallFrameColumns): The columns.
+        """
+        if "opcode" in columns:
+            self.opcodes[columns["opcode"]] = True
+        self.add_ids(columns["transaction_id"])
+
+
+class IndexWriter:
+    def __init__(
+        self,
+        start_block: int,
+        end_block: int,
+        file_type: FileType,
+        committed_position: Optional[Tuple[int, int]] = None,
+        directory: str = DATA_DIR,
+    ):
+        """
+        Initialize the writer of the sidecar index of an output.
+
+        Output handlers split their rows into units that can be read on their own, and
+        record each unit as it is written. Records are appended to the index files when
+        the output is flushed, so the index covers the same rows as a checkpoint.
+
+        Args:
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+            file_type (FileType): The type of file to index.
+            committed_position (Optional[Tuple[int, int]]): Resume the index of an existing
+                output from this `(part, position)`, discarding the units written after it.
+            directory (str): The directory holding the output directories of the ranges.
+        """
+        self.file_type = file_type
+        self.file_name, self.lookup_file_name = get_index_file_names(
+            start_block, end_block, file_type, directory
+        )
+
+        # Records not yet appended to the index files
+        self.units: List[np.ndarray] = []
+        self.transactions: List[np.ndarray] = []
+
+        if committed_position is None:
+            for file_name in (self.file_name, self.lookup_file_name):
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+            self.unit_count = 0
+        else:
+            self.unit_count = self.truncate(*committed_position)
+
+    def truncate(self, part: int, position: int) -> int:
+        """
+        Discard the records of the units written at or after a position of the output.
+
+        Args:
+            part (int): The part of the position.
+            position (int): The position in the part.
+
+        Returns:
+            int: The number of units kept.
+        """
+        units = read_records(self.file_name, UNIT_DTYPE)
+        # Units are recorded in the order they are written
+        kept = int(
+            np.sum(
+                (units["part"] < part) | ((units["part"] == part) & (units["position"] < position))
+            )
+        )
+        if os.path.exists(self.file_name):
+            os.truncate(self.file_name, kept * UNIT_DTYPE.itemsize)
+
+        transactions = read_records(self.lookup_file_name, TRANSACTION_DTYPE)
+        kept_transactions = int(np.searchsorted(transactions["unit"], kept))
+        if os.path.exists(self.lookup_file_name):
+            os.truncate(self.lookup_file_name, kept_transactions * TRANSACTION_DTYPE.itemsize)
+
+        return kept
+
+    def add_unit(self, part: int, position: int, unit: IndexUnit):
+        """
+        Record a unit of rows, read from the same position it was written at.
+
+        Args:
+            part (int): The part file holding the unit.
+            position (int): The position of the unit in the part.
+            unit (IndexUnit): The summary of the rows of the unit.
+        """
+        if not unit.rows:
+            return
+
+        record = np.zeros(1, dtype=UNIT_DTYPE)
+        record["part"] = part
+        record["position"] = position
+        record["offset"] = position
+        record["first_id"] = unit.first_id
+        record["last_id"] = unit.last_id
+        record["rows"] = unit.rows
+        record["opcodes"] = np.packbits(unit.opcodes)
+
+        index = self.unit_count + len(self.units)
+        for transactions in unit.transactions:
+            transactions["unit"] = index
+            self.transactions.append(transactions)
+        self.units.append(record)
+
+    def save(self):
+        """
+        Append the pending records to the index files.
+        """
+        if not self.units:
+            return
+
+        with open(self.file_name, "ab") as f:
+            f.write(np.concatenate(self.units).tobytes())
+        transactions = np.concatenate(self.transactions or [np.zeros(0, TRANSACTION_DTYPE)])
+        if len(transactions):
+            with open(self.lookup_file_name, "ab") as f:
+                f.write(transactions.tobytes())
+
+        self.unit_count += sum(len(units) for units in self.units)
+        self.units = []
+        self.transactions = []
+
+    def read_units(self) -> np.ndarray:
+        """
+        Read the saved unit records.
+
+        Returns:
+            np.ndarray: The unit records.
+        """
+        return read_records(self.file_name, UNIT_DTYPE)
+
+    def set_offsets(self, offsets: List[int]):
+        """
+        Set the offsets units are read from, for output rewritten once finished.
+
+        Args:
+            offsets (List[int]): The offset of every saved unit, in order.
+        """
+        units = self.read_units()
+        units["offset"] = offsets
+
+        # Write to a temporary file first so that a crash never leaves a corrupt index
+        temp_file_name = f"{self.file_name}.tmp"
+        with open(temp_file_name, "wb") as f:
+            f.write(units.tobytes())
+        os.replace(temp_file_name, self.file_name)
+
+
+def merge_indexes(
+    start_block: int,
+    end_block: int,
+    file_type: FileType,
+    shards: List[Tuple[int, int, int]],
+    shards_directory: str,
+):
+    """
+    Merge the indexes of the shards of a run into the index of the whole range.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        shards (List[Tuple[int, int, int]]): The block range of each shard, in block order,
+            with the number of the first merged part holding its output.
+        shards_directory (str): The directory holding the output directories of the shards.
+    """
+    writer = IndexWriter(start_block, end_block, file_type)
+    unit_count = 0
+    for shard_start, shard_end, first_part in shards:
+        units, transactions = load_index(shard_start, shard_end, file_type, shards_directory)
+        units["part"] += np.uint64(first_part)
+        transactions["unit"] += np.uint64(unit_count)
+        unit_count += len(units)
+        writer.units.append(units)
+        writer.transactions.append(transactions)
+    writer.save()
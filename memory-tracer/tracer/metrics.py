@@ -0,0 +1,271 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+
+from tracer.config import METRICS_INTERVAL
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Initialize the instrumentation of the tracing pipeline.
+
+        Stages record the time they take in timers, and the amounts they process in
+        counters, which all only grow so that rates can be derived between snapshots.
+        Gauges are read when a snapshot is taken. Stages run on the event loop as well as
+        on writer threads, so recording is guarded by a lock.
+        """
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        # Number of calls and total seconds of each stage
+        self.timers: Dict[str, List[float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.maxima: Dict[str, int] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        # Gauges kept up to date by the code they measure
+        self.levels: Dict[str, int] = {}
+
+        self.file_name: Optional[str] = None
+        self.label = ""
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def add_time(self, stage: str, seconds: float):
+        """
+        Record a call of a stage.
+
+        Args:
+            stage (str): The name of the stage.
+            seconds (float): The time the call took.
+        """
+        with self.lock:
+            timer = self.timers.setdefault(stage, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """
+        Record the time spent in the context as a call of a stage.
+
+        Args:
+            stage (str): The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str) -> Callable:
+        """
+        Decorate a function to record its calls as calls of a stage.
+
+        Args:
+            stage (str): The name of the stage.
+
+        Returns:
+            Callable: The decorator.
+        """
+
+        def decorator(f: Callable) -> Callable:
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.time(stage):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def increment(self, name: str, value: int = 1):
+        """
+        Add to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (int): The amount to add.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: int):
+        """
+        Add a value to a counter, and keep track of the largest value added.
+
+        Args:
+            name (str): The name of the counter, also used for its maximum.
+            value (int): The value observed.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.maxima[name] = max(self.maxima.get(name, 0), value)
+
+    def adjust(self, name: str, delta: int):
+        """
+        Move a gauge kept up to date by the code it measures.
+
+        Args:
+            name (str): The name of the gauge.
+            delta (int): The amount to add, negative to decrease it.
+        """
+        with self.lock:
+            self.levels[name] = self.levels.get(name, 0) + delta
+
+    def register_gauge(self, name: str, read: Callable[[], float]):
+        """
+        Register a gauge read whenever a snapshot is taken, replacing any gauge of the
+        same name.
+
+        Args:
+            name (str): The name of the gauge.
+            read (Callable[[], float]): Returns the current value of the gauge.
+        """
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        """
+        Take a snapshot of the metrics recorded so far.
+
+        Returns:
+            dict: The timers, counters and current value of the gauges.
+        """
+        gauges = {}
+        # Gauges read state owned by the event loop, which may change while they are read
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception:
+                continue
+
+        with self.lock:
+            gauges.update(self.levels)
+            return {
+                "time": time.time(),
+                "elapsed": round(time.monotonic() - self.started_at, 3),
+                "process": self.label,
+                "pid": os.getpid(),
+                "timers": {
+                    stage: {"calls": calls, "seconds": round(seconds, 6)}
+                    for stage, (calls, seconds) in self.timers.items()
+                },
+                "counters": dict(self.counters),
+                "maxima": dict(self.maxima),
+                "gauges": gauges,
+            }
+
+    def write_snapshot(self):
+        """
+        Append a snapshot to the metrics log as a line of JSON.
+        """
+        line = json.dumps(self.snapshot())
+        # Each line is written at once, so processes can share the same log
+        with open(self.file_name, "a") as f:
+            f.write(line + "\n")
+
+    def run(self, interval: float):
+        """
+        Write a snapshot every interval until the metrics log is stopped.
+
+        Args:
+            interval (float): The number of seconds between snapshots.
+        """
+        while not self.stopped.wait(interval):
+            self.write_snapshot()
+
+    def start(self, file_name: str, label: str, interval: float = METRICS_INTERVAL):
+        """
+        Start writing snapshots to a metrics log periodically, on a background thread.
+
+        Args:
+            file_name (str): The path of the metrics log, appended to.
+            label (str): Identifies the process in the snapshots, e.g. its block range.
+            interval (float): The number of seconds between snapshots.
+        """
+        self.file_name = file_name
+        self.label = label
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the metrics log, writing a last snapshot.
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.write_snapshot()
+
+
+metrics = Metrics()
+
+
+@dataclass(frozen=True)
+class Instrumentation:
+    # Append periodic snapshots of the metrics to this JSON lines file
+    metrics_file: Optional[str] = None
+    # Write the profile of the run to this file: an HTML report of pyinstrument if it
+    # ends with .html, the stats of cProfile otherwise
+    profile_file: Optional[str] = None
+
+
+@contextmanager
+def profile(file_name: str) -> Iterator[None]:
+    """
+    Profile the code run in the context.
+
+    Args:
+        file_name (str): The path of the profile, an HTML report of pyinstrument if it
+            ends with .html, or cProfile stats to load with `pstats` or snakeviz otherwise.
+    """
+    if file_name.endswith(".html"):
+        # pyinstrument is only required for its reports, which show time spent awaiting
+        from pyinstrument import Profiler  # type: ignore[import-untyped]
+
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(file_name, "w") as f:
+                f.write(profiler.output_html())
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_name)
+
+
+@contextmanager
+def instrument(instrumentation: Instrumentation, label: str) -> Iterator[None]:
+    """
+    Write the metrics log and the profile of the code run in the context, as selected.
+
+    Args:
+        instrumentation (Instrumentation): The instrumentation to run.
+        label (str): Identifies the process in the metrics log, e.g. its block range.
+    """
+    if instrumentation.metrics_file:
+        metrics.start(instrumentation.metrics_file, label)
+    try:
+        if instrumentation.profile_file:
+            with profile(instrumentation.profile_file):
+                yield
+        else:
+            yield
+    finally:
+        metrics.stop()
@@ -1,7 +1,45 @@
-import pypeln as pl  # type: ignore[import-untyped]
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
 from aiohttp import ClientSession, TCPConnector
 
-from tracer.config import ASYNC_WORKERS_LIMIT
+from tracer.budget import memory_budget
+from tracer.config import ASYNC_WORKERS_LIMIT, STAGE_QUEUE_SIZE
+from tracer.metrics import metrics
+
+T = TypeVar("T")
+
+
+def count_queued(stage: Iterable[T]) -> Iterator[T]:
+    """
+    Count the items of a stage read ahead of the workers, which are queued until a
+    worker takes them.
+
+    Args:
+        stage (Iterable[T]): An iterable of items.
+
+    Returns:
+        Iterator[T]: An iterator over the same items.
+    """
+    for item in stage:
+        metrics.adjust("stage_queue", 1)
+        yield item
+
+
+def batch_stage(stage: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """
+    Group the items of a stage into lists of at most `batch_size` items.
+
+    Args:
+        stage (Iterable[T]): An iterable of items to group.
+        batch_size (int): The maximum number of items per batch.
+
+    Returns:
+        Iterator[List[T]]: An iterator over the batches, lazily consuming the stage.
+    """
+    iterator = iter(stage)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
 
 
 async def schedule_rpc_tasks(task, stage) -> None:
@@ -16,15 +54,43 @@ async def schedule_rpc_tasks(task, stage) -> None:
     This function uses an asynchronous HTTP session to execute the provided task function
     for each item in the stage concurrently, with a specified number of workers.
 
-    The number of concurrent workers is defined by `ASYNC_WORKERS_LIMIT`.
+    The number of concurrent workers is defined by `ASYNC_WORKERS_LIMIT`. Items are read
+    from the stage at most `STAGE_QUEUE_SIZE` ahead of the workers, and a task only starts
+    once the memory budget allows, so the RPC responses held by tasks until their output
+    is written stay bounded.
+
+    Raises:
+        Exception: The first exception raised by a task, once the stage has been drained.
     """
+    # pypeln is only loaded once tasks are scheduled, as it is slow to import
+    import pypeln as pl  # type: ignore[import-untyped]
+
+    # pypeln does not always propagate exceptions raised by workers,
+    # so they are collected here and re-raised once the stage is done.
+    errors: List[Exception] = []
+
     async with ClientSession(connector=TCPConnector(limit=0)) as session:
 
         async def f(arg):
-            await task(arg, session)
+            metrics.adjust("stage_queue", -1)
+            try:
+                async with memory_budget.reserve():
+                    metrics.adjust("tasks_in_flight", 1)
+                    try:
+                        await task(arg, session)
+                    finally:
+                        metrics.adjust("tasks_in_flight", -1)
+                metrics.increment("tasks")
+            except Exception as e:
+                errors.append(e)
+                raise
 
         await pl.task.each(
             f=f,
-            stage=stage,
+            stage=count_queued(stage),
             workers=ASYNC_WORKERS_LIMIT,
+            maxsize=STAGE_QUEUE_SIZE,
         )
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,266 @@
+import csv
+import io
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from tracer.fs import (
+    CSV_FIELDNAMES,
+    ID_COLUMNS,
+    FileType,
+    OutputFormat,
+    find_range_output,
+    get_part_index,
+    open_compressed_binary,
+)
+from tracer.index import get_hash_key, load_index
+
+# A row of an output, with the same string values as the CSV output
+Row = Dict[str, Optional[str]]
+
+
+class IndexedOutput:
+    def __init__(self, start_block: int, end_block: int, file_type: FileType):
+        """
+        Initialize the reader of a finished output through its sidecar index.
+
+        Only the units of the index that may hold the requested rows are read, each
+        decompressed (or decoded) on its own, instead of scanning the whole output.
+
+        Args:
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+            file_type (FileType): The type of file.
+        """
+        self.file_type = file_type
+        self.id_column = ID_COLUMNS[file_type]
+        self.path, self.output_format = find_range_output(start_block, end_block, file_type)
+        if os.path.isdir(self.path):
+            self.parts = sorted(
+                os.path.join(self.path, part)
+                for part in os.listdir(self.path)
+                if get_part_index(part) is not None
+            )
+        else:
+            self.parts = [self.path]
+
+        self.units, self.transactions = load_index(start_block, end_block, file_type)
+        if not len(self.units):
+            raise FileNotFoundError(
+                f"No index found for the {file_type.value} of blocks {start_block}-{end_block}"
+            )
+
+    def find_units(self, first_id: int, last_id: int, opcode: Optional[int] = None) -> np.ndarray:
+        """
+        Find the units that may hold rows of a range of transactions.
+
+        Args:
+            first_id (int): The first transaction id of the range.
+            last_id (int): The last transaction id of the range.
+            opcode (Optional[int]): Only find units holding call frames of this opcode.
+
+        Returns:
+            np.ndarray: The indexes of the units, in the order they were written.
+        """
+        units = self.units
+        matches = (units["first_id"] <= last_id) & (units["last_id"] >= first_id)
+        if opcode is not None:
+            # Opcode sets are packed most significant bit first
+            matches &= ((units["opcodes"][:, opcode // 8] >> (7 - opcode % 8)) & 1).astype(bool)
+        return np.flatnonzero(matches)
+
+    def read_csv_unit(self, part: int, offset: int, first_id: int, last_id: int) -> List[Row]:
+        """
+        Decompress the frame (or gzip member) of a compressed CSV part starting at an offset,
+        and parse its rows of a range of transactions.
+
+        Args:
+            part (int): The index of the part file.
+            offset (int): The offset of the frame in the part file.
+            first_id (int): The first transaction id of the range.
+            last_id (int): The last transaction id of the range.
+
+        Returns:
+            List[Row]: The rows of the range in the frame.
+        """
+        # The frame ends where the next frame of the part starts
+        units = self.units
+        next_offsets = units["offset"][(units["part"] == part) & (units["offset"] > offset)]
+        size = int(next_offsets.min()) - offset if len(next_offsets) else -1
+
+        file_name = self.parts[part]
+        with open(file_name, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        with open_compressed_binary(file_name, io.BytesIO(data)) as stream:
+            text = stream.read().decode()
+
+        # Rows start with their transaction id, so that the rows of other transactions
+        # (and the header starting the first frame of a part) are skipped unparsed
+        lines = []
+        for line in text.splitlines():
+            transaction_id = line[: line.find(",")]
+            if transaction_id.isdigit() and first_id <= int(transaction_id) <= last_id:
+                lines.append(line)
+        return [dict(zip(CSV_FIELDNAMES[self.file_type], row)) for row in csv.reader(lines)]
+
+    def read_unit(self, index: int, first_id: int, last_id: int) -> List[Row]:
+        """
+        Read the rows of a range of transactions from a unit.
+
+        Args:
+            index (int): The index of the unit.
+            first_id (int): The first transaction id of the range.
+            last_id (int): The last transaction id of the range.
+
+        Returns:
+            List[Row]: The rows of the range in the unit, and in the other units sharing
+                its frame.
+        """
+        unit = self.units[index]
+        part, offset = int(unit["part"]), int(unit["offset"])
+        if self.output_format == OutputFormat.CSV:
+            return self.read_csv_unit(part, offset, first_id, last_id)
+
+        from tracer.columnar import read_unit_rows
+
+        return read_unit_rows(
+            self.parts[part], self.output_format, offset, self.id_column, first_id, last_id
+        )
+
+    def iter_rows(
+        self, first_id: int, last_id: int, opcode: Optional[int] = None
+    ) -> Iterator[Row]:
+        """
+        Iterate over the rows of a range of transactions.
+
+        Args:
+            first_id (int): The first transaction id of the range.
+            last_id (int): The last transaction id of the range.
+            opcode (Optional[int]): Only return call frames of this opcode.
+
+        Returns:
+            Iterator[Row]: An iterator over the rows, in the order they were written.
+        """
+        locations = set()
+        for index in self.find_units(first_id, last_id, opcode):
+            unit = self.units[index]
+            location = (int(unit["part"]), int(unit["offset"]))
+            # Units sharing a frame are read together
+            if location in locations:
+                continue
+            locations.add(location)
+
+            for row in self.read_unit(index, first_id, last_id):
+                if opcode is None or int(row["opcode"], 16) == opcode:
+                    yield row
+
+
+class RangeQuery:
+    def __init__(self, start_block: int, end_block: int):
+        """
+        Initialize point lookups into the finished output of a block range, whatever the
+        options it was written with.
+
+        Args:
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+        """
+        self.transactions = IndexedOutput(start_block, end_block, FileType.TRANSACTION)
+        self.call_frames = IndexedOutput(start_block, end_block, FileType.CALL_FRAME)
+
+    def get_block_transaction_ids(self, block_number: int) -> Optional[Tuple[int, int]]:
+        """
+        Get the range of transaction ids of a block, from the index alone.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            Optional[Tuple[int, int]]: The first and last transaction ids of the block,
+                or None if it has no transactions.
+        """
+        lookup = self.transactions.transactions
+        ids = lookup["id"][lookup["block"] == block_number]
+        if not len(ids):
+            return None
+        return int(ids.min()), int(ids.max())
+
+    def get_transactions(self, first_id: int, last_id: Optional[int] = None) -> List[Row]:
+        """
+        Get the transactions of a range of ids.
+
+        Args:
+            first_id (int): The first transaction id.
+            last_id (Optional[int]): The last transaction id, `first_id` by default.
+
+        Returns:
+            List[Row]: The transactions.
+        """
+        return list(
+            self.transactions.iter_rows(first_id, first_id if last_id is None else last_id)
+        )
+
+    def get_transaction_by_hash(self, tx_hash: str) -> Optional[Row]:
+        """
+        Get a transaction by its hash.
+
+        Args:
+            tx_hash (str): The hex encoded transaction hash.
+
+        Returns:
+            Optional[Row]: The transaction, or None if it is not part of the range.
+        """
+        lookup = self.transactions.transactions
+        # Keys are a suffix of the hash, so candidates are checked against the full hash
+        for transaction_id in lookup["id"][lookup["hash_key"] == get_hash_key(tx_hash)].tolist():
+            for transaction in self.get_transactions(transaction_id):
+                if (transaction["tx_hash"] or "").lower() == tx_hash.lower():
+                    return transaction
+        return None
+
+    def get_block_transactions(self, block_number: int) -> List[Row]:
+        """
+        Get the transactions of a block.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            List[Row]: The transactions of the block.
+        """
+        ids = self.get_block_transaction_ids(block_number)
+        return self.get_transactions(*ids) if ids else []
+
+    def get_call_frames(
+        self, first_id: int, last_id: Optional[int] = None, opcode: Optional[int] = None
+    ) -> List[Row]:
+        """
+        Get the call frames of a range of transactions.
+
+        Args:
+            first_id (int): The first transaction id.
+            last_id (Optional[int]): The last transaction id, `first_id` by default.
+            opcode (Optional[int]): Only return call frames of this opcode.
+
+        Returns:
+            List[Row]: The call frames.
+        """
+        last_id = first_id if last_id is None else last_id
+        return list(self.call_frames.iter_rows(first_id, last_id, opcode))
+
+    def iter_call_frames(self, opcode: int) -> Iterator[Row]:
+        """
+        Iterate over the call frames of an opcode, skipping the units without any.
+
+        Args:
+            opcode (int): The opcode number.
+
+        Returns:
+            Iterator[Row]: An iterator over the call frames.
+        """
+        units = self.call_frames.units
+        return self.call_frames.iter_rows(
+            int(units["first_id"].min()), int(units["last_id"].max()), opcode
+        )
@@ -0,0 +1,298 @@
+import os
+import shutil
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import groupby
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional
+
+from tracer.aggregate import STATE_FILE_NAME, SUMMARY_FILE_NAME, CallFrameAggregator
+from tracer.cache import get_cache_key, rpc_cache
+from tracer.config import DATA_DIR, REPLAY_BATCH_SIZE
+from tracer.frames import CallFrameColumns, decode_call_frame_columns, summarize_frames
+from tracer.fs import (
+    FileType,
+    OutputOptions,
+    create_iterator,
+    create_output_handler,
+    get_output_directory,
+    get_output_path,
+)
+from tracer.index import get_index_file_names
+from tracer.rpc import get_memory_tracer
+from tracer.shard import find_output_path, get_merged_output_path
+
+
+def get_trace_cache_keys(transactions: List[Dict[str, str]], tracer: str) -> List[str]:
+    """
+    Get the keys the traces of transactions are cached under by `debug_traceTransaction`.
+
+    Args:
+        transactions (List[Dict[str, str]]): The transactions.
+        tracer (str): The source of the JS tracer the traces were made with.
+
+    Returns:
+        List[str]: The cache key of each transaction.
+    """
+    return [
+        get_cache_key("debug_traceTransaction", [tx["tx_hash"], {"tracer": tracer}])
+        for tx in transactions
+    ]
+
+
+def get_cached_traces(transactions: List[Dict[str, str]], tracer: str) -> List[dict]:
+    """
+    Look up the cached trace results of the transactions of a single block.
+
+    Traces are looked up as cached by `debug_traceTransaction`, falling back to the trace
+    of the whole block cached by `debug_traceBlockByNumber`.
+
+    Args:
+        transactions (List[Dict[str, str]]): All the transactions of the block, in block order.
+        tracer (str): The source of the JS tracer the traces were made with.
+
+    Returns:
+        List[dict]: The trace result of each transaction.
+
+    Raises:
+        LookupError: If the trace of a transaction is not cached.
+    """
+    keys = get_trace_cache_keys(transactions, tracer)
+    cached = rpc_cache.get_many(keys)
+    if len(cached) == len(keys):
+        return [cached[key] for key in keys]
+
+    block_number = int(transactions[0]["block"])
+    block_traces = rpc_cache.get(
+        "debug_traceBlockByNumber", [hex(block_number), {"tracer": tracer}]
+    )
+    if block_traces is None:
+        missing = next(tx["tx_hash"] for tx, key in zip(transactions, keys) if key not in cached)
+        raise LookupError(f"Trace of transaction {missing} in block {block_number} is not cached")
+
+    traces_by_hash = {trace["txHash"]: trace for trace in block_traces if "txHash" in trace}
+    traces = []
+    for index, transaction in enumerate(transactions):
+        # Older clients do not report the hash, so traces are matched by position
+        trace = traces_by_hash.get(transaction["tx_hash"]) or block_traces[index]
+        if "error" in trace:
+            raise Exception(f"Trace Error ({transaction['tx_hash']}): {trace['error']}")
+        traces.append(trace["result"])
+    return traces
+
+
+def replay_blocks(blocks: List[List[Dict[str, str]]]) -> CallFrameColumns:
+    """
+    Rebuild the call frames of the transactions of a batch of blocks from cached traces.
+
+    Args:
+        blocks (List[List[Dict[str, str]]]): The transactions of each block.
+
+    Returns:
+        CallFrameColumns: The call frame columns of the transactions, in order.
+    """
+    tracer = get_memory_tracer()
+    transactions = [transaction for block in blocks for transaction in block]
+    traces = [trace for block in blocks for trace in get_cached_traces(block, tracer)]
+    return decode_call_frame_columns(transactions, traces)
+
+
+def check_cached_traces(transactions_path: str, options: OutputOptions):
+    """
+    Check that the trace of every traced transaction of a range is cached, either on its
+    own or as part of the trace of its block, without reading the traces.
+
+    Args:
+        transactions_path (str): The path of the transactions output of the range.
+        options (OutputOptions): The options the range was traced with.
+
+    Raises:
+        LookupError: If the trace of a transaction is not cached.
+    """
+    tracer = get_memory_tracer()
+    with create_iterator(transactions_path, options) as transaction_iterator:
+        traced_transactions = (tx for tx in transaction_iterator if tx.get("traced") != "0")
+        for block, block_transactions in groupby(traced_transactions, key=lambda tx: tx["block"]):
+            transactions = list(block_transactions)
+            keys = get_trace_cache_keys(transactions, tracer)
+            cached = rpc_cache.has_many(keys)
+            if len(cached) == len(keys):
+                continue
+
+            block_key = get_cache_key(
+                "debug_traceBlockByNumber", [hex(int(block)), {"tracer": tracer}]
+            )
+            if not rpc_cache.has_many([block_key]):
+                missing = next(
+                    tx["tx_hash"] for tx, key in zip(transactions, keys) if key not in cached
+                )
+                raise LookupError(f"Trace of transaction {missing} in block {block} is not cached")
+
+
+def replace_path(source: str, destination: str):
+    """
+    Move a file or directory into place, replacing the previous one. A directory is
+    moved aside rather than removed until the new one is in place.
+
+    Args:
+        source (str): The path of the new file or directory.
+        destination (str): The path to move it to.
+    """
+    if not os.path.isdir(destination):
+        os.replace(source, destination)
+        return
+
+    backup = f"{destination}.old"
+    if os.path.isdir(backup):
+        shutil.rmtree(backup)
+    os.replace(destination, backup)
+    os.replace(source, destination)
+    shutil.rmtree(backup)
+
+
+def replace_outputs(start_block: int, end_block: int, options: OutputOptions, directory: str):
+    """
+    Move the call frames and frames outputs of a range rebuilt in another directory into
+    place, along with their indexes and the summary of the range.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        options (OutputOptions): The options the outputs were written with.
+        directory (str): The directory holding the output directory of the rebuilt range.
+    """
+    for file_type in (FileType.CALL_FRAME, FileType.FRAME):
+        output_path = get_output_path(start_block, end_block, file_type, options)
+        replace_path(
+            get_output_path(start_block, end_block, file_type, options, directory), output_path
+        )
+        for source, destination in zip(
+            get_index_file_names(start_block, end_block, file_type, directory),
+            get_index_file_names(start_block, end_block, file_type),
+        ):
+            if os.path.exists(source):
+                os.replace(source, destination)
+
+        # The output of a sharded run is a directory of parts, which the new output replaces
+        merged_path = get_merged_output_path(start_block, end_block, file_type, options)
+        if merged_path != output_path and os.path.isdir(merged_path):
+            shutil.rmtree(merged_path)
+
+    rebuilt_directory = get_output_directory(start_block, end_block, directory)
+    for file_name in (STATE_FILE_NAME, SUMMARY_FILE_NAME):
+        os.replace(
+            os.path.join(rebuilt_directory, file_name),
+            os.path.join(get_output_directory(start_block, end_block), file_name),
+        )
+
+
+def batch_blocks(transactions: Iterable[Dict[str, str]]) -> Iterator[List[List[Dict[str, str]]]]:
+    """
+    Group transactions by block, and blocks into batches of about `REPLAY_BATCH_SIZE`
+    transactions.
+
+    Args:
+        transactions (Iterable[Dict[str, str]]): The transactions, with those of each block
+            next to each other, as written by the tracer.
+
+    Returns:
+        Iterator[List[List[Dict[str, str]]]]: An iterator over the batches of blocks.
+    """
+    batch: List[List[Dict[str, str]]] = []
+    size = 0
+    for _, block_transactions in groupby(transactions, key=lambda tx: tx["block"]):
+        batch.append(list(block_transactions))
+        size += len(batch[-1])
+        if size >= REPLAY_BATCH_SIZE:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def replay_call_frames(
+    start_block: int,
+    end_block: int,
+    options: OutputOptions = OutputOptions(),
+    workers: Optional[int] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> str:
+    """
+    Rebuild the call frames output of a traced block range from the cached traces,
+    without querying the node.
+
+    Batches of blocks are decoded in parallel worker processes, and their call frames are
+    written in order by the output handler of the range. The outputs are written to a
+    temporary directory, and only replace the previous output, its frames table and its
+    summary once complete. Nothing is written if a trace is not cached.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        options (OutputOptions): The options the range was traced with, which the call
+            frames are written with as well.
+        workers (Optional[int]): The number of worker processes, one per core by default.
+        on_progress (Optional[Callable[[int], None]]): Called with the number of
+            transactions replayed after every batch.
+
+    Returns:
+        str: The path of the rebuilt call frames output.
+
+    Raises:
+        LookupError: If the trace of a transaction is not cached.
+    """
+    workers = workers or os.cpu_count() or 1
+    transactions_path = find_output_path(start_block, end_block, FileType.TRANSACTION, options)
+    check_cached_traces(transactions_path, options)
+
+    # Start over, removing the outputs of a previous, interrupted replay
+    temp_directory = os.path.join(DATA_DIR, f".replay_{start_block}_to_{end_block}")
+    if os.path.isdir(temp_directory):
+        shutil.rmtree(temp_directory)
+
+    output = create_output_handler(
+        start_block, end_block, FileType.CALL_FRAME, options, directory=temp_directory
+    )
+    frame_output = create_output_handler(
+        start_block, end_block, FileType.FRAME, options, directory=temp_directory
+    )
+    aggregator = CallFrameAggregator()
+    replayed = 0
+
+    with create_iterator(transactions_path, options) as transaction_iterator:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Results are written in submission order, with a bounded number of
+            # batches in flight so that memory use does not grow with the range.
+            pending: Deque[Future] = deque()
+            sizes: Deque[int] = deque()
+
+            def write_next():
+                nonlocal replayed
+                call_frames = pending.popleft().result()
+                output.write_columns(call_frames)
+                frame_output.write_columns(summarize_frames(call_frames))
+                aggregator.update(call_frames)
+                replayed += sizes.popleft()
+                if on_progress:
+                    on_progress(replayed)
+
+            # Plain transfers flagged as not traced have no cached trace
+            traced_transactions = (tx for tx in transaction_iterator if tx.get("traced") != "0")
+            for blocks in batch_blocks(traced_transactions):
+                pending.append(executor.submit(replay_blocks, blocks))
+                sizes.append(sum(len(transactions) for transactions in blocks))
+                if len(pending) >= 2 * workers:
+                    write_next()
+
+            while pending:
+                write_next()
+
+    output.compress()
+    frame_output.compress()
+    aggregator.write_summary(
+        get_output_directory(start_block, end_block, temp_directory), start_block, end_block
+    )
+
+    replace_outputs(start_block, end_block, options, temp_directory)
+    shutil.rmtree(temp_directory)
+    return get_output_path(start_block, end_block, FileType.CALL_FRAME, options)
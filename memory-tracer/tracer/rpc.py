@@ -1,14 +1,196 @@
+import asyncio
 import json
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, List, Optional
 
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession
 
-from tracer.config import API_KEY, INSTRUCTIONS, MEMORY_ACCESS_SIZE, RPC_ENDPOINT
+from tracer.budget import record_response_size
+from tracer.cache import get_cache_key, is_cacheable, rpc_cache
+from tracer.config import (
+    API_KEY,
+    COMPACT_TRACER,
+    INSTRUCTIONS,
+    MEMORY_ACCESS_SIZE,
+    RPC_MAX_RETRIES,
+)
+from tracer.metrics import metrics
+from tracer.scheduler import Endpoint, get_retry_delay, pool
+
+# JSON-RPC error code used by hosted endpoints to signal rate limiting
+LIMIT_EXCEEDED_ERROR_CODE = -32005
+# JSON-RPC error code of methods the node does not support
+METHOD_NOT_FOUND_ERROR_CODE = -32601
+# Number of characters of the body of an HTTP error response included in the error
+HTTP_ERROR_BODY_LENGTH = 200
+
+
+class TransientRpcError(Exception):
+    def __init__(self, message: str, throttled: bool = False, retry_after: Optional[float] = None):
+        """
+        An error of the RPC endpoint that is worth retrying.
+
+        Args:
+            message (str): The error message.
+            throttled (bool): Whether the endpoint rejected the request because of rate limiting.
+            retry_after (Optional[float]): The delay in seconds the endpoint asked to wait for.
+        """
+        super().__init__(message)
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+class RpcError(Exception):
+    def __init__(self, message: str, code: Optional[int] = None):
+        """
+        An error the RPC endpoint returned for a request, which retrying would not fix.
+
+        Args:
+            message (str): The error message.
+            code (Optional[int]): The JSON-RPC error code, if the endpoint returned one.
+        """
+        super().__init__(message)
+        self.code = code
+
+
+def get_error_code(error: Any) -> Optional[int]:
+    """
+    Get the code of a JSON-RPC error object.
+
+    Args:
+        error (Any): The `error` member of a JSON-RPC response.
+
+    Returns:
+        Optional[int]: The error code, or None if the error has none.
+    """
+    return error.get("code") if isinstance(error, dict) else None
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse the value of a Retry-After header.
+
+    Args:
+        value (Optional[str]): The header value, either a number of seconds or an HTTP date.
+
+    Returns:
+        Optional[float]: The delay in seconds, or None if absent or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def send_rpc(url: str, payload, session: ClientSession):
+    """
+    Send a JSON-RPC payload in a single HTTP request.
+
+    Args:
+        url (str): The url of the RPC endpoint.
+        payload (dict | list): The JSON-RPC request object or array of request objects.
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        dict | list: The decoded JSON response.
+
+    Raises:
+        TransientRpcError: If the endpoint is rate limiting or temporarily unavailable.
+        RpcError: If the endpoint rejected the request with another HTTP error status.
+    """
+    with metrics.time("rpc"):
+        # Local nodes, such as the stub node of the benchmark, take no API key
+        headers = {"x-api-key": API_KEY} if API_KEY else None
+        async with session.post(url, json=payload, headers=headers) as response:
+            if response.status == 429 or response.status >= 500:
+                raise TransientRpcError(
+                    f"HTTP {response.status}",
+                    throttled=response.status == 429,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                )
+            # Other errors, such as a wrong API key or url, are not fixed by retrying
+            if response.status >= 400:
+                text = (await response.text(errors="replace"))[:HTTP_ERROR_BODY_LENGTH]
+                raise RpcError(f"HTTP {response.status}: {text}")
+            body = await response.read()
+
+    record_response_size(len(body))
+    metrics.observe("response_bytes", len(body))
+    try:
+        with metrics.time("decode"):
+            result = json.loads(body)
+    except ValueError as e:
+        raise TransientRpcError(f"Invalid JSON response: {e}")
+
+    # Hosted endpoints may also report rate limiting as a JSON-RPC error
+    error = result.get("error") if isinstance(result, dict) else None
+    if isinstance(error, dict) and error.get("code") == LIMIT_EXCEEDED_ERROR_CODE:
+        raise TransientRpcError(f"RPC Error: {error}", throttled=True)
+
+    return result
+
+
+async def post_rpc(payload, session: ClientSession):
+    """
+    Post a JSON-RPC payload (a single request or a batch) to an RPC endpoint of the pool.
+
+    Requests are routed to the healthy endpoint with the fewest outstanding requests for
+    its weight, and go through its scheduler, which adapts the number of requests in flight
+    to the endpoint. Transient failures are retried with jittered exponential backoff,
+    preferably on another endpoint.
+
+    Args:
+        payload (dict | list): The JSON-RPC request object or array of request objects.
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        dict | list: The decoded JSON response.
+    """
+    attempt = 0
+    failed_endpoint: Optional[Endpoint] = None
+    while True:
+        retry_after = None
+        async with pool.request(exclude=failed_endpoint) as endpoint:
+            start = time.monotonic()
+            try:
+                result = await send_rpc(endpoint.url, payload, session)
+                endpoint.on_success(time.monotonic() - start)
+                return result
+            except TransientRpcError as e:
+                if e.throttled:
+                    endpoint.on_throttle(e.retry_after)
+                    metrics.increment("rpc_throttled")
+                else:
+                    endpoint.on_failure()
+                    metrics.increment("rpc_failures")
+                retry_after = e.retry_after
+                error: Exception = e
+            except (ClientError, asyncio.TimeoutError) as e:
+                endpoint.on_failure()
+                metrics.increment("rpc_failures")
+                error = e
+
+        failed_endpoint = endpoint
+        attempt += 1
+        if attempt > RPC_MAX_RETRIES:
+            raise error
+        await asyncio.sleep(max(get_retry_delay(attempt), retry_after or 0))
 
 
 async def call_rpc(method: str, params: list, session: ClientSession) -> dict:
     """
     Call the Ethereum JSON-RPC API.
 
+    Results of requests for historical data are served from the on-disk cache when present.
+
     Args:
         method (str): The JSON-RPC method to call.
         params (list): Parameters for the JSON-RPC method.
@@ -20,24 +202,121 @@ async def call_rpc(method: str, params: list, session: ClientSession) -> dict:
     Raises:
         Exception: If there is an error in the RPC response.
     """
+    return (await call_rpc_batch(method, [params], session))[0]
 
-    if not RPC_ENDPOINT:
-        raise ValueError("RPC_ENDPOINT not found in environment file")
 
-    payload = {
-        "jsonrpc": "2.0",
-        "method": method,
-        "params": params,
-        "id": 1,
-    }
+async def call_rpc_batch(
+    method: str, params_list: List[list], session: ClientSession
+) -> List[Any]:
+    """
+    Call the Ethereum JSON-RPC API with a batch of requests for the same method.
+
+    All requests are sent in a single JSON-RPC array payload. Responses may arrive
+    in any order, so they are matched back to their request by id. Requests for
+    historical data are only sent if their result is not in the on-disk cache, and
+    their results are added to it.
+
+    Args:
+        method (str): The JSON-RPC method to call.
+        params_list (List[list]): Parameters for each request in the batch.
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[Any]: The results of the RPC calls, in the same order as `params_list`.
+
+    Raises:
+        Exception: If the batch is rejected or any request in it returns an error.
+    """
+    if not params_list:
+        return []
+
+    keys = [
+        get_cache_key(method, params) if is_cacheable(method, params) else None
+        for params in params_list
+    ]
+    with metrics.time("cache"):
+        cached = await rpc_cache.run(rpc_cache.get_many, [key for key in keys if key is not None])
+
+    results = [cached.get(key) if key is not None else None for key in keys]
+    missing = [
+        request_id for request_id, key in enumerate(keys) if key is None or key not in cached
+    ]
+    metrics.increment("cache_hits", len(params_list) - len(missing))
+    metrics.increment("cache_misses", len(missing))
+    if not missing:
+        return results
+
+    fetched = await send_rpc_batch(method, [params_list[i] for i in missing], session)
+
+    new_results = {}
+    for request_id, result in zip(missing, fetched):
+        results[request_id] = result
+        # Unknown blocks have a null result, which may change once they are mined
+        if keys[request_id] is not None and result is not None:
+            new_results[keys[request_id]] = result
+    with metrics.time("cache"):
+        await rpc_cache.run(rpc_cache.put_many, new_results)
+
+    return results
+
+
+async def send_rpc_batch(
+    method: str, params_list: List[list], session: ClientSession
+) -> List[Any]:
+    """
+    Send a batch of requests for the same method to the Ethereum JSON-RPC API.
+
+    Args:
+        method (str): The JSON-RPC method to call.
+        params_list (List[list]): Parameters for each request in the batch.
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[Any]: The results of the RPC calls, in the same order as `params_list`.
 
-    async with session.post(
-        RPC_ENDPOINT, json=payload, headers={"x-api-key": API_KEY}
-    ) as response:
-        result = await response.json()
+    Raises:
+        RpcError: If the batch is rejected or any request in it returns an error.
+    """
+    # A single request is sent on its own, as not every node accepts batches
+    if len(params_list) == 1:
+        payload = {"jsonrpc": "2.0", "method": method, "params": params_list[0], "id": 1}
+        result = await post_rpc(payload, session)
         if "error" in result:
-            raise Exception(f"RPC Error ({method}>req:{params}): {result['error']}")
-        return result.get("result")
+            raise RpcError(
+                f"RPC Error ({method}>req:{params_list[0]}): {result['error']}",
+                get_error_code(result["error"]),
+            )
+        return [result.get("result")]
+
+    payload = [
+        {"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}
+        for request_id, params in enumerate(params_list)
+    ]
+
+    responses = await post_rpc(payload, session)
+
+    # Nodes reply with a single error object if the batch itself is rejected
+    # e.g. when it exceeds the node's batch limit.
+    if not isinstance(responses, list):
+        raise RpcError(
+            f"RPC Error ({method}>batch:{len(params_list)}): {responses.get('error')}",
+            get_error_code(responses.get("error")),
+        )
+
+    responses_by_id = {response.get("id"): response for response in responses}
+
+    results = []
+    for request_id, params in enumerate(params_list):
+        response = responses_by_id.get(request_id)
+        if response is None:
+            raise RpcError(f"RPC Error ({method}>req:{params}): missing response")
+        if "error" in response:
+            raise RpcError(
+                f"RPC Error ({method}>req:{params}): {response['error']}",
+                get_error_code(response["error"]),
+            )
+        results.append(response.get("result"))
+    return results
 
 
 async def get_block(block_number: str, session: ClientSession) -> dict:
@@ -54,26 +333,76 @@ async def get_block(block_number: str, session: ClientSession) -> dict:
     return await call_rpc("eth_getBlockByNumber", [block_number, True], session)
 
 
-async def get_transaction_trace(tx_hash: str, session: ClientSession) -> dict:
+async def get_block_number(session: ClientSession) -> int:
     """
-    Trace a transaction by its hash.
+    Retrieve the number of the latest block.
 
     Args:
-        tx_hash (str): The transaction hash to trace.
         session (ClientSession): The aiohttp session to use for the request.
 
     Returns:
-        dict: The trace result of the transaction.
+        int: The number of the head of the chain.
+    """
+    return int(await call_rpc("eth_blockNumber", [], session), 0)
+
+
+async def get_block_hashes(
+    block_numbers: List[str], session: ClientSession
+) -> List[Optional[str]]:
+    """
+    Retrieve the current hash of a batch of blocks in a single request.
+
+    The request bypasses the on-disk cache, as it checks whether blocks were replaced.
+
+    Args:
+        block_numbers (List[str]): The block numbers (hexadecimal format).
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[Optional[str]]: The hash of each block, in the same order as `block_numbers`,
+            or None for blocks the node does not know (anymore).
+    """
+    headers = await send_rpc_batch(
+        "eth_getBlockByNumber", [[block_number, False] for block_number in block_numbers], session
+    )
+    return [header and header["hash"] for header in headers]
+
+
+@lru_cache(maxsize=None)
+def get_memory_tracer(compact: bool = COMPACT_TRACER) -> str:
     """
+    Build the source of the custom JS tracer that records memory accesses.
+
+    The source is built once per variant, and reused by every trace request.
+
+    Args:
+        compact (bool): Build the compact tracer, see `get_compact_memory_tracer`.
+
+    Returns:
+        str: The tracer source to pass as the `tracer` option of the debug_trace* methods.
+    """
+    if compact:
+        return get_compact_memory_tracer()
+
     # Custom tracer
     # Learn more: https://geth.ethereum.org/docs/developers/evm-tracing/custom-tracer
     # Failed transactions are ignored.
+    # Call frames are numbered in the order they are entered, the transaction being frame 0.
 
-    tracer = f"""
+    return f"""
     {{
         data: [],
+        frames: [0],
+        frame_count: 0,
         required_instructions: {json.dumps(INSTRUCTIONS)},
         fault: function (log) {{}},
+        enter: function (frame) {{
+            this.frame_count++;
+            this.frames.push(this.frame_count);
+        }},
+        exit: function (result) {{
+            this.frames.pop();
+        }},
         step: function (log) {{
             let name = log.op.toString();
 
@@ -105,6 +434,7 @@ async def get_transaction_trace(tx_hash: str, session: ClientSession) -> dict:
                 this.data.push({{
                     op: instruction.opcode,
                     depth: log.getDepth(),
+                    frame: this.frames[this.frames.length - 1],
                     access_regions,
                     gas_cost: log.getCost(),
                     pre_memory_size,
@@ -122,4 +452,219 @@ async def get_transaction_trace(tx_hash: str, session: ClientSession) -> dict:
         }}
     }}
     """
+
+
+def get_compact_memory_tracer() -> str:
+    """
+    Build the source of the compact variant of the custom JS tracer.
+
+    Instructions are looked up by opcode number in a table built once in `setup`, and
+    memory accesses are returned in `packed` as parallel arrays of integers: one entry per
+    instruction in `op`, `depth`, `frame`, `gas_cost`, `pre_memory_size` and
+    `post_memory_size`, and the `offset, size` pairs of the regions accessed by every
+    instruction, one after the other, in `regions`. See `parse_packed_call_frames` for the
+    decoding.
+
+    Returns:
+        str: The tracer source to pass as the `tracer` option of the debug_trace* methods.
+    """
+    # Each instruction is described by its opcode number, its fixed access size (null for
+    # variable sizes) and the stack positions of the offset and size of each region.
+    instructions = [
+        [
+            int(instruction["opcode"], 16),
+            instruction.get("size"),
+            [
+                [input["offset"], input.get("size", -1)]
+                for input in instruction["stack_input_positions"]
+            ],
+        ]
+        for instruction in INSTRUCTIONS.values()
+    ]
+
+    return f"""
+    {{
+        op: [],
+        depth: [],
+        frame: [],
+        gas_cost: [],
+        pre_memory_size: [],
+        post_memory_size: [],
+        regions: [],
+        instructions: [],
+        // Ordinal of the current call frame, in the order frames are entered
+        frames: [0],
+        frame_count: 0,
+        setup: function (config) {{
+            const instructions = {json.dumps(instructions)};
+            for (let i = 0; i < instructions.length; i++) {{
+                this.instructions[instructions[i][0]] = {{
+                    size: instructions[i][1],
+                    inputs: instructions[i][2]
+                }};
+            }}
+        }},
+        fault: function (log) {{}},
+        enter: function (frame) {{
+            this.frame_count++;
+            this.frames.push(this.frame_count);
+        }},
+        exit: function (result) {{
+            this.frames.pop();
+        }},
+        step: function (log) {{
+            const op = log.op.toNumber();
+            const instruction = this.instructions[op];
+            if (instruction === undefined) {{
+                return;
+            }}
+
+            const pre_memory_size = log.memory.length();
+            let post_memory_size = pre_memory_size;
+            const inputs = instruction.inputs;
+
+            // post_memory_size is the highest offset accessed by the instruction.
+            for (let i = 0; i < inputs.length; i++) {{
+                const offset = log.stack.peek(inputs[i][0]);
+                const size = instruction.size === null ? log.stack.peek(inputs[i][1]) :
+                             instruction.size;
+
+                if (size > 0) {{
+                    post_memory_size = Math.max(post_memory_size, offset + size);
+                }}
+                this.regions.push(offset, size);
+            }}
+
+            this.op.push(op);
+            this.depth.push(log.getDepth());
+            this.frame.push(this.frames[this.frames.length - 1]);
+            this.gas_cost.push(log.getCost());
+            this.pre_memory_size.push(pre_memory_size);
+            // Ensure post_memory_size is a multiple of 32 (rounded up)
+            this.post_memory_size.push(Math.ceil(post_memory_size / 32) * 32);
+        }},
+        result: function (ctx, _) {{
+            let error = !!ctx.error
+            return {{
+                error,
+                packed: error ? {{}} : {{
+                    op: this.op,
+                    depth: this.depth,
+                    frame: this.frame,
+                    gas_cost: this.gas_cost,
+                    pre_memory_size: this.pre_memory_size,
+                    post_memory_size: this.post_memory_size,
+                    regions: this.regions
+                }}
+            }};
+        }}
+    }}
+    """
+
+
+async def get_blocks(block_numbers: List[str], session: ClientSession) -> List[dict]:
+    """
+    Retrieve a batch of blocks by their numbers in a single request.
+
+    Args:
+        block_numbers (List[str]): The block numbers to retrieve (hexadecimal format).
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[dict]: The block data, in the same order as `block_numbers`.
+    """
+    return await call_rpc_batch(
+        "eth_getBlockByNumber", [[block_number, True] for block_number in block_numbers], session
+    )
+
+
+async def get_block_receipts(block_numbers: List[str], session: ClientSession) -> List[List[dict]]:
+    """
+    Retrieve the receipts of the transactions of a batch of blocks in a single request.
+
+    Args:
+        block_numbers (List[str]): The block numbers (hexadecimal format).
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[List[dict]]: For each block, the receipts of its transactions in block order.
+    """
+    return await call_rpc_batch(
+        "eth_getBlockReceipts", [[block_number] for block_number in block_numbers], session
+    )
+
+
+async def get_block_transaction_counts(
+    block_numbers: List[str], session: ClientSession
+) -> List[int]:
+    """
+    Retrieve the number of transactions of a batch of blocks in a single request.
+
+    Args:
+        block_numbers (List[str]): The block numbers (hexadecimal format).
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[int]: The number of transactions of each block, in the same order as
+            `block_numbers`.
+    """
+    counts = await call_rpc_batch(
+        "eth_getBlockTransactionCountByNumber",
+        [[block_number] for block_number in block_numbers],
+        session,
+    )
+    return [int(count, 0) for count in counts]
+
+
+async def get_transaction_trace(tx_hash: str, session: ClientSession) -> dict:
+    """
+    Trace a transaction by its hash.
+
+    Args:
+        tx_hash (str): The transaction hash to trace.
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        dict: The trace result of the transaction.
+    """
+    tracer = get_memory_tracer()
     return await call_rpc("debug_traceTransaction", [tx_hash, {"tracer": tracer}], session)
+
+
+async def get_transaction_traces(tx_hashes: List[str], session: ClientSession) -> List[dict]:
+    """
+    Trace a batch of transactions by their hashes in a single request.
+
+    Args:
+        tx_hashes (List[str]): The transaction hashes to trace.
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[dict]: The trace results, in the same order as `tx_hashes`.
+    """
+    tracer = get_memory_tracer()
+    return await call_rpc_batch(
+        "debug_traceTransaction", [[tx_hash, {"tracer": tracer}] for tx_hash in tx_hashes], session
+    )
+
+
+async def get_block_traces(block_numbers: List[str], session: ClientSession) -> List[List[dict]]:
+    """
+    Trace every transaction of a batch of blocks in a single request.
+
+    Each block is re-executed once by the node, instead of once per transaction.
+
+    Args:
+        block_numbers (List[str]): The block numbers to trace (hexadecimal format).
+        session (ClientSession): The aiohttp session to use for the request.
+
+    Returns:
+        List[List[dict]]: For each block, the per-transaction trace entries in block order.
+            Each entry holds the trace in `result` (and the `txHash` on recent clients).
+    """
+    tracer = get_memory_tracer()
+    return await call_rpc_batch(
+        "debug_traceBlockByNumber",
+        [[block_number, {"tracer": tracer}] for block_number in block_numbers],
+        session,
+    )
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+from tracer.config import (
+    RPC_EJECTION_DURATION,
+    RPC_EJECTION_THRESHOLD,
+    RPC_ENDPOINTS,
+    RPC_INITIAL_CONCURRENCY,
+    RPC_LATENCY_TOLERANCE,
+    RPC_MAX_CONCURRENCY,
+    RPC_MAX_EJECTION_DURATION,
+    RPC_MAX_REQUESTS_PER_SECOND,
+    RPC_MIN_CONCURRENCY,
+    RPC_RETRY_BASE_DELAY,
+    RPC_RETRY_MAX_DELAY,
+)
+from tracer.metrics import metrics
+
+# Weight of the latest sample in the short and long term moving averages of request
+# latency. The long term average is the baseline the short term average is compared to.
+LATENCY_SMOOTHING = 0.2
+BASELINE_LATENCY_SMOOTHING = 0.01
+
+# Factors the concurrency limit is multiplied by when requests fail or are throttled,
+# and when latency grows, which is a softer signal of congestion.
+FAILURE_BACKOFF = 0.5
+CONGESTION_BACKOFF = 0.9
+
+
+def moving_average(average: Optional[float], sample: float, smoothing: float) -> float:
+    """
+    Update an exponential moving average with a new sample.
+
+    Args:
+        average (Optional[float]): The current average, None before the first sample.
+        sample (float): The new sample.
+        smoothing (float): The weight of the new sample.
+
+    Returns:
+        float: The updated average.
+    """
+    if average is None:
+        return sample
+    return smoothing * sample + (1 - smoothing) * average
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        initial_limit: int = RPC_INITIAL_CONCURRENCY,
+        min_limit: int = RPC_MIN_CONCURRENCY,
+        max_limit: int = RPC_MAX_CONCURRENCY,
+        max_requests_per_second: float = RPC_MAX_REQUESTS_PER_SECOND,
+    ):
+        """
+        Initialize the scheduler that gates requests sent to an RPC endpoint.
+
+        The number of requests in flight follows an AIMD (additive increase,
+        multiplicative decrease) limit, requests are spaced out to honor the maximum
+        request rate, and all requests are paused when the endpoint asks to retry later.
+
+        Args:
+            initial_limit (int): The number of requests allowed in flight at first.
+            min_limit (int): The lowest number of requests allowed in flight.
+            max_limit (int): The highest number of requests allowed in flight.
+            max_requests_per_second (float): The maximum request rate, 0 for no limit.
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.interval = 1 / max_requests_per_second if max_requests_per_second else 0.0
+
+        self.in_flight = 0
+        self.waiters: List[asyncio.Future] = []
+
+        # Monotonic times before which no request may start
+        self.next_request_at = 0.0
+        self.resume_at = 0.0
+        self.last_decrease_at = 0.0
+
+        self.latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+
+    def wake(self):
+        """
+        Wake up as many waiting requests as the limit allows.
+        """
+        available = int(self.limit) - self.in_flight
+        while available > 0 and self.waiters:
+            waiter = self.waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                available -= 1
+
+    async def acquire(self):
+        """
+        Wait until a request is allowed to start.
+        """
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            await waiter
+        self.in_flight += 1
+
+        # Space out requests to honor the maximum request rate and any requested pause
+        now = time.monotonic()
+        start = max(now, self.next_request_at, self.resume_at)
+        self.next_request_at = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def release(self):
+        """
+        Mark a request as finished.
+        """
+        self.in_flight -= 1
+        self.wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold a slot for a single request for the duration of the context.
+        """
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def decrease(self, factor: float):
+        """
+        Shrink the limit, at most once per round trip so that the failures of
+        requests sent together only count once.
+
+        Args:
+            factor (float): The factor to multiply the limit by.
+        """
+        now = time.monotonic()
+        if now - self.last_decrease_at < (self.latency or 0):
+            return
+        self.last_decrease_at = now
+        self.limit = max(self.min_limit, self.limit * factor)
+
+    def on_success(self, latency: float):
+        """
+        Record a successful request, growing the limit unless the endpoint slows down.
+
+        Args:
+            latency (float): The duration of the request in seconds.
+        """
+        self.latency = moving_average(self.latency, latency, LATENCY_SMOOTHING)
+        self.baseline_latency = moving_average(
+            self.baseline_latency, latency, BASELINE_LATENCY_SMOOTHING
+        )
+
+        if self.latency > self.baseline_latency * RPC_LATENCY_TOLERANCE:
+            self.decrease(CONGESTION_BACKOFF)
+        else:
+            # Grows the limit by one request per round trip of the whole window
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.wake()
+
+    def on_failure(self):
+        """
+        Record a transient failure of the endpoint.
+        """
+        self.decrease(FAILURE_BACKOFF)
+
+    def on_throttle(self, retry_after: Optional[float]):
+        """
+        Record a request throttled by the endpoint, pausing all requests if it asked to
+        retry after a delay.
+
+        Args:
+            retry_after (Optional[float]): The delay in seconds requested by the endpoint.
+        """
+        self.decrease(FAILURE_BACKOFF)
+        if retry_after:
+            self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+
+
+def get_retry_delay(attempt: int) -> float:
+    """
+    Get the delay before retrying a request, using exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of failed attempts so far, starting at 1.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return random.uniform(0, min(RPC_RETRY_MAX_DELAY, RPC_RETRY_BASE_DELAY * 2**attempt))
+
+
+class Endpoint:
+    def __init__(self, url: str, weight: float = 1.0):
+        """
+        Initialize an RPC endpoint of the pool, with its own request scheduler and health.
+
+        Args:
+            url (str): The url of the endpoint.
+            weight (float): The share of requests the endpoint should receive,
+                relative to the other endpoints.
+        """
+        self.url = url
+        self.weight = weight
+        self.scheduler = RequestScheduler()
+
+        # Requests routed to the endpoint, waiting for a slot or in flight
+        self.outstanding = 0
+
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def is_available(self, now: float) -> bool:
+        """
+        Check whether the endpoint can receive requests.
+
+        Args:
+            now (float): The current monotonic time.
+
+        Returns:
+            bool: False while the endpoint is ejected.
+        """
+        return now >= self.ejected_until
+
+    def on_success(self, latency: float):
+        """
+        Record a successful request, restoring the endpoint to full health.
+
+        Args:
+            latency (float): The duration of the request in seconds.
+        """
+        self.scheduler.on_success(latency)
+        self.consecutive_failures = 0
+        self.ejections = 0
+
+    def on_failure(self):
+        """
+        Record a transient failure, ejecting the endpoint after too many in a row.
+        """
+        self.scheduler.on_failure()
+
+        # Requests sent before the endpoint was ejected do not eject it again
+        if not self.is_available(time.monotonic()):
+            return
+
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= RPC_EJECTION_THRESHOLD:
+            self.eject()
+
+    def on_throttle(self, retry_after: Optional[float]):
+        """
+        Record a throttled request. Throttling endpoints are healthy, so they are not ejected.
+
+        Args:
+            retry_after (Optional[float]): The delay in seconds requested by the endpoint.
+        """
+        self.scheduler.on_throttle(retry_after)
+
+    def eject(self):
+        """
+        Stop routing requests to the endpoint until its ejection duration has passed.
+        """
+        duration = min(RPC_MAX_EJECTION_DURATION, RPC_EJECTION_DURATION * 2**self.ejections)
+        self.ejections += 1
+        self.consecutive_failures = 0
+        self.ejected_until = time.monotonic() + duration
+        logging.warning(f"Ejected RPC endpoint {self.url} for {duration:.0f}s")
+
+
+class EndpointPool:
+    def __init__(self, endpoints: List[Tuple[str, float]]):
+        """
+        Initialize the pool of RPC endpoints requests are spread across.
+
+        Args:
+            endpoints (List[Tuple[str, float]]): The url and weight of each endpoint.
+        """
+        self.endpoints = [Endpoint(url, weight) for url, weight in endpoints]
+
+    def pick(self, exclude: Optional[Endpoint] = None) -> Endpoint:
+        """
+        Pick the available endpoint with the fewest outstanding requests for its weight.
+
+        Args:
+            exclude (Optional[Endpoint]): An endpoint to avoid if any other is available,
+                such as the one a failed request was sent to.
+
+        Returns:
+            Endpoint: The endpoint to send the next request to.
+        """
+        if not self.endpoints:
+            raise ValueError("RPC_ENDPOINT not found in environment file")
+
+        now = time.monotonic()
+        available = [endpoint for endpoint in self.endpoints if endpoint.is_available(now)]
+        candidates = [endpoint for endpoint in available if endpoint is not exclude] or available
+
+        # When every endpoint is ejected, fall back to the one re-admitted first
+        if not candidates:
+            return min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)
+
+        return min(candidates, key=lambda endpoint: (endpoint.outstanding + 1) / endpoint.weight)
+
+    @asynccontextmanager
+    async def request(self, exclude: Optional[Endpoint] = None):
+        """
+        Route a single request to an endpoint, holding a slot of its scheduler for the
+        duration of the context.
+
+        Args:
+            exclude (Optional[Endpoint]): An endpoint to avoid if any other is available.
+
+        Yields:
+            Endpoint: The endpoint to send the request to.
+        """
+        endpoint = self.pick(exclude)
+        endpoint.outstanding += 1
+        try:
+            async with endpoint.scheduler.slot():
+                yield endpoint
+        finally:
+            endpoint.outstanding -= 1
+
+
+pool = EndpointPool(RPC_ENDPOINTS)
+
+metrics.register_gauge(
+    "requests_in_flight", lambda: sum(endpoint.scheduler.in_flight for endpoint in pool.endpoints)
+)
+metrics.register_gauge(
+    "requests_waiting", lambda: sum(len(endpoint.scheduler.waiters) for endpoint in pool.endpoints)
+)
+metrics.register_gauge(
+    "concurrency_limit", lambda: sum(int(endpoint.scheduler.limit) for endpoint in pool.endpoints)
+)
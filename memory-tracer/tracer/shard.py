@@ -0,0 +1,227 @@
+import os
+import shutil
+from typing import Dict, List, Tuple
+
+from tracer.aggregate import CallFrameAggregator
+from tracer.chain import get_transaction_counts
+from tracer.config import DATA_DIR, RPC_BATCH_SIZE
+from tracer.fs import (
+    FileType,
+    OutputFormat,
+    OutputOptions,
+    get_output_directory,
+    get_output_file_name,
+    get_output_path,
+    get_part_index,
+)
+from tracer.index import merge_indexes
+from tracer.pipeline import batch_stage, schedule_rpc_tasks
+
+
+def split_range(start_block: int, end_block: int, shards: int) -> List[Tuple[int, int]]:
+    """
+    Split a block range into contiguous sub-ranges of nearly equal size.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        shards (int): The number of sub-ranges to split the range into.
+
+    Returns:
+        List[Tuple[int, int]]: The inclusive `(start, end)` sub-ranges, in block order.
+            There are fewer sub-ranges than requested if the range has fewer blocks.
+    """
+    total_blocks = end_block - start_block + 1
+    shards = max(1, min(shards, total_blocks))
+
+    ranges = []
+    shard_start = start_block
+    for shard in range(shards):
+        size = total_blocks // shards + (shard < total_blocks % shards)
+        ranges.append((shard_start, shard_start + size - 1))
+        shard_start += size
+    return ranges
+
+
+async def get_block_offsets(start_block: int, end_block: int) -> Dict[int, int]:
+    """
+    Get the id of the first transaction of every block of a range.
+
+    Ids are numbered from 1 in block order, so that they do not depend on the order
+    blocks are fetched in, nor on which process fetches them.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+
+    Returns:
+        Dict[int, int]: The id of the first transaction of each block.
+    """
+    counts: Dict[int, int] = {}
+
+    async def task(block_numbers: List[int], session):
+        """
+        Task to count the transactions of a batch of blocks.
+
+        Args:
+            block_numbers (List[int]): The block numbers to count transactions for.
+            session: The session object for RPC calls.
+        """
+        block_counts = await get_transaction_counts(block_numbers, session)
+        counts.update(zip(block_numbers, block_counts))
+
+    block_range = range(start_block, end_block + 1)
+    await schedule_rpc_tasks(task=task, stage=batch_stage(block_range, RPC_BATCH_SIZE))
+
+    offsets = {}
+    next_id = 1
+    for block_number in block_range:
+        offsets[block_number] = next_id
+        next_id += counts[block_number]
+    return offsets
+
+
+def get_shards_directory(start_block: int, end_block: int) -> str:
+    """
+    Get the directory holding the outputs of the shards of a run until they are merged.
+
+    The shards are kept apart from the data directory, so that they are never mistaken
+    for, nor replace, a traced range of the same blocks.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+
+    Returns:
+        str: The path of the directory.
+    """
+    return os.path.join(DATA_DIR, f".shards_{start_block}_to_{end_block}")
+
+
+def get_merged_output_path(
+    start_block: int, end_block: int, file_type: FileType, options: OutputOptions
+) -> str:
+    """
+    Get the path of the merged output of a sharded run.
+
+    The segments of every shard are gathered into a single directory of part files,
+    which is read back like a chunked CSV or columnar dataset.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        options (OutputOptions): The options the output is written with.
+
+    Returns:
+        str: The path of the directory holding the merged part files.
+    """
+    if options.output_format == OutputFormat.CSV:
+        return get_output_file_name(start_block, end_block, file_type)
+    return get_output_path(start_block, end_block, file_type, options)
+
+
+def find_output_path(
+    start_block: int, end_block: int, file_type: FileType, options: OutputOptions
+) -> str:
+    """
+    Get the path of the finished output of a block range, traced in a single process
+    or in shards.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        file_type (FileType): The type of file.
+        options (OutputOptions): The options the output was written with.
+
+    Returns:
+        str: The path of the output.
+
+    Raises:
+        FileNotFoundError: If the range has no finished output.
+    """
+    for path in (
+        get_output_path(start_block, end_block, file_type, options),
+        get_merged_output_path(start_block, end_block, file_type, options),
+    ):
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(
+        f"No {file_type.value} output found for blocks {start_block}-{end_block}"
+    )
+
+
+def merge_shards(
+    start_block: int,
+    end_block: int,
+    shard_ranges: List[Tuple[int, int]],
+    options: OutputOptions,
+):
+    """
+    Merge the outputs of the shards of a run into the output of the whole range.
+
+    Segments are hard-linked (or copied where links are not supported) into a temporary
+    directory, and renamed so that they sort in block order. The directory is moved into
+    place once complete, and the directory of the shards is only removed once every
+    output, index and summary is merged, so an interrupted merge is simply run again.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        shard_ranges (List[Tuple[int, int]]): The block ranges of the shards, in block order.
+        options (OutputOptions): The options the shards were written with.
+    """
+    shards_directory = get_shards_directory(start_block, end_block)
+    for file_type in FileType:
+        merged_path = get_merged_output_path(start_block, end_block, file_type, options)
+        temp_path = f"{merged_path}.tmp"
+
+        # Start over, removing the output of a previous, interrupted merge
+        if os.path.isdir(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+
+        part_count = 0
+        # The number of the first merged part of each shard, to renumber its index
+        first_parts = []
+        for shard_start, shard_end in shard_ranges:
+            first_parts.append((shard_start, shard_end, part_count))
+            shard_path = get_output_path(
+                shard_start, shard_end, file_type, options, shards_directory
+            )
+            if os.path.isdir(shard_path):
+                segments = sorted(
+                    os.path.join(shard_path, part)
+                    for part in os.listdir(shard_path)
+                    if get_part_index(part) is not None
+                )
+            else:
+                segments = [shard_path]
+
+            for segment in segments:
+                extension = os.path.basename(segment).split(".", 1)[1]
+                part_file_name = os.path.join(temp_path, f"part-{part_count:05d}.{extension}")
+                try:
+                    os.link(segment, part_file_name)
+                except OSError:
+                    shutil.copyfile(segment, part_file_name)
+                part_count += 1
+
+        merge_indexes(start_block, end_block, file_type, first_parts, shards_directory)
+
+        # A directory cannot replace another one that is not empty
+        if os.path.isdir(merged_path):
+            shutil.rmtree(merged_path)
+        os.replace(temp_path, merged_path)
+
+    # Combine the statistics of the shards into those of the range
+    aggregator = CallFrameAggregator()
+    for shard_start, shard_end in shard_ranges:
+        aggregator.merge(
+            CallFrameAggregator.load(
+                get_output_directory(shard_start, shard_end, shards_directory)
+            )
+        )
+    aggregator.write_summary(get_output_directory(start_block, end_block), start_block, end_block)
+
+    shutil.rmtree(shards_directory)
@@ -0,0 +1,476 @@
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa  # type: ignore[import-untyped]
+import pyarrow.csv as pacsv  # type: ignore[import-untyped]
+
+from tracer.combine import iter_range_batches
+from tracer.config import EVM_WORD_SIZE, MEMORY_GAS_PER_WORD, QUADRATIC_DIVISOR
+from tracer.fs import FileType, get_output_directory
+
+# Columns of the call frames output read by the simulation
+SIMULATED_COLUMNS = [
+    "transaction_id",
+    "call_depth",
+    "pre_active_memory_size",
+    "post_active_memory_size",
+]
+
+# Row identifying the memory expansion of an instruction, repeated for each memory region
+# the instruction accesses: transaction id, call depth, pre and post memory sizes
+FrameKey = Tuple[int, int, int, int]
+
+
+def quadratic_cost(words: np.ndarray, divisor: int = QUADRATIC_DIVISOR) -> np.ndarray:
+    """
+    Get the gas of memory under the current schedule, linear with a quadratic term.
+
+    Args:
+        words (np.ndarray): The sizes of memory, in words.
+        divisor (int): The divisor of the quadratic term.
+
+    Returns:
+        np.ndarray: The gas of each size of memory.
+    """
+    return MEMORY_GAS_PER_WORD * words + np.floor(words * words / divisor)
+
+
+def linear_cost(words: np.ndarray, gas_per_word: float = MEMORY_GAS_PER_WORD) -> np.ndarray:
+    """
+    Get the gas of memory priced per word, without a quadratic term.
+
+    Args:
+        words (np.ndarray): The sizes of memory, in words.
+        gas_per_word (float): The gas of each word.
+
+    Returns:
+        np.ndarray: The gas of each size of memory.
+    """
+    return gas_per_word * words
+
+
+def fitted_cost(words: np.ndarray, coefficients: Tuple[float, ...]) -> np.ndarray:
+    """
+    Get the gas of memory priced per word in proportion to the measured time of accesses.
+
+    Each word costs the gas of the current schedule, scaled by how much slower accesses
+    to memory of the size are than to empty memory, according to the fitted polynomial.
+
+    Args:
+        words (np.ndarray): The sizes of memory, in words.
+        coefficients (Tuple[float, ...]): The coefficients of the polynomial of the time of
+            an access by size of memory in words, highest degree first.
+
+    Returns:
+        np.ndarray: The gas of each size of memory.
+    """
+    slowdown = np.maximum(np.polyval(coefficients, words) / coefficients[-1], 0)
+    return MEMORY_GAS_PER_WORD * words * slowdown
+
+
+@dataclass(frozen=True)
+class GasSchedule:
+    # Name of the schedule, prefixing its columns in the simulation outputs
+    name: str
+    # Gas of memory by size in words, which expanding memory costs the difference of
+    memory_cost: Callable[[np.ndarray], np.ndarray]
+
+
+# The current schedule, which the gas of the other schedules is compared to
+CURRENT_SCHEDULE = GasSchedule("quadratic", quadratic_cost)
+
+
+def fit_benchmark(file_name: str, degree: int = 1) -> Tuple[float, ...]:
+    """
+    Fit a polynomial to the time of memory accesses measured by the client benchmarks.
+
+    Args:
+        file_name (str): A results file of the client benchmarks, e.g.
+            `client-benchmarks/out/benchmark_results.csv`.
+        degree (int): The degree of the polynomial.
+
+    Returns:
+        Tuple[float, ...]: The coefficients of the polynomial of the time of an access in
+            nanoseconds, by size of memory in words, highest degree first.
+
+    Raises:
+        ValueError: If the file has too few measurements, or the time of accesses to empty
+            memory is not positive.
+    """
+    with open(file_name, newline="") as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader)]
+        rows = [dict(zip(header, row)) for row in reader if row]
+
+    if len(rows) <= degree:
+        raise ValueError(f"{file_name} has too few measurements to fit degree {degree}")
+
+    words = np.asarray([int(row["memory_size"]) for row in rows], dtype=np.float64) / EVM_WORD_SIZE
+    times = np.asarray([float(row["nsPerOp"]) for row in rows], dtype=np.float64)
+    coefficients = tuple(np.polyfit(words, times, degree).tolist())
+    if coefficients[-1] <= 0:
+        raise ValueError("The fitted time of accesses to empty memory is not positive")
+    return coefficients
+
+
+def parse_schedule(spec: str) -> GasSchedule:
+    """
+    Parse a gas schedule given on the command line.
+
+    Args:
+        spec (str): `quadratic[:<divisor>]`, `linear[:<gas per word>]`, or
+            `fitted:<benchmark results file>[:<degree>]`.
+
+    Returns:
+        GasSchedule: The gas schedule.
+
+    Raises:
+        ValueError: If the schedule is unknown.
+    """
+    kind, *params = spec.split(":")
+    if kind == "quadratic":
+        divisor = int(params[0]) if params else QUADRATIC_DIVISOR
+        return GasSchedule(f"quadratic_{divisor}", partial(quadratic_cost, divisor=divisor))
+    if kind == "linear":
+        gas_per_word = float(params[0]) if params else MEMORY_GAS_PER_WORD
+        return GasSchedule(
+            f"linear_{gas_per_word:g}", partial(linear_cost, gas_per_word=gas_per_word)
+        )
+    if kind == "fitted" and params:
+        degree = int(params[1]) if len(params) > 1 else 1
+        coefficients = fit_benchmark(params[0], degree)
+        name = os.path.splitext(os.path.basename(params[0]))[0]
+        return GasSchedule(f"fitted_{name}", partial(fitted_cost, coefficients=coefficients))
+    raise ValueError(f"Unknown gas schedule: {spec}")
+
+
+def get_expanding_rows(columns: Dict[str, np.ndarray], previous: Optional[FrameKey]) -> np.ndarray:
+    """
+    Select a single row of each instruction that expanded memory.
+
+    Instructions accessing several memory regions are written as consecutive rows with the
+    same sizes of memory. Consecutive instructions cannot have the same sizes when the
+    first one expanded memory, as the second one starts from the size the first one
+    expanded memory to, so repeated rows are those of the same instruction.
+
+    Args:
+        columns (Dict[str, np.ndarray]): The simulated columns of a batch of call frames.
+        previous (Optional[FrameKey]): The key of the row preceding the batch, if any.
+
+    Returns:
+        np.ndarray: The indices of the selected rows.
+    """
+    keys = [columns[name] for name in SIMULATED_COLUMNS]
+    expanding = columns["post_active_memory_size"] > columns["pre_active_memory_size"]
+
+    repeated = np.ones(len(expanding), dtype=bool)
+    for key in keys:
+        repeated[1:] &= key[1:] == key[:-1]
+    if len(repeated):
+        repeated[0] = previous == get_frame_key(columns, 0)
+    return np.flatnonzero(expanding & ~repeated)
+
+
+def get_frame_key(columns: Dict[str, np.ndarray], index: int) -> FrameKey:
+    """
+    Get the key of a row of a batch of call frames, see `get_expanding_rows`.
+
+    Args:
+        columns (Dict[str, np.ndarray]): The simulated columns of a batch of call frames.
+        index (int): The index of the row.
+
+    Returns:
+        FrameKey: The key of the row.
+    """
+    return tuple(int(columns[name][index]) for name in SIMULATED_COLUMNS)  # type: ignore
+
+
+def simulate_batch(
+    columns: Dict[str, np.ndarray],
+    previous: Optional[FrameKey],
+    schedules: List[GasSchedule],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Price the memory expansions of a batch of call frames under gas schedules, in a worker
+    process.
+
+    Args:
+        columns (Dict[str, np.ndarray]): The simulated columns of the batch.
+        previous (Optional[FrameKey]): The key of the row preceding the batch, if any.
+        schedules (List[GasSchedule]): The schedules to compare to the current one.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The ids of the transactions that expanded memory,
+            and for each the gas of memory expansion under the current schedule followed
+            by the gas and the difference with the current gas of every schedule.
+    """
+    rows = get_expanding_rows(columns, previous)
+    transaction_ids = columns["transaction_id"][rows]
+    pre_words = np.ceil(columns["pre_active_memory_size"][rows] / EVM_WORD_SIZE)
+    post_words = np.ceil(columns["post_active_memory_size"][rows] / EVM_WORD_SIZE)
+
+    current = CURRENT_SCHEDULE.memory_cost(post_words) - CURRENT_SCHEDULE.memory_cost(pre_words)
+    gas = [current]
+    for schedule in schedules:
+        schedule_gas = schedule.memory_cost(post_words) - schedule.memory_cost(pre_words)
+        gas += [schedule_gas, schedule_gas - current]
+
+    starts, sums = sum_runs(transaction_ids, np.stack(gas, axis=1))
+    return transaction_ids[starts], sums
+
+
+def sum_runs(keys: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the values of runs of equal keys.
+
+    Args:
+        keys (np.ndarray): The keys, with equal keys next to each other.
+        values (np.ndarray): The values, a row per key.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The index of the first key of each run, and the sum
+            of the values of the run.
+    """
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64), values
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return starts, np.add.reduceat(values, starts, axis=0)
+
+
+class BlockIndex:
+    def __init__(self, start_block: int, end_block: int):
+        """
+        Initialize the lookup of the blocks of transactions by id, from the first
+        transaction id of every block of a range.
+
+        The transactions of a block have consecutive ids, but blocks are given ids in the
+        order they are fetched in, which is not block order in unsharded and follow runs,
+        so blocks are sorted by their first id.
+
+        Args:
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+        """
+        first_ids = np.full(end_block - start_block + 1, np.iinfo(np.uint64).max, np.uint64)
+        for batch in iter_range_batches(start_block, end_block, FileType.TRANSACTION):
+            offsets = batch.column("block").to_numpy() - np.uint64(start_block)
+            np.minimum.at(first_ids, offsets.astype(np.int64), batch.column("id").to_numpy())
+
+        # Blocks without transactions are never looked up
+        blocks = np.flatnonzero(first_ids != np.iinfo(np.uint64).max)
+        first_ids = first_ids[blocks]
+        order = np.argsort(first_ids)
+        self.blocks = blocks[order]
+        self.first_ids = first_ids[order]
+
+    def get_block_offsets(self, transaction_ids: np.ndarray) -> np.ndarray:
+        """
+        Get the blocks of transactions.
+
+        Args:
+            transaction_ids (np.ndarray): The transaction ids.
+
+        Returns:
+            np.ndarray: The offset of the block of each transaction from the start block.
+        """
+        return self.blocks[np.searchsorted(self.first_ids, transaction_ids, side="right") - 1]
+
+
+class TransactionWriter:
+    def __init__(self, file_name: str, value_names: List[str]):
+        """
+        Initialize the writer of the sums of the values of the call frames of every
+        transaction to a CSV file, from the chunks of rows of the call frames output.
+
+        The rows of a transaction are next to each other, but may be split across chunks,
+        so the sums of the last transaction of a chunk are held back until the next one.
+
+        Args:
+            file_name (str): The path of the CSV file.
+            value_names (List[str]): The names of the summed columns.
+        """
+        self.schema = pa.schema(
+            [("transaction_id", pa.uint64()), ("block", pa.uint64())]
+            + [(name, pa.int64()) for name in value_names]
+        )
+        self.writer = pacsv.CSVWriter(file_name, self.schema)
+        self.pending: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def add(self, transaction_ids: np.ndarray, blocks: np.ndarray, values: np.ndarray):
+        """
+        Add a chunk of rows.
+
+        Args:
+            transaction_ids (np.ndarray): The transaction id of each row.
+            blocks (np.ndarray): The block of each row.
+            values (np.ndarray): The values of each row.
+        """
+        if not len(transaction_ids):
+            return
+
+        starts, sums = sum_runs(transaction_ids, values)
+        transaction_ids, blocks = transaction_ids[starts], blocks[starts]
+        if self.pending is not None:
+            pending_id, pending_block, pending_sums = self.pending
+            if pending_id[0] == transaction_ids[0]:
+                sums[0] += pending_sums[0]
+            else:
+                self.write(*self.pending)
+
+        self.write(transaction_ids[:-1], blocks[:-1], sums[:-1])
+        self.pending = (transaction_ids[-1:], blocks[-1:], sums[-1:])
+
+    def write(self, transaction_ids: np.ndarray, blocks: np.ndarray, values: np.ndarray):
+        """
+        Write the rows of complete transactions to the CSV file.
+
+        Args:
+            transaction_ids (np.ndarray): The transaction ids.
+            blocks (np.ndarray): The block of each transaction.
+            values (np.ndarray): The summed values of each transaction.
+        """
+        if not len(transaction_ids):
+            return
+        values = np.rint(values).astype(np.int64)
+        arrays = [pa.array(transaction_ids, pa.uint64()), pa.array(blocks, pa.uint64())]
+        arrays += [pa.array(values[:, index]) for index in range(values.shape[1])]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        """
+        Write the held back sums and close the CSV file.
+        """
+        if self.pending is not None:
+            self.write(*self.pending)
+        self.writer.close()
+
+
+def write_block_sums(file_name: str, start_block: int, value_names: List[str], sums: np.ndarray):
+    """
+    Write the sums of the values of the call frames of every block to a CSV file.
+
+    Args:
+        file_name (str): The path of the CSV file.
+        start_block (int): The number of the first block.
+        value_names (List[str]): The names of the summed columns.
+        sums (np.ndarray): The summed values of each block of the range, in order.
+    """
+    values = np.rint(sums).astype(np.int64)
+    arrays = [pa.array(np.arange(start_block, start_block + len(sums), dtype=np.uint64))]
+    arrays += [pa.array(values[:, index]) for index in range(values.shape[1])]
+    pacsv.write_csv(pa.table(arrays, names=["block"] + value_names), file_name)
+
+
+def iter_simulated_columns(start_block: int, end_block: int) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Read the columns of the call frames output of a block range used by the simulation.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+
+    Returns:
+        Iterator[Dict[str, np.ndarray]]: An iterator over batches of the columns.
+    """
+    for batch in iter_range_batches(start_block, end_block, FileType.CALL_FRAME):
+        if batch.num_rows:
+            yield {name: batch.column(name).to_numpy() for name in SIMULATED_COLUMNS}
+
+
+def simulate_range(
+    start_block: int,
+    end_block: int,
+    schedules: List[GasSchedule],
+    workers: Optional[int] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Re-price the memory expansions of a traced block range under alternative gas
+    schedules, and compare them to the current schedule.
+
+    The call frames output is streamed in batches, which are priced in parallel worker
+    processes and summed by transaction, so memory usage only grows with the number of
+    blocks of the range. The sums are written to `simulation_transactions.csv`, in the
+    order of the call frames output, and `simulation_blocks.csv`, and the totals to
+    `simulation.json`, in the output directory of the range.
+
+    Args:
+        start_block (int): The starting block number.
+        end_block (int): The ending block number.
+        schedules (List[GasSchedule]): The schedules to compare to the current one.
+        workers (Optional[int]): The number of worker processes, one per core by default.
+        on_progress (Optional[Callable[[int], None]]): Called with the number of call
+            frames simulated after every batch.
+
+    Returns:
+        Dict[str, Dict[str, float]]: The total gas of memory expansion under the current
+            schedule and every other schedule, with its difference to the current one.
+    """
+    workers = workers or os.cpu_count() or 1
+    output_directory = get_output_directory(start_block, end_block)
+    value_names = ["expansion_gas"]
+    for schedule in schedules:
+        value_names += [f"{schedule.name}_gas", f"{schedule.name}_delta"]
+
+    block_index = BlockIndex(start_block, end_block)
+    transaction_writer = TransactionWriter(
+        os.path.join(output_directory, "simulation_transactions.csv"), value_names
+    )
+    block_sums = np.zeros((end_block - start_block + 1, len(value_names)))
+    simulated = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Results are summed in submission order, with a bounded number of batches in
+        # flight so that memory use does not grow with the range.
+        pending: Deque[Future] = deque()
+        sizes: Deque[int] = deque()
+
+        def add_next():
+            nonlocal simulated
+            transaction_ids, gas = pending.popleft().result()
+            block_offsets = block_index.get_block_offsets(transaction_ids)
+            transaction_writer.add(transaction_ids, block_offsets + start_block, gas)
+            np.add.at(block_sums, block_offsets, gas)
+            simulated += sizes.popleft()
+            if on_progress:
+                on_progress(simulated)
+
+        previous: Optional[FrameKey] = None
+        for columns in iter_simulated_columns(start_block, end_block):
+            pending.append(executor.submit(simulate_batch, columns, previous, schedules))
+            sizes.append(len(columns["transaction_id"]))
+            previous = get_frame_key(columns, -1)
+            if len(pending) >= 2 * workers:
+                add_next()
+
+        while pending:
+            add_next()
+
+    transaction_writer.close()
+    write_block_sums(
+        os.path.join(output_directory, "simulation_blocks.csv"),
+        start_block,
+        value_names,
+        block_sums,
+    )
+
+    totals = block_sums.sum(axis=0)
+    current = float(totals[0])
+    summary = {CURRENT_SCHEDULE.name: {"gas": current, "delta": 0.0, "ratio": 1.0}}
+    for index, schedule in enumerate(schedules):
+        gas = float(totals[1 + 2 * index])
+        summary[schedule.name] = {
+            "gas": gas,
+            "delta": float(totals[2 + 2 * index]),
+            "ratio": gas / current if current else 1.0,
+        }
+    with open(os.path.join(output_directory, "simulation.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
@@ -0,0 +1,432 @@
+import asyncio
+import csv
+import io
+import os
+import queue
+import shutil
+import threading
+import zlib
+from typing import IO, Dict, List, Optional
+
+from tracer.config import DATA_DIR, INDEX_UNIT_SIZE, STREAM_BUFFER_SIZE, STREAM_QUEUE_SIZE
+from tracer.frames import CallFrameColumns, count_rows, format_csv_rows
+from tracer.fs import (
+    COMPRESSION_EXTENSIONS,
+    CSV_FIELDNAMES,
+    Compression,
+    FileType,
+    OutputOptions,
+    get_output_path,
+    get_part_index,
+)
+from tracer.index import IndexUnit, IndexWriter
+from tracer.metrics import metrics
+
+
+class GzipCompressor:
+    def __init__(self):
+        self.compressor = zlib.compressobj(wbits=31)
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress data into the current frame.
+        """
+        return self.compressor.compress(data)
+
+    def finish(self) -> bytes:
+        """
+        End the current gzip member. Data compressed afterwards starts a new member.
+        """
+        data = self.compressor.flush(zlib.Z_FINISH)
+        self.compressor = zlib.compressobj(wbits=31)
+        return data
+
+
+class ZstdCompressor:
+    def __init__(self):
+        import zstandard  # type: ignore[import-untyped]
+
+        self.context = zstandard.ZstdCompressor()
+        self.compressor = self.context.compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress data into the current frame.
+        """
+        return self.compressor.compress(data)
+
+    def finish(self) -> bytes:
+        """
+        End the current zstd frame. Data compressed afterwards starts a new frame.
+        """
+        data = self.compressor.flush()
+        self.compressor = self.context.compressobj()
+        return data
+
+
+class LZ4Compressor:
+    def __init__(self):
+        import lz4.frame  # type: ignore[import-untyped]
+
+        self.frame = lz4.frame
+        self.compressor = None
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress data into the current frame, starting a new frame if needed.
+        """
+        header = b""
+        if self.compressor is None:
+            self.compressor = self.frame.LZ4FrameCompressor()
+            header = self.compressor.begin()
+        return header + self.compressor.compress(data)
+
+    def finish(self) -> bytes:
+        """
+        End the current lz4 frame. Data compressed afterwards starts a new frame.
+        """
+        if self.compressor is None:
+            return b""
+        data = self.compressor.flush()
+        self.compressor = None
+        return data
+
+
+COMPRESSORS = {
+    Compression.GZIP: GzipCompressor,
+    Compression.ZSTD: ZstdCompressor,
+    Compression.LZ4: LZ4Compressor,
+}
+
+
+class StreamingOutputHandler:
+    # Message asking the writer thread to end the current frame and sync to disk
+    FLUSH = object()
+    # Message asking the writer thread to stop
+    CLOSE = object()
+
+    def __init__(
+        self,
+        start_block: int,
+        end_block: int,
+        file_type: FileType,
+        options: OutputOptions,
+        committed_position: Optional[List[int]] = None,
+        directory: str = DATA_DIR,
+    ):
+        """
+        Initialize the streaming handler instance for a specific file type.
+
+        Rows are rendered to CSV in memory and handed over to a background thread,
+        which compresses them and writes them to disk as they arrive. With a chunk size,
+        the output is rotated into a directory of chunk files that each start with the
+        CSV header.
+
+        Compression frames are ended every `INDEX_UNIT_SIZE` bytes of rows, and the rows of
+        each frame are indexed at the offset of the frame, which can be decompressed on
+        its own.
+
+        Args:
+            start_block (int): The starting block number.
+            end_block (int): The ending block number.
+            file_type (FileType): The type of file to handle (TRANSACTION or CALL_FRAME).
+            options (OutputOptions): The output options, with the compression to use.
+            committed_position (Optional[List[int]]): Resume existing output from the
+                `[chunk, offset]` position returned by `flush` at the last checkpoint.
+            directory (str): The directory holding the output directories of the ranges.
+        """
+        if file_type not in CSV_FIELDNAMES:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        if options.compression is None:
+            raise ValueError("Streaming output requires a compression")
+
+        self.start_block = start_block
+        self.end_block = end_block
+        self.file_type = file_type
+        self.compression = options.compression
+        self.chunk_size = options.chunk_size
+        self.output_path = get_output_path(start_block, end_block, file_type, options, directory)
+        self.header = ",".join(CSV_FIELDNAMES[file_type]).encode() + b"\n"
+
+        # Rows are rendered into this buffer before being handed to the writer thread
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(
+            self.buffer,
+            fieldnames=CSV_FIELDNAMES[file_type],
+            extrasaction="ignore",
+            lineterminator="\n",
+        )
+
+        self.compressor = COMPRESSORS[self.compression]()
+        self.chunk_index, offset = committed_position or [0, 0]
+        self.chunk_bytes = 0
+        # Offset of the current frame in the chunk, and the number of bytes compressed into it
+        self.frame_start = 0
+        self.frame_bytes = 0
+
+        self.index = IndexWriter(
+            start_block,
+            end_block,
+            file_type,
+            None if committed_position is None else (self.chunk_index, offset),
+            directory,
+        )
+        # Summary of the rows rendered into the buffer
+        self.unit = IndexUnit()
+
+        self.file = self.open_chunk(
+            self.chunk_index, offset, resume=committed_position is not None
+        )
+
+        # Rows are queued without blocking the event loop, which waits for the queue to
+        # have room again with `drain`
+        self.queue: queue.Queue = queue.Queue()
+        self.dequeued = threading.Condition()
+        metrics.register_gauge(f"{file_type.value}_write_queue", self.queue.qsize)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def get_chunk_file_name(self, index: int) -> str:
+        """
+        Get the path of a chunk file.
+
+        Args:
+            index (int): The index of the chunk.
+
+        Returns:
+            str: The path of the chunk file, or of the single output file without rotation.
+        """
+        if not self.chunk_size:
+            return self.output_path
+        extension = COMPRESSION_EXTENSIONS[self.compression]
+        return os.path.join(self.output_path, f"part-{index:05d}.csv.{extension}")
+
+    def open_chunk(self, index: int, offset: int, resume: bool) -> IO[bytes]:
+        """
+        Open a chunk file for writing.
+
+        Args:
+            index (int): The index of the chunk.
+            offset (int): The number of compressed bytes of the chunk to keep when resuming.
+            resume (bool): Keep the output covered by the checkpoint instead of starting over.
+
+        Returns:
+            IO[bytes]: The chunk file, positioned at the end of the kept output.
+        """
+        if not resume:
+            # Start over, removing the output of any previous run
+            if os.path.isdir(self.output_path):
+                shutil.rmtree(self.output_path)
+            elif os.path.exists(self.output_path):
+                os.remove(self.output_path)
+
+        directory = self.output_path if self.chunk_size else os.path.dirname(self.output_path)
+        os.makedirs(directory, exist_ok=True)
+
+        if self.chunk_size:
+            # Discard chunks that are not covered by the checkpoint
+            for part in os.listdir(self.output_path):
+                part_index = get_part_index(part)
+                if part_index is not None and part_index > index:
+                    os.remove(os.path.join(self.output_path, part))
+
+        file_name = self.get_chunk_file_name(index)
+        if resume and os.path.exists(file_name):
+            file = open(file_name, "r+b")
+            file.truncate(offset)
+            file.seek(offset)
+            # The uncompressed size of a resumed chunk is unknown, so it is
+            # approximated with its compressed size.
+            self.chunk_bytes = offset
+            self.frame_start = offset
+            self.frame_bytes = 0
+            return file
+
+        file = open(file_name, "wb")
+        file.write(self.compressor.compress(self.header))
+        self.chunk_bytes = len(self.header)
+        self.frame_start = 0
+        self.frame_bytes = len(self.header)
+        return file
+
+    def run(self):
+        """
+        Compress and write the queued data until the handler is closed.
+        """
+        while True:
+            message = self.queue.get()
+            try:
+                if self.error is None:
+                    self.process(message)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+                with self.dequeued:
+                    self.dequeued.notify_all()
+
+            if message is self.CLOSE:
+                return
+
+    def end_frame(self):
+        """
+        End the current compression frame, if any data was compressed into it.
+        """
+        if self.frame_bytes:
+            self.file.write(self.compressor.finish())
+        self.frame_start = self.file.tell()
+        self.frame_bytes = 0
+
+    @metrics.timed("compress")
+    def process(self, message):
+        """
+        Process a single message on the writer thread.
+
+        Args:
+            message (Tuple[bytes, IndexUnit] | object): Rendered CSV rows along with their
+                summary, or a FLUSH or CLOSE message.
+        """
+        if message is self.FLUSH or message is self.CLOSE:
+            self.end_frame()
+            self.file.flush()
+            if message is self.CLOSE:
+                self.file.close()
+            return
+
+        # Rotate to a new chunk at a row boundary once the chunk is full
+        if self.chunk_size and self.chunk_bytes >= self.chunk_size:
+            self.end_frame()
+            self.file.close()
+            self.chunk_index += 1
+            self.file = self.open_chunk(self.chunk_index, 0, resume=True)
+
+        data, unit = message
+        self.index.add_unit(self.chunk_index, self.frame_start, unit)
+        self.file.write(self.compressor.compress(data))
+        self.chunk_bytes += len(data)
+        self.frame_bytes += len(data)
+
+        if self.frame_bytes >= INDEX_UNIT_SIZE:
+            self.end_frame()
+
+    def raise_error(self):
+        """
+        Raise the error encountered by the writer thread, if any.
+        """
+        if self.error is not None:
+            raise self.error
+
+    def submit(self):
+        """
+        Hand the rendered rows over to the writer thread, without waiting for the queue
+        to have room.
+        """
+        data = self.buffer.getvalue()
+        if data:
+            self.queue.put_nowait((data.encode(), self.unit))
+            self.unit = IndexUnit()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+            # Callers without an event loop, such as replay, wait for room right away
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                self.wait_for_room()
+
+    def wait_for_room(self):
+        """
+        Block until the writer thread has brought the queue back under its size.
+        """
+        with self.dequeued:
+            self.dequeued.wait_for(lambda: self.queue.qsize() < STREAM_QUEUE_SIZE)
+
+    async def drain(self):
+        """
+        Wait for the writer thread to catch up once `STREAM_QUEUE_SIZE` buffers are
+        queued, so that rows are not rendered faster than they are compressed. The wait
+        runs on a worker thread, leaving the event loop free.
+        """
+        if self.queue.qsize() >= STREAM_QUEUE_SIZE:
+            await asyncio.get_running_loop().run_in_executor(None, self.wait_for_room)
+        self.raise_error()
+
+    async def wait_for_writes(self):
+        """
+        Wait for the writer thread to write every queued buffer, on a worker thread so that
+        the event loop is free. A `flush` right after only waits for the rows written since.
+        """
+        self.submit()
+        await asyncio.get_running_loop().run_in_executor(None, self.queue.join)
+        self.raise_error()
+
+    @metrics.timed("write")
+    def write(self, data: List[Dict[str, str]]):
+        """
+        Write a list of dictionaries to the compressed output.
+
+        Args:
+            data (List[Dict[str, str]]): The data to write to the file.
+        """
+        self.raise_error()
+        metrics.increment(f"{self.file_type.value}_rows", len(data))
+        self.unit.add_rows(self.file_type, data)
+        self.writer.writerows(data)
+        if self.buffer.tell() >= STREAM_BUFFER_SIZE:
+            self.submit()
+
+    @metrics.timed("write")
+    def write_columns(self, columns: CallFrameColumns):
+        """
+        Write call frame or frame columns to the compressed output in bulk.
+
+        Args:
+            columns (CallFrameColumns): The columns to write.
+        """
+        self.raise_error()
+        metrics.increment(f"{self.file_type.value}_rows", count_rows(columns))
+        self.unit.add_columns(columns)
+        self.buffer.write(format_csv_rows(columns, self.file_type))
+        if self.buffer.tell() >= STREAM_BUFFER_SIZE:
+            self.submit()
+
+    @metrics.timed("flush")
+    def flush(self) -> List[int]:
+        """
+        Write all pending rows, ending the current compression frame, along with the index
+        of the rows.
+
+        Returns:
+            List[int]: The `[chunk, offset]` position of the output written so far.
+        """
+        self.submit()
+        self.queue.put(self.FLUSH)
+        self.queue.join()
+        self.raise_error()
+        self.index.save()
+        return [self.chunk_index, self.file.tell()]
+
+    def close(self):
+        """
+        Stop the writer thread without writing the pending rows, which are discarded
+        when the output is resumed by a new handler.
+        """
+        self.queue.put(self.CLOSE)
+        self.thread.join()
+
+    def compress(self, delete_source=True):
+        """
+        Finish the output. Rows are compressed as they are written,
+        so this only writes the pending rows and stops the writer thread.
+        """
+        self.submit()
+        self.queue.put(self.CLOSE)
+        self.thread.join()
+        self.raise_error()
+        self.index.save()
+
+    def remove_source(self):
+        """
+        Streamed output has no uncompressed source to remove.
+        """